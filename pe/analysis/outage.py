@@ -0,0 +1,160 @@
+from datetime import datetime
+from typing import NamedTuple, Union
+import numpy as np
+
+NS_PER_SECOND = 1_000_000_000
+
+
+class Outage(NamedTuple):
+    """
+    A window in which the client could not write
+    :param datetime start: The last successful write before the gap
+    :param datetime end: The first successful write after the gap
+    :param float duration: Length of the gap (s)
+    :param datetime degraded_start: When write throughput first dropped below
+        normal leading up to the gap
+    :param datetime degraded_end: When write throughput got back to normal
+        after the gap
+    """
+    start: datetime
+    end: datetime
+    duration: float
+    degraded_start: datetime
+    degraded_end: datetime
+
+    @property
+    def degraded_duration(self) -> float:
+        """
+        How long (s) throughput was below normal, including the gap itself
+        """
+        return (self.degraded_end - self.degraded_start).total_seconds()
+
+    def to_dict(self) -> dict:
+        """
+        A plain (JSON friendly) representation of this outage
+        """
+        return {
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "duration": self.duration,
+            "degraded_start": self.degraded_start.isoformat(),
+            "degraded_end": self.degraded_end.isoformat(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Outage":
+        """
+        Inverse of to_dict
+        """
+        return cls(
+            start=datetime.fromisoformat(data["start"]),
+            end=datetime.fromisoformat(data["end"]),
+            duration=data["duration"],
+            degraded_start=datetime.fromisoformat(data["degraded_start"]),
+            degraded_end=datetime.fromisoformat(data["degraded_end"]),
+        )
+
+    def __str__(self):
+        return (
+            f"Outage of {self.duration:.3f}s from {self.start} to {self.end} "
+            + f"(degraded for {self.degraded_duration:.3f}s)"
+        )
+
+
+def as_epoch_ns(times: np.ndarray) -> np.ndarray:
+    """
+    Views an array of datetime64 (any unit) or int64 epoch-ns as int64 epoch-ns
+    """
+    if np.issubdtype(times.dtype, np.datetime64):
+        times = times.astype("datetime64[ns]")
+    return np.asarray(times).view(np.int64)
+
+
+def to_local_time(times: np.ndarray) -> np.ndarray:
+    """
+    The client writes UTC timestamps while the logs of every component are in
+    local time. Shifts UTC write times onto the clock the logs use
+    :param np.ndarray times: datetime64 or int64 epoch-ns UTC timestamps
+    :returns: datetime64[ns] local timestamps
+    """
+    offset = datetime.now().astimezone().utcoffset()
+    offset_ns = int(offset.total_seconds() * NS_PER_SECOND) if offset else 0
+    return (as_epoch_ns(times) + offset_ns).view("datetime64[ns]")
+
+
+def find_outages(
+    times: np.ndarray,
+    period: Union[float, None] = None,
+    threshold: float = 3.0,
+    window: float = 1.0,
+    degraded_fraction: float = 0.5,
+) -> list[Outage]:
+    """
+    Finds every gap between successful writes that is longer than threshold
+    times the write period, along with the period of degraded throughput
+    around each one. Fully vectorized, so it stays fast on 10M+ writes
+    :param np.ndarray times: Sorted datetime64 or int64 epoch-ns timestamps of
+        successful writes
+    :param float period: The expected time between writes (s). Defaults to the
+        window divided by the median number of writes per window
+    :param float threshold: How many periods without a write count as an outage
+    :param float window: Width of the bins used to measure throughput (s)
+    :param float degraded_fraction: A bin with fewer writes than this fraction
+        of the median bin is considered degraded
+    :returns: The outages, in time order
+    """
+    epoch_ns = as_epoch_ns(times)
+    if len(epoch_ns) < 2:
+        return []
+    # Throughput per bin, and which bins fall short of normal
+    window_ns = int(window * NS_PER_SECOND)
+    first = epoch_ns[0]
+    counts = np.bincount((epoch_ns - first) // window_ns)
+    normal = np.median(counts)
+    degraded = counts < degraded_fraction * normal
+    healthy_bins = np.flatnonzero(~degraded)
+
+    if period is None:
+        period_ns = window_ns / max(normal, 1)
+    else:
+        period_ns = period * NS_PER_SECOND
+    gap_ixs = np.flatnonzero(np.diff(epoch_ns) > threshold * period_ns)
+    if len(gap_ixs) == 0:
+        return []
+
+    # Walk out from each gap through any degraded bins on either side
+    starts, ends = epoch_ns[gap_ixs], epoch_ns[gap_ixs + 1]
+    start_bins = (starts - first) // window_ns
+    end_bins = (ends - first) // window_ns
+    padded = np.concatenate(([-1], healthy_bins, [len(counts)]))
+    before = padded[np.searchsorted(healthy_bins, start_bins)]
+    after = padded[np.searchsorted(healthy_bins, end_bins) + 1]
+    degraded_starts = np.where(degraded[start_bins], first + (before + 1) * window_ns, starts)
+    degraded_ends = np.where(degraded[end_bins], first + after * window_ns, ends)
+
+    as_datetimes = lambda epochs: epochs.view("datetime64[ns]").astype("datetime64[us]").tolist()
+    return [
+        Outage(
+            start=start,
+            end=end,
+            duration=duration,
+            degraded_start=degraded_start,
+            degraded_end=degraded_end,
+        )
+        for start, end, duration, degraded_start, degraded_end in zip(
+            as_datetimes(starts),
+            as_datetimes(ends),
+            ((ends - starts) / NS_PER_SECOND).tolist(),
+            as_datetimes(degraded_starts),
+            as_datetimes(degraded_ends),
+        )
+    ]
+
+
+def biggest_outage(outages: list[Outage]) -> Outage:
+    """
+    The longest of the outages, which is taken to be the failover
+    """
+    if len(outages) == 0:
+        raise ValueError("The client never observed an outage")
+    return max(outages, key=lambda outage: outage.duration)
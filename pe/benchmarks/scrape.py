@@ -0,0 +1,110 @@
+"""
+Benchmarks scraping a large synthetic DEBUG level Patroni log.
+
+Run with `python -m pe.benchmarks.scrape --size-mb 1024`
+"""
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import click
+from pe.log_scraper.log_scraper import PatroniScraper
+
+# Each MiB of log is stamped one second after the last
+LOG_START = datetime(2023, 6, 20, 10, 0, 0)
+# Mostly noise, the way DEBUG logs are, with a few markers sprinkled in
+NOISE_LINES = [
+    "{stamp},345 DEBUG: Starting new HTTP connection (1): 127.0.0.1:2379\n",
+    '{stamp},346 DEBUG: http://127.0.0.1:2379 "GET /v2/machines HTTP/1.1" 200 0\n',
+    "{stamp},347 DEBUG: Converted retries value: 0 -> Retry(total=0, connect=None, read=None, redirect=0, status=None)\n",
+    "{stamp},348 DEBUG: API thread: 127.0.0.1 - - \"GET /cluster HTTP/1.1\" 200 - latency: 0.512 ms\n",
+    "{stamp},349 DEBUG: Writing pe1 to key /service/patroni-experiments/members/pe1 ttl=60\n",
+]
+MARKER_LINES = [
+    "{stamp},350 INFO: no action. I am (pe1), the leader with the lock\n",
+    "{stamp},351 INFO: received failover request with leader=pe1 candidate=pe2 scheduled_at=None\n",
+]
+
+
+def write_synthetic_log(path: str, size_mb: int):
+    """
+    Writes a log of (roughly) size_mb MiB made of DEBUG noise and markers,
+    one second of log per MiB
+    """
+    block = "".join(NOISE_LINES * 20 + MARKER_LINES)
+    block = block * max(1, (1 << 20) // len(block))
+    with open(path, "w") as fout:
+        for second in range(size_mb):
+            stamp = (LOG_START + timedelta(seconds=second)).strftime("%Y-%m-%d %H:%M:%S")
+            fout.write(block.replace("{stamp}", stamp))
+
+
+def naive_scrape(scraper: PatroniScraper) -> int:
+    """
+    The original scraper: every marker tested against every line
+    """
+    found = 0
+    translations = scraper.get_translations()
+    with open(scraper.local_path) as fin:
+        for line in fin:
+            for marker, _ in translations:
+                if marker in line:
+                    datetime.strptime(line[:23], "%Y-%m-%d %H:%M:%S,%f")
+                    found += 1
+    return found
+
+
+@click.command()
+@click.option("--size-mb", default=1024, help="Size of the synthetic log (MiB)")
+def benchmark(size_mb: int):
+    """
+    Compares the compiled matcher with the original nested marker loop
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        scraper = PatroniScraper(os.path.join(folder, "patroni.log"), old=True)
+        print(f"Writing {size_mb} MiB synthetic log...")
+        write_synthetic_log(scraper.local_path, size_mb)
+
+        start = time.perf_counter()
+        naive_found = naive_scrape(scraper)
+        naive_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = len(scraper.scrape())
+        seconds = time.perf_counter() - start
+
+        # Measured on a separate run, since tracing slows allocations down
+        tracemalloc.start()
+        scraper.scrape()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert found == naive_found, f"Matchers disagree ({found} vs {naive_found})"
+        print(f"Naive:    {naive_seconds:.2f}s ({size_mb / naive_seconds:.1f} MiB/s)")
+        print(f"Compiled: {seconds:.2f}s ({size_mb / seconds:.1f} MiB/s)")
+        print(f"Speedup:  {naive_seconds / seconds:.1f}x over {found} events")
+        print(f"Peak memory while scraping: {peak / (1 << 20):.1f} MiB")
+
+        # A 30s window in the middle of the log, the way a failover is analyzed
+        middle = LOG_START + timedelta(seconds=size_mb // 2)
+        window = (middle, middle + timedelta(seconds=30))
+        pad = timedelta(seconds=5)
+        start = time.perf_counter()
+        windowed = scraper.scrape(window, pad)
+        windowed_seconds = time.perf_counter() - start
+        expected = [
+            event
+            for event in scraper.scrape()
+            if window[0] - pad <= event.timestamp < window[1] + pad
+        ]
+        assert windowed == expected, "Windowed scrape disagrees with a full scrape"
+        print(f"Windowed: {windowed_seconds:.3f}s for {len(windowed)} events in 40s of log")
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    benchmark()
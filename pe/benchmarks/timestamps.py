@@ -0,0 +1,90 @@
+"""
+Microbenchmarks the fixed layout timestamp parsers against strptime.
+
+Run with `python -m pe.benchmarks.timestamps --lines 1000000`
+"""
+import time
+from datetime import datetime, timedelta
+import click
+import numpy as np
+from pe.log_scraper.timestamps import haproxy_parser, patroni_parser, postgres_parser
+
+# (name, parser factory, strptime layout, line template, fraction digits, stamp start)
+FORMATS = [
+    (
+        "Patroni",
+        patroni_parser,
+        "%Y-%m-%d %H:%M:%S,%f",
+        "{} INFO: no action. I am (pe1), the leader with the lock\n",
+        3,
+        0,
+    ),
+    (
+        "Postgres",
+        postgres_parser,
+        "%Y-%m-%d %H:%M:%S.%f",
+        "{} UTC [42] LOG:  database system is ready to accept connections\n",
+        3,
+        0,
+    ),
+    (
+        "HAProxy",
+        haproxy_parser,
+        "%Y-%m-%dT%H:%M:%S.%f",
+        "<6>{}+00:00 haproxy[7]: Server patroni-experiments/pe1 is UP\n",
+        6,
+        3,
+    ),
+]
+
+
+def synthetic_lines(template: str, layout: str, fraction_digits: int, count: int) -> list[str]:
+    """
+    count log lines, 7ms apart, starting shortly before midnight so the date
+    and hour roll over
+    """
+    start = datetime(2023, 12, 31, 23, 59, 0)
+    return [
+        template.format(
+            (start + timedelta(milliseconds=7 * ix)).strftime(layout)[: 20 + fraction_digits]
+        )
+        for ix in range(count)
+    ]
+
+
+@click.command()
+@click.option("--lines", "count", default=1_000_000, help="Lines to parse per format")
+def benchmark(count: int):
+    """
+    Compares strptime, the fixed layout parser and its NumPy batch mode
+    """
+    for name, make_parser, layout, template, fraction_digits, start in FORMATS:
+        lines = synthetic_lines(template, layout, fraction_digits, count)
+        width = 20 + fraction_digits
+
+        begin = time.perf_counter()
+        expected = [datetime.strptime(line[start : start + width], layout) for line in lines]
+        strptime_seconds = time.perf_counter() - begin
+
+        parser = make_parser()
+        begin = time.perf_counter()
+        parsed = [parser.parse(line) for line in lines]
+        parse_seconds = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        batch = parser.parse_many(lines)
+        batch_seconds = time.perf_counter() - begin
+
+        assert parsed == expected, f"{name} parser disagrees with strptime"
+        assert np.array_equal(
+            batch, np.array(expected, dtype="datetime64[ns]").view(np.int64)
+        ), f"{name} batch parser disagrees with strptime"
+        print(
+            f"{name:8} strptime {strptime_seconds:.2f}s, "
+            + f"parse {parse_seconds:.2f}s ({strptime_seconds / parse_seconds:.1f}x), "
+            + f"parse_many {batch_seconds:.2f}s ({strptime_seconds / batch_seconds:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,105 @@
+"""
+Benchmarks the wire format (pe/wire.py) against the jsonpickle encoding the
+agent payloads used to be sent in: encode and decode time, and size on the
+wire. jsonpickle is only needed for the comparison.
+
+Run with `python -m pe.benchmarks.wire --events 10000`
+"""
+import json
+import time
+from datetime import datetime, timedelta
+import click
+from pe import wire
+from pe.config.parse import TopologyConfig
+from pe.log_scraper.log_scraper import Event
+
+try:
+    import jsonpickle
+except ImportError:
+    jsonpickle = None
+
+TOPOLOGY_PATH = "config/topology.example.yml"
+
+
+def synthetic_timeline(count: int) -> list[Event]:
+    """
+    count scraped events, 7ms apart
+    """
+    start = datetime(2023, 6, 20, 10, 0, 0)
+    raw = "2023-06-20 10:00:00,000 INFO: no action. I am (pe1), the leader with the lock\n"
+    return [
+        Event(start + timedelta(milliseconds=7 * ix), raw, "First heartbeat as leader")
+        for ix in range(count)
+    ]
+
+
+def measure(encode, decode, repeat: int) -> tuple[float, float, int]:
+    """
+    :returns: (encode s, decode s) per call, and the encoded size (bytes)
+    """
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        body = encode()
+    encode_seconds = (time.perf_counter() - begin) / repeat
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        decode(body)
+    decode_seconds = (time.perf_counter() - begin) / repeat
+    return encode_seconds, decode_seconds, len(body.encode())
+
+
+@click.command()
+@click.option("--events", "count", default=10_000, help="Events in the timeline")
+@click.option("--repeat", default=20, help="Times each encode/decode is run")
+def benchmark(count: int, repeat: int):
+    """
+    Compares both encodings of a topology and a timeline, as sent in a request
+    """
+    topology = TopologyConfig(TOPOLOGY_PATH)
+    timeline = synthetic_timeline(count)
+
+    decoded = TopologyConfig.from_dict(wire.decode("topology", wire.encode("topology", topology.to_dict())))
+    assert decoded.nodes == topology.nodes and decoded.proxy == topology.proxy
+    events = wire.decode("timeline", wire.encode("timeline", [event.to_dict() for event in timeline]))
+    assert [Event.from_dict(event) for event in events] == timeline
+
+    payloads = {
+        "topology": (
+            lambda: json.dumps({"topology": wire.encode("topology", topology.to_dict())}),
+            lambda body: TopologyConfig.from_dict(wire.decode("topology", json.loads(body)["topology"])),
+            lambda: json.dumps({"topology": jsonpickle.encode(topology)}),
+            lambda body: jsonpickle.decode(json.loads(body)["topology"]),
+        ),
+        f"timeline ({count} events)": (
+            lambda: json.dumps(wire.encode("timeline", [event.to_dict() for event in timeline])),
+            lambda body: [
+                Event.from_dict(event) for event in wire.decode("timeline", json.loads(body))
+            ],
+            lambda: jsonpickle.encode(timeline),
+            lambda body: jsonpickle.decode(body),
+        ),
+    }
+    for name, (encode, decode, pickle_encode, pickle_decode) in payloads.items():
+        encode_seconds, decode_seconds, size = measure(encode, decode, repeat)
+        print(
+            f"{name}: wire encode {encode_seconds * 1e3:.3f}ms, "
+            + f"decode {decode_seconds * 1e3:.3f}ms, {size} bytes"
+        )
+        if jsonpickle == None:
+            continue
+        pickle_encode_seconds, pickle_decode_seconds, pickle_size = measure(
+            pickle_encode, pickle_decode, repeat
+        )
+        print(
+            f"{name}: jsonpickle encode {pickle_encode_seconds * 1e3:.3f}ms "
+            + f"({pickle_encode_seconds / encode_seconds:.1f}x), "
+            + f"decode {pickle_decode_seconds * 1e3:.3f}ms "
+            + f"({pickle_decode_seconds / decode_seconds:.1f}x), "
+            + f"{pickle_size} bytes ({pickle_size / size:.1f}x)"
+        )
+    if jsonpickle == None:
+        print("Install jsonpickle to compare against it")
+
+
+if __name__ == "__main__":
+    benchmark()
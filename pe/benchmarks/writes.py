@@ -0,0 +1,68 @@
+"""
+Measures the throughput the data generator achieves in each write mode
+against a running database, compared with the rate it was asked for.
+
+Run with `python -m pe.benchmarks.writes --host 127.0.0.1 --port 5432 --rate 100`
+"""
+import time
+import tracemalloc
+import click
+from pe.data_generator.data_generator import WRITE_MODES, DataGenerator
+
+TABLE_NAME = "dg_benchmark"
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Host of the database (or proxy)")
+@click.option("--port", default=5432, help="Port of the database (or proxy)")
+@click.option("--rate", default=100.0, help="MiB written per second (across all clients)")
+@click.option("--clients", default=1, help="Number of concurrent writing clients")
+@click.option("--rows-per-tick", default=1, help="Rows each client writes per tick")
+@click.option("--seconds", default=5.0, help="How long to write in each mode (s)")
+def benchmark(host: str, port: int, rate: float, clients: int, rows_per_tick: int, seconds: float):
+    """
+    Writes for a few seconds in every write mode, and reports the achieved
+    throughput, and the memory allocated by a single write
+    """
+    for mode in WRITE_MODES:
+        dg = DataGenerator(
+            host,
+            port,
+            rate=rate,
+            table_name=TABLE_NAME,
+            clients=clients,
+            write_mode=mode,
+            rows_per_tick=rows_per_tick,
+            open_loop=True,
+        )
+        dg.reset()
+        dg.start_writing()
+        time.sleep(seconds)
+        dg.stop_writing()
+        report = dg.get_throughput_report()
+
+        # One more write on its own, to see what it allocates beyond the payload
+        client = dg.clients[0]
+        client.block_for_writable_connection()
+        client.write()
+        tracemalloc.start()
+        client.write()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        client.conn.close()
+        client.conn = None
+
+        print(
+            f"{mode:6} achieved {report.achieved:.1f} of {report.requested:.1f} MiB/s "
+            + f"({100 * report.achieved / report.requested:.0f}%), "
+            + f"{peak / 1024:.1f} KiB allocated per write "
+            + f"(payload {dg.payload_size * rows_per_tick / 1024:.0f} KiB)"
+        )
+        with dg.conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+        dg.conn.commit()
+        dg.conn.close()
+
+
+if __name__ == "__main__":
+    benchmark()
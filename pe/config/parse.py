@@ -50,6 +50,33 @@ class NodeConfig(AgentConfig):
             ("pg_port", str(self.pg_port)),
         ] + super().replacements
 
+    def to_dict(self) -> dict:
+        """
+        A plain (JSON friendly) representation of this node
+        """
+        return {
+            "name": self.name,
+            "host": self.host,
+            "api_port": self.api_port,
+            "patroni_port": self.patroni_port,
+            "etcd_port": self.etcd_port,
+            "pg_port": self.pg_port,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "NodeConfig":
+        """
+        Inverse of to_dict (also reads a node from the topology yaml)
+        """
+        return cls(
+            name=data["name"],
+            host=data["host"],
+            api_port=data["api_port"],
+            patroni_port=data["patroni_port"],
+            etcd_port=data["etcd_port"],
+            pg_port=data["pg_port"]
+        )
+
 @dataclass
 class ProxyConfig(AgentConfig):
     """
@@ -67,6 +94,29 @@ class ProxyConfig(AgentConfig):
             ("proxy_port", str(self.proxy_port)),
         ] + super().replacements 
 
+    def to_dict(self) -> dict:
+        """
+        A plain (JSON friendly) representation of this proxy
+        """
+        return {
+            "name": self.name,
+            "host": self.host,
+            "api_port": self.api_port,
+            "proxy_port": self.proxy_port,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ProxyConfig":
+        """
+        Inverse of to_dict (also reads the proxy from the topology yaml)
+        """
+        return cls(
+            name=data["name"],
+            host=data["host"],
+            api_port=data["api_port"],
+            proxy_port=data["proxy_port"],
+        )
+
 @dataclass
 class TopologyConfig:
     """
@@ -76,20 +126,33 @@ class TopologyConfig:
     def __init__(self, file_path):
         with open(os.path.join(ROOT_DIR, file_path), "r") as fin:
             config = yaml.safe_load(fin)
-        self.nodes = [NodeConfig(
-            name=node["name"],
-            host=node["host"],
-            api_port=node["api_port"],
-            patroni_port=node["patroni_port"],
-            etcd_port=node["etcd_port"],
-            pg_port=node["pg_port"]
-        ) for node in config["nodes"]]
-        self.proxy = ProxyConfig(
-            name=config["proxy"]["name"],
-            host=config["proxy"]["host"],
-            api_port=config["proxy"]["api_port"],
-            proxy_port=config["proxy"]["proxy_port"],
-        )
+        self.nodes = [NodeConfig.from_dict(node) for node in config["nodes"]]
+        self.proxy = ProxyConfig.from_dict(config["proxy"])
+
+    def to_dict(self) -> dict:
+        """
+        A plain (JSON friendly) representation of this topology, in the same
+        shape as the topology yaml
+        """
+        return {
+            "nodes": [node.to_dict() for node in self.nodes],
+            "proxy": self.proxy.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TopologyConfig":
+        """
+        Inverse of to_dict
+        :raises ConfigParseError: If data isn't a topology
+        """
+        # Skips __init__, which reads from a file
+        topology = cls.__new__(cls)
+        try:
+            topology.nodes = [NodeConfig.from_dict(node) for node in data["nodes"]]
+            topology.proxy = ProxyConfig.from_dict(data["proxy"])
+        except (KeyError, TypeError) as e:
+            raise ConfigParseError(f"Improper topology {data}") from e
+        return topology
 
     def __str__(self):
         nodes_str = ""
@@ -1,81 +1,432 @@
+from array import array
 from threading import Thread
-from typing import Union
+from typing import Literal, NamedTuple, Union
+import heapq
+import struct
 import time
 from datetime import datetime
 import json
+import numpy as np
+import psycopg
 import psycopg2
 import os
+from psycopg.adapt import Dumper
+from psycopg.postgres import types as pg_types
+from psycopg.pq import Format
+from pe.data_generator.journal import ACKED, FAILED, UNKNOWN, Journal, JournalReport, reconcile
+from pe.data_generator.histogram import LatencyReport, WindowedHistogram
+from pe.data_generator.schedule import ScheduleLog, ScheduleReport
 from pe.utils import ROOT_DIR
 
+MIB = 1 << 20
+# Rows fetched per round trip when streaming results back
+FETCH_CHUNK = 100000
+
+# How each tick's rows get to the database
+# insert: one execution of the prepared insert per row (pipelined together)
+# batch: a single prepared multi-row INSERT
+# copy: a single binary COPY ... FROM STDIN
+WriteMode = Literal["insert", "batch", "copy"]
+WRITE_MODES = ["insert", "batch", "copy"]
+# Postgres takes at most this many bind parameters per statement (its wire
+# protocol counts them in 16 bits)
+MAX_BIND_PARAMS = 65535
+# Bind parameters per row of a batch insert: (time, seq, client_id, payload)
+BATCH_ROW_PARAMS = 4
+
+# Binary COPY framing: signature, flags and header extension length, then
+# each tuple's field count, and -1 fields to end the data
+COPY_HEADER = b"PGCOPY\n\xff\r\n\0" + struct.pack("!ii", 0, 0)
+COPY_TRAILER = struct.pack("!h", -1)
+# A tuple up to its payload: (time, seq, client_id) as (length, value)s,
+# then the payload's length
+COPY_ROW = struct.Struct("!hiqiqiii")
+# Where time and seq sit within a tuple
+COPY_TIME_OFFSET = 6
+COPY_SEQ_OFFSET = 18
+# Postgres counts timestamps in microseconds from 2000-01-01
+PG_EPOCH_US = 946_684_800 * 1_000_000
+
+
+def connect_writable(proxy_host: str, proxy_port: int, connect=psycopg2.connect):
+    """
+    A helper function which blocks until it's able to establish a
+    connection to the database that is writable. Useful because during
+    the recovery process the new leader spends time in a read-only state
+    before continuing back to normal.
+    :param connect: How to connect, psycopg2.connect or psycopg.connect
+    """
+    DELAY = 0.1
+    conn = None
+    while conn == None:
+        try:
+            conn = connect(
+                            dbname="postgres",
+                            host=proxy_host,
+                            user="postgres",
+                            password="password",
+                            port=proxy_port)
+        except:
+            pass
+        if conn == None:
+            time.sleep(DELAY)
+        if conn and (getattr(conn, "readonly", None) or getattr(conn, "read_only", None)):
+            conn.close()
+            conn = None
+            time.sleep(DELAY)
+    return conn
+
+
+class Payload:
+    """
+    The JSON payload, encoded once and bound as is on every write
+    :param bytes data: The encoded JSON
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+class PayloadDumper(Dumper):
+    """
+    Sends a Payload as a binary json parameter. json's binary format is just
+    its text, so the pre-encoded bytes go out untouched
+    """
+    format = Format.BINARY
+    oid = pg_types["json"].oid
+
+    def dump(self, obj: Payload) -> bytes:
+        return obj.data
+
+
+def biggest_gap(times: list[float]) -> tuple[float, float]:
+    """
+    Finds the largest gap between two consecutive (sorted) timestamps
+    :param list[float] times: Sorted epoch timestamps (s)
+    :returns: (start, end) of the largest gap
+    """
+    if len(times) < 2:
+        raise ValueError("Need at least two writes to find a gap")
+    gap_ix = max(range(len(times) - 1), key=lambda ix: times[ix + 1] - times[ix])
+    return (times[gap_ix], times[gap_ix + 1])
+
+
+class OutageReport(NamedTuple):
+    """
+    The outage as observed by every client of a DataGenerator
+    :param tuple[datetime, datetime] outage: The window in which NO client
+        managed to write anything
+    :param list[tuple[datetime, datetime]] client_outages: The biggest gap
+        each individual client observed, indexed by client id
+    """
+    outage: tuple[datetime, datetime]
+    client_outages: list[tuple[datetime, datetime]]
+
+    @property
+    def duration(self) -> float:
+        """
+        How long (s) the merged outage lasted
+        """
+        return (self.outage[1] - self.outage[0]).total_seconds()
+
+    @property
+    def recovery_spread(self) -> float:
+        """
+        How long (s) it took between the first and the last client writing
+        again after the outage. Gives a sense of how the reconnect stampede
+        is absorbed
+        """
+        recoveries = [end for _, end in self.client_outages]
+        return (max(recoveries) - min(recoveries)).total_seconds()
+
+    def __str__(self):
+        durations = sorted(
+            (end - start).total_seconds() for start, end in self.client_outages
+        )
+        return (
+            f"Clients: {len(self.client_outages)}\n"
+            + f"Outage (no client writing): {self.duration:.3f}s\n"
+            + f"Per-client outage (min/median/max): {durations[0]:.3f}s / "
+            + f"{durations[len(durations) // 2]:.3f}s / {durations[-1]:.3f}s\n"
+            + f"Recovery spread across clients: {self.recovery_spread:.3f}s\n"
+        )
+
+
+class ThroughputReport(NamedTuple):
+    """
+    How much data the generator managed to push compared to what it was
+    asked for
+    :param float requested: The configured rate (MiB/s)
+    :param float achieved: Acknowledged payload bytes over the writing period (MiB/s)
+    :param float seconds: Length of the writing period (s)
+    """
+    requested: float
+    achieved: float
+    seconds: float
+
+    def __str__(self):
+        return (
+            f"Requested throughput: {self.requested:.2f} MiB/s\n"
+            + f"Achieved throughput: {self.achieved:.2f} MiB/s "
+            + f"({100 * self.achieved / self.requested:.1f}% over {self.seconds:.1f}s)\n"
+        )
+
+
+class WriterClient():
+    """
+    A single client of the database, with its own connection and writing
+    thread. Records the (client side) timeline of writes that succeeded
+    :param DataGenerator generator: The generator driving this client
+    :param int client_id: Identifier for this client, stored with each row
+    """
+    def __init__(self, generator: "DataGenerator", client_id: int):
+        self.generator = generator
+        self.client_id = client_id
+        self.conn = None
+        self.writing_thread: Union[Thread, None] = None
+        # Epoch seconds of every acknowledged write
+        self.timeline = array("d")
+        # Payload bytes in acknowledged writes
+        self.bytes_written = 0
+        # Intended vs actual send times of acknowledged writes
+        self.schedule = ScheduleLog(generator.freq)
+        # Outcome of every attempted write, by sequence id
+        self.journal = Journal()
+        columns = f"{generator.table_name} (time, seq, client_id, payload)"
+        self.insert_sql = f"INSERT INTO {columns} VALUES (%s, %s, %s, %s)"
+        self.batch_sql = f"INSERT INTO {columns} VALUES " + ", ".join(
+            ["(%s, %s, %s, %s)"] * generator.rows_per_tick
+        )
+        self.copy_sql = f"COPY {columns} FROM STDIN (FORMAT BINARY)"
+        # The whole binary COPY stream of a tick, built once. Only the time
+        # and seq of each row are patched in before it's sent again
+        self.copy_buffer, self.copy_rows = self.make_copy_buffer()
+
+    def block_for_writable_connection(self):
+        """
+        Throws away the current connection (if any) and blocks until a
+        writable one is available. Every statement is prepared on its first
+        use (prepared statements only live as long as the session), and the
+        payload is bound as a parameter, so the server never lexes it
+        """
+        while True:
+            if self.conn:
+                self.conn.close()
+            self.conn = connect_writable(
+                self.generator.proxy_host, self.generator.proxy_port, connect=psycopg.connect
+            )
+            try:
+                self.conn.prepare_threshold = 0
+                self.conn.adapters.register_dumper(Payload, PayloadDumper)
+                self.conn.execute("SELECT 1")
+                self.conn.commit()
+                return
+            except psycopg.Error:
+                # Lost the connection before we could use it, try again
+                pass
+
+    def make_copy_buffer(self) -> tuple[bytearray, list[int]]:
+        """
+        Pre-encodes a tick's worth of rows as a binary COPY stream, so the
+        (possibly multi-MB) payload is never copied or re-formatted while
+        writing
+        :returns: The stream, and where each row starts in it
+        """
+        generator = self.generator
+        payload = generator.payload_bytes
+        row = COPY_ROW.pack(4, 8, 0, 8, 0, 4, self.client_id, len(payload)) + payload
+        starts = [len(COPY_HEADER) + ix * len(row) for ix in range(generator.rows_per_tick)]
+        buffer = bytearray(COPY_HEADER + row * generator.rows_per_tick + COPY_TRAILER)
+        return buffer, starts
+
+    def write(self):
+        """
+        Writes one tick's worth of rows (in a single transaction) using the
+        generator's write mode. The payload is always bound (or copied) as
+        the same pre-encoded bytes. The write is journaled under a new
+        sequence id, and its outcome recorded: a failure before committing
+        means it never landed, a failure while committing means we can't know
+        """
+        generator = self.generator
+        rows = generator.rows_per_tick
+        seq = self.journal.begin()
+        try:
+            with self.conn.cursor() as cur:
+                if generator.write_mode == "copy":
+                    stamp = time.time_ns() // 1000 - PG_EPOCH_US
+                    for start in self.copy_rows:
+                        struct.pack_into("!q", self.copy_buffer, start + COPY_TIME_OFFSET, stamp)
+                        struct.pack_into("!q", self.copy_buffer, start + COPY_SEQ_OFFSET, seq)
+                    with cur.copy(self.copy_sql) as copy:
+                        copy.write(self.copy_buffer)
+                else:
+                    params = (datetime.utcnow(), seq, self.client_id, generator.payload)
+                    if generator.write_mode == "insert":
+                        cur.executemany(self.insert_sql, [params] * rows)
+                    else:
+                        cur.execute(self.batch_sql, params * rows)
+        except Exception:
+            self.journal.resolve(seq, FAILED)
+            raise
+        try:
+            self.conn.commit()
+        except Exception:
+            self.journal.resolve(seq, UNKNOWN)
+            raise
+        self.journal.resolve(seq, ACKED)
+        self.bytes_written += generator.payload_size * rows
+
+    def writing_job(self):
+        """
+        The function run in the background to write at a constant rate.
+        Ticks are scheduled on the monotonic clock. When open loop, a tick that
+        fails (or is missed while reconnecting) is still owed, so after an
+        outage the writes that queued up are issued back to back until the
+        schedule is caught up. When closed loop, missed ticks are dropped
+        """
+        generator = self.generator
+        self.block_for_writable_connection()
+        began_end_at: Union[float, None] = None
+        next_tick = time.monotonic()
+        while generator.is_starting or generator.end_seconds != None:
+            now = time.monotonic()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+            elif not generator.open_loop:
+                next_tick = now
+            sent = time.monotonic()
+            attempted_at = time.time()
+            started_ns = time.perf_counter_ns()
+            try:
+                self.write()
+                generator.latencies.record(time.perf_counter_ns() - started_ns, attempted_at)
+                completed = time.monotonic()
+                self.timeline.append(time.time())
+                self.schedule.record(next_tick, sent, completed)
+                next_tick += generator.freq
+                if generator.end_seconds != None:
+                    if began_end_at == None:
+                        began_end_at = completed
+                    elif completed - began_end_at > generator.end_seconds:
+                        break
+            except Exception:
+                generator.latencies.record(time.perf_counter_ns() - started_ns, attempted_at)
+                self.block_for_writable_connection()
+        self.conn.close()
+        self.conn = None
+
+    def start_writing(self):
+        """
+        Starts this client's background writing job
+        """
+        self.writing_thread = Thread(target=self.writing_job)
+        self.writing_thread.start()
+
+    def join(self):
+        """
+        Waits for this client's writing job to finish
+        """
+        if self.writing_thread:
+            self.writing_thread.join()
+            self.writing_thread = None
+
+
 class DataGenerator():
     """
     A class that writes data to the database at regular
     intervals to test
     :param proxy_host: Host of the proxy
     :param proxy_port: Port of the proxy
-    :param freq=0.1: How often to write data (s)
-    :param rate=1.0: How many MiB to write per second
+    :param freq=0.1: How often each client writes data (s)
+    :param rate=1.0: How many MiB to write per second (across all clients)
     :table_name="dummy": Name of the table to store data in
+    :param clients=1: How many concurrent clients to write with. Each client
+        gets its own connection and thread, so failover is observed the way
+        a pool of independent writers would see it. NOTE: Make sure postgres
+        max_connections and HAProxy maxconn allow for this many clients.
+    :param write_mode="insert": How each tick's rows are sent (see WriteMode).
+        "batch" and "copy" send the whole tick as a single statement, which
+        keeps the primary under realistic WAL/replication pressure
+    :param rows_per_tick=1: How many rows each client writes per tick. The
+        data written per tick (freq * rate) is split evenly between them
+    :param open_loop=False: Should writes be issued on a fixed arrival schedule,
+        regardless of how long the previous ones took? Stalled writes then
+        build up a backlog the way real clients would, instead of hiding it
     """
-    def __init__(self, proxy_host: str, proxy_port: int, freq=0.1, rate=1.0, table_name="dummy"):
+    def __init__(
+        self,
+        proxy_host: str,
+        proxy_port: int,
+        freq=0.1,
+        rate=1.0,
+        table_name="dummy",
+        clients=1,
+        write_mode: WriteMode = "insert",
+        rows_per_tick=1,
+        open_loop=False,
+    ):
+        if clients < 1:
+            raise ValueError("Need at least one client to write data")
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode {write_mode}, expected one of {WRITE_MODES}")
+        if rows_per_tick < 1:
+            raise ValueError("Need to write at least one row per tick")
+        if write_mode == "batch" and rows_per_tick * BATCH_ROW_PARAMS > MAX_BIND_PARAMS:
+            raise ValueError(
+                f"A batch of {rows_per_tick} rows needs more than {MAX_BIND_PARAMS} bind parameters, "
+                f"write at most {MAX_BIND_PARAMS // BATCH_ROW_PARAMS} rows per tick or use copy"
+            )
         self.proxy_host = proxy_host
         self.proxy_port = proxy_port
         self.conn = self.block_for_writable_connection(initial=True)
         self.table_name = table_name
         self.create_table()
-        self.writing_thread: Union[Thread, None] = None
         self.is_starting = False
         self.end_seconds: Union[float, None] = None
         self.freq = freq
         self.rate = rate
-        self.payload = self.make_payload()
-    
-    def make_payload(self):
+        self.write_mode = write_mode
+        self.rows_per_tick = rows_per_tick
+        self.open_loop = open_loop
+        # Encoded once, and shared by every client
+        self.payload_bytes = self.make_payload(clients * rows_per_tick).encode()
+        self.payload = Payload(self.payload_bytes)
+        self.payload_size = len(self.payload_bytes)
+        self.started_at: Union[float, None] = None
+        self.stopped_at: Union[float, None] = None
+        # Latency of every attempted write (successful or not), shared by all clients
+        self.latencies = WindowedHistogram()
+        self.clients = [WriterClient(self, client_id) for client_id in range(clients)]
+
+    def make_payload(self, rows: int):
         """
         This function looks at the frequency and rate, and will
         construct a JSON object (in local directory) of the necessary
         size to ensure that we are transmitting rate MiB data / s
+        across all of the rows written in a tick
+        :param int rows: How many rows (across all clients) share each tick
         :returns: a json.dumps object which can be written during DB
         calls to obtain the desired rate
         """
-        size = self.freq * self.rate
+        size = self.freq * self.rate / rows
         dictionary = {
-            "a": "b" * int(size * int(1e6))
+            "a": "b" * int(size * MIB)
         }
         json_object = json.dumps(dictionary, indent=4)
         with open(os.path.join(ROOT_DIR, "data_generator", "payload.json"), "w") as outfile:
             outfile.write(json_object)
         return json_object
-    
+
     def block_for_writable_connection(self, initial=False):
         """
-        A helper function which blocks until it's able to establish a
-        connection to the database that is writable. Useful because during
-        the recovery process the new leader spends time in a read-only state
-        before continuing back to normal.
+        Blocks until this generator's own (setup and analysis) connection
+        is writable. Clients manage their own connections.
         """
-        DELAY = 0.1
         if not initial and self.conn:
             self.conn.close()
-        conn = None
-        while conn == None:
-            try:
-                conn = psycopg2.connect(
-                                database="postgres",
-                                host=self.proxy_host,
-                                user="postgres",
-                                password="password",
-                                port=self.proxy_port)
-            except:
-                pass
-            if conn == None:
-                time.sleep(DELAY)
-            if conn and conn.readonly:
-                conn.close()
-                conn = None
-                time.sleep(DELAY)
-        return conn
-    
+        return connect_writable(self.proxy_host, self.proxy_port)
+
     def reset(self):
         """
         Drops existing table and recreates it
@@ -85,7 +436,13 @@ class DataGenerator():
             DROP TABLE IF EXISTS {self.table_name};
             """)
         self.create_table()
-    
+        self.latencies = WindowedHistogram()
+        for client in self.clients:
+            client.timeline = array("d")
+            client.bytes_written = 0
+            client.schedule = ScheduleLog(self.freq)
+            client.journal = Journal()
+
     def create_table(self):
         """
         Creates a table to write data into with the given
@@ -96,82 +453,139 @@ class DataGenerator():
             CREATE TABLE IF NOT EXISTS {self.table_name} (
                 id SERIAL PRIMARY KEY,
                 time TIMESTAMP NOT NULL,
+                seq BIGINT NOT NULL DEFAULT 0,
+                client_id INTEGER NOT NULL DEFAULT 0,
                 payload JSON
             );
             """)
         self.conn.commit()
-    
-    def writing_job(self):
-        """
-        The function run in the background to write at a constant rate
-        """
-        began_end_at: Union[datetime, None] = None
-        while self.is_starting or self.end_seconds != None:
-            start_time = datetime.now()
-            try:
-                with self.conn.cursor() as cur:
-                    now = datetime.utcnow()
-                    now = str(now)
-                    cur.execute(f"""
-                    INSERT INTO {self.table_name} 
-                        (time, payload)
-                    VALUES 
-                        ('{now}', '{self.payload}')
-                    """)
-                self.conn.commit()
-                if self.end_seconds != None:
-                    if began_end_at == None:
-                        began_end_at = datetime.now()
-                    else:
-                        time_finishing = (datetime.now() - began_end_at).total_seconds()
-                        if time_finishing > self.end_seconds:
-                            self.end_seconds = None
-            except Exception:
-                self.conn = self.block_for_writable_connection()
-            end_time = datetime.now()
-            buffer_time = self.freq - (end_time - start_time).total_seconds()
-            if buffer_time > 0:
-                time.sleep(buffer_time)
-                
-    
+
     def start_writing(self):
         """
-        Starts the background data writing job
+        Starts the background data writing job on every client
         """
         self.is_starting = True
-        self.writing_thread = Thread(target=self.writing_job)
-        self.writing_thread.start()
-    
+        self.started_at = time.time()
+        self.stopped_at = None
+        for client in self.clients:
+            client.start_writing()
+
     def stop_writing(self):
         """
         Stops the background data writing job
         """
         self.is_starting = False
         self.end_seconds = None
-        if self.writing_thread:
-            self.writing_thread.join()
-            self.writing_thread = None
-    
+        for client in self.clients:
+            client.join()
+        self.stopped_at = time.time()
+
     def write_for_x_seconds_then_stop(self, x: float):
         """
-        Called after the failover happens, waits until it gets confirmation
-        on at least x seconds of writes and then stops the process
+        Called after the failover happens, waits until every client gets
+        confirmation on at least x seconds of writes and then stops the process
         """
         self.is_starting = None
         self.end_seconds = x
-        if self.writing_thread:
-            self.writing_thread.join()
-            self.writing_thread = None
+        for client in self.clients:
+            client.join()
+        self.end_seconds = None
+        self.stopped_at = time.time()
+
+    def get_outage_report(self) -> OutageReport:
+        """
+        After the writing job(s) are over, merges the timelines recorded by
+        each client into a single report of the outage
+        """
+        client_outages = []
+        for client in self.clients:
+            start, end = biggest_gap(client.timeline)
+            client_outages.append(
+                (datetime.fromtimestamp(start), datetime.fromtimestamp(end))
+            )
+        merged = list(heapq.merge(*[client.timeline for client in self.clients]))
+        start, end = biggest_gap(merged)
+        return OutageReport(
+            outage=(datetime.fromtimestamp(start), datetime.fromtimestamp(end)),
+            client_outages=client_outages,
+        )
+
+    def get_schedule_report(self) -> ScheduleReport:
+        """
+        After the writing job(s) are over, reports how far writes fell behind
+        their schedule, merged (worst case) across every client
+        """
+        return ScheduleReport.merge([client.schedule.report() for client in self.clients])
+
+    def get_latency_report(self, outage: Union[tuple[datetime, datetime], None] = None) -> LatencyReport:
+        """
+        After the writing job(s) are over, reports the write latency
+        percentiles before, during and after the failover
+        :param outage: The failover window, defaults to the outage observed
+            by the clients
+        """
+        if outage == None:
+            outage = self.get_outage_report().outage
+        return LatencyReport.of(self.latencies, outage)
+
+    def get_throughput_report(self) -> ThroughputReport:
+        """
+        After the writing job(s) are over, compares the achieved throughput
+        with the requested rate
+        """
+        if self.started_at == None:
+            raise ValueError("Nothing has been written yet")
+        stopped_at = self.stopped_at if self.stopped_at != None else time.time()
+        seconds = stopped_at - self.started_at
+        written = sum(client.bytes_written for client in self.clients)
+        return ThroughputReport(
+            requested=self.rate,
+            achieved=written / MIB / seconds,
+            seconds=seconds,
+        )
 
-    def get_successful_writes(self) -> list[datetime]:
+    def get_journal_report(self) -> JournalReport:
+        """
+        After the writing job(s) are over, reconciles what every client
+        believes happened to its writes against what is in the table, to
+        find lost, unexpectedly landed and duplicated writes
+        """
+        self.conn = self.block_for_writable_connection()
+        return reconcile(
+            self.conn,
+            self.table_name,
+            [client.journal for client in self.clients],
+            self.rows_per_tick,
+        )
+
+    def get_successful_writes(self) -> np.ndarray:
         """
         After the writing job(s) are over, checks which timestamps
-        actually made it to the DB
+        actually made it to the DB. The timestamps are streamed in fixed size
+        chunks through a server side cursor straight into a preallocated array,
+        so memory stays flat even for runs with millions of rows
+        :returns: A sorted datetime64[ns] array of the (UTC) write times
         """
         self.conn = self.block_for_writable_connection()
         with self.conn.cursor() as cur:
             cur.execute(f"""
-                SELECT "time" from {self.table_name};
+                SELECT count(*) from {self.table_name};
             """)
-            res = cur.fetchall()
-            return [row[0] for row in res]
+            total = cur.fetchone()[0]
+        result = np.empty(total, dtype=np.int64)
+        filled = 0
+        with self.conn.cursor(name="successful_writes") as cur:
+            cur.itersize = FETCH_CHUNK
+            cur.execute(f"""
+                SELECT (extract(epoch from "time") * 1000000)::bigint
+                FROM {self.table_name} ORDER BY "time";
+            """)
+            while filled < total:
+                rows = cur.fetchmany(FETCH_CHUNK)
+                if not rows:
+                    break
+                chunk = result[filled : filled + len(rows)]
+                chunk[:] = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(chunk))
+                filled += len(chunk)
+        self.conn.commit()
+        return result[:filled].view("datetime64[us]").astype("datetime64[ns]")
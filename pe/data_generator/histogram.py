@@ -0,0 +1,193 @@
+from array import array
+from datetime import datetime
+from threading import Lock
+from typing import NamedTuple, Union
+
+# Each power of two is split into 2^SUB_BUCKET_BITS linear sub-buckets, which
+# bounds the relative error of any recorded value to ~3%
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Enough buckets to hold any 64 bit value
+BUCKETS = SUB_BUCKETS + (64 - SUB_BUCKET_BITS) * SUB_BUCKETS
+REPORTED_PERCENTILES = [50.0, 99.0, 99.9]
+
+
+def bucket_index(value: int) -> int:
+    """
+    Maps a (non-negative) value to its log-linear bucket
+    """
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    if shift < 0:
+        return value
+    return SUB_BUCKETS + (shift << SUB_BUCKET_BITS) + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_upper_bound(index: int) -> int:
+    """
+    The largest value that maps to the given bucket
+    """
+    if index < SUB_BUCKETS:
+        return index
+    shift, sub_bucket = divmod(index - SUB_BUCKETS, SUB_BUCKETS)
+    return ((SUB_BUCKETS + sub_bucket + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    A compact, fixed size histogram of latencies (ns) with log-linear
+    buckets. Recording a value only bumps a counter, so no per-write
+    objects are kept around
+    """
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * BUCKETS))
+        self.total = 0
+        self.max = 0
+
+    def record(self, value: int):
+        """
+        Records a latency
+        :param int value: The latency (ns)
+        """
+        self.counts[bucket_index(value)] += 1
+        self.total += 1
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram"):
+        """
+        Adds the values recorded in other to this histogram
+        """
+        counts = self.counts
+        for ix, count in enumerate(other.counts):
+            if count:
+                counts[ix] += count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile: float) -> int:
+        """
+        The value (ns) below which the given percentage of latencies fall
+        :param float percentile: Between 0 and 100
+        """
+        if self.total == 0:
+            raise ValueError("Can't take the percentile of an empty histogram")
+        threshold = max(1, -(-self.total * percentile // 100))
+        seen = 0
+        for ix, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold:
+                return min(bucket_upper_bound(ix), self.max)
+        return self.max
+
+
+class WindowedHistogram:
+    """
+    Latency histograms kept per fixed wall-clock window, so the tail can be
+    compared before, during and after a failover. Safe to share between the
+    threads of every client
+    :param float window: Width of each window (s)
+    """
+
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self.windows: dict[int, LatencyHistogram] = {}
+        self.lock = Lock()
+
+    def record(self, value: int, at: float):
+        """
+        Records a latency
+        :param int value: The latency (ns)
+        :param float at: When the write was attempted (epoch s)
+        """
+        key = int(at // self.window)
+        with self.lock:
+            histogram = self.windows.get(key)
+            if histogram is None:
+                histogram = self.windows[key] = LatencyHistogram()
+            histogram.record(value)
+
+    def between(self, start: float, end: float) -> LatencyHistogram:
+        """
+        Merges every window whose midpoint falls in [start, end) into a single
+        histogram, so each window is counted in exactly one phase
+        :param float start: Epoch seconds
+        :param float end: Epoch seconds
+        """
+        result = LatencyHistogram()
+        with self.lock:
+            for key, histogram in self.windows.items():
+                midpoint = (key + 0.5) * self.window
+                if start <= midpoint < end:
+                    result.merge(histogram)
+        return result
+
+
+class LatencySummary(NamedTuple):
+    """
+    The percentiles of one phase of the experiment (ms)
+    """
+    writes: int
+    p50: float
+    p99: float
+    p999: float
+    max: float
+
+    @classmethod
+    def of(cls, histogram: LatencyHistogram) -> Union["LatencySummary", None]:
+        """
+        Summarizes a histogram, or None if nothing was recorded
+        """
+        if histogram.total == 0:
+            return None
+        p50, p99, p999 = [histogram.percentile(p) / 1e6 for p in REPORTED_PERCENTILES]
+        return cls(
+            writes=histogram.total, p50=p50, p99=p99, p999=p999, max=histogram.max / 1e6
+        )
+
+    def __str__(self):
+        return (
+            f"{self.writes} writes, p50 {self.p50:.2f}ms, p99 {self.p99:.2f}ms, "
+            + f"p99.9 {self.p999:.2f}ms, max {self.max:.2f}ms"
+        )
+
+
+class LatencyReport(NamedTuple):
+    """
+    Client-side write latencies before, during and after the failover
+    :param tuple[datetime, datetime] outage: The window used as "during"
+    """
+    outage: tuple[datetime, datetime]
+    before: Union[LatencySummary, None]
+    during: Union[LatencySummary, None]
+    after: Union[LatencySummary, None]
+
+    @classmethod
+    def of(
+        cls, histogram: WindowedHistogram, outage: tuple[datetime, datetime]
+    ) -> "LatencyReport":
+        """
+        Splits the windows of the histogram around the outage
+        :param WindowedHistogram histogram: Latencies of every write attempt
+        :param tuple[datetime, datetime] outage: The failover window
+        """
+        start, end = outage[0].timestamp(), outage[1].timestamp()
+        phases = [
+            LatencySummary.of(histogram.between(phase_start, phase_end))
+            for phase_start, phase_end in [
+                (float("-inf"), start),
+                (start, end),
+                (end, float("inf")),
+            ]
+        ]
+        return cls(outage, *phases)
+
+    def __str__(self):
+        return "".join(
+            f"Write latency {name} failover: {summary if summary else 'no writes'}\n"
+            for name, summary in [
+                ("before", self.before),
+                ("during", self.during),
+                ("after", self.after),
+            ]
+        )
@@ -0,0 +1,152 @@
+from array import array
+from typing import NamedTuple
+
+# Outcomes of a write, as stored in the journal
+PENDING = 0
+# Commit returned successfully
+ACKED = 1
+# The statement failed, so the transaction was never committed
+FAILED = 2
+# The connection dropped while committing, so the write may or may not have landed
+UNKNOWN = 3
+
+
+class Journal:
+    """
+    A client-side journal of every write a client attempts. Each write gets
+    the next sequence id (its index in the journal) and one byte recording
+    its outcome
+    """
+
+    def __init__(self):
+        self.outcomes = array("b")
+
+    def __len__(self):
+        return len(self.outcomes)
+
+    def begin(self) -> int:
+        """
+        Starts a new write
+        :returns: The write's sequence id
+        """
+        self.outcomes.append(PENDING)
+        return len(self.outcomes) - 1
+
+    def resolve(self, seq: int, outcome: int):
+        """
+        Records how a write ended
+        :param int seq: The write's sequence id
+        :param int outcome: One of ACKED, FAILED, UNKNOWN
+        """
+        self.outcomes[seq] = outcome
+
+    def count(self, outcome: int) -> int:
+        """
+        How many writes ended with the given outcome
+        """
+        return self.outcomes.count(outcome)
+
+
+class JournalReport(NamedTuple):
+    """
+    The result of reconciling the journals of every client against the rows
+    that actually landed in the table. Writes are identified by (client_id, seq)
+    :param int acked: Writes the database acknowledged
+    :param int failed: Writes that failed before committing
+    :param int unknown: Writes whose commit was interrupted
+    :param list[tuple[int, int]] lost: Acknowledged writes missing from the table
+    :param list[tuple[int, int]] unknown_landed: Unknown outcome writes that landed
+    :param list[tuple[int, int]] failed_landed: Failed writes that landed anyway
+    :param list[tuple[int, int]] duplicates: Writes that landed more than once,
+        or that no journal knows about
+    """
+    acked: int
+    failed: int
+    unknown: int
+    lost: list[tuple[int, int]]
+    unknown_landed: list[tuple[int, int]]
+    failed_landed: list[tuple[int, int]]
+    duplicates: list[tuple[int, int]]
+
+    def __str__(self):
+        return (
+            f"Writes acked/failed/unknown: {self.acked}/{self.failed}/{self.unknown}\n"
+            + f"Lost writes (acked but missing): {len(self.lost)} {self.lost[:10]}\n"
+            + f"Unknown outcome writes that landed: {len(self.unknown_landed)}\n"
+            + f"Failed writes that landed: {len(self.failed_landed)} {self.failed_landed[:10]}\n"
+            + f"Duplicated writes: {len(self.duplicates)} {self.duplicates[:10]}\n"
+        )
+
+
+def reconcile(conn, table_name: str, journals: list[Journal], rows_per_write: int) -> JournalReport:
+    """
+    Compares the journals against the table in a single set-based query. The
+    journals are shipped as arrays, joined against the rows grouped by write,
+    and only the writes that disagree come back
+    :param conn: A psycopg2 connection to the database
+    :param str table_name: The table the writes went to
+    :param list[Journal] journals: The journal of every client, indexed by client id
+    :param int rows_per_write: How many rows each write inserts
+    """
+    client_ids = array("i")
+    seqs = array("q")
+    outcomes = array("b")
+    for client_id, journal in enumerate(journals):
+        client_ids.extend([client_id] * len(journal))
+        seqs.extend(range(len(journal)))
+        outcomes.extend(journal.outcomes)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            WITH journal (client_id, seq, outcome) AS (
+                SELECT * FROM unnest(%s::integer[], %s::bigint[], %s::smallint[])
+            ), landed AS (
+                SELECT client_id, seq, count(*) AS n FROM {table_name}
+                GROUP BY client_id, seq
+            )
+            SELECT
+                coalesce(j.client_id, l.client_id),
+                coalesce(j.seq, l.seq),
+                j.outcome,
+                coalesce(l.n, 0)
+            FROM journal j FULL OUTER JOIN landed l
+                ON j.client_id = l.client_id AND j.seq = l.seq
+            WHERE
+                (j.outcome = %s AND coalesce(l.n, 0) < %s)
+                OR (j.outcome <> %s AND l.n > 0)
+                OR l.n > %s
+                OR j.seq IS NULL
+            ORDER BY 1, 2;
+            """,
+            (
+                client_ids.tolist(),
+                seqs.tolist(),
+                outcomes.tolist(),
+                ACKED,
+                rows_per_write,
+                ACKED,
+                rows_per_write,
+            ),
+        )
+        rows = cur.fetchall()
+    conn.commit()
+    lost, unknown_landed, failed_landed, duplicates = [], [], [], []
+    for client_id, seq, outcome, landed in rows:
+        write = (client_id, seq)
+        if outcome == None or landed > rows_per_write:
+            duplicates.append(write)
+        elif outcome == ACKED:
+            lost.append(write)
+        elif outcome == FAILED:
+            failed_landed.append(write)
+        else:
+            unknown_landed.append(write)
+    return JournalReport(
+        acked=sum(journal.count(ACKED) for journal in journals),
+        failed=sum(journal.count(FAILED) for journal in journals),
+        unknown=sum(journal.count(UNKNOWN) for journal in journals),
+        lost=lost,
+        unknown_landed=unknown_landed,
+        failed_landed=failed_landed,
+        duplicates=duplicates,
+    )
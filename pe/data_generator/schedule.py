@@ -0,0 +1,100 @@
+from array import array
+from typing import NamedTuple
+
+
+class ScheduleReport(NamedTuple):
+    """
+    How far the writes fell behind their arrival schedule. Every latency here
+    is measured from when the write SHOULD have been sent, so the writes that
+    queued up behind a stalled one are accounted for (coordinated omission
+    correction)
+    :param float corrected_downtime: Longest any single write waited between
+        its intended send time and being acknowledged (s)
+    :param float uncorrected_downtime: Longest gap between two consecutive
+        acknowledgements, which is all a closed loop client gets to see (s)
+    :param float recovery: Time between the first acknowledged write after the
+        outage and the backlog being drained (s)
+    :param float max_lag: Longest a write was sent after its intended time (s)
+    :param int max_backlog: Most ticks that were overdue at once
+    """
+    corrected_downtime: float
+    uncorrected_downtime: float
+    recovery: float
+    max_lag: float
+    max_backlog: int
+
+    @classmethod
+    def merge(cls, reports: list["ScheduleReport"]) -> "ScheduleReport":
+        """
+        Combines the reports of many clients into the worst case across them
+        """
+        return cls(
+            corrected_downtime=max(r.corrected_downtime for r in reports),
+            uncorrected_downtime=max(r.uncorrected_downtime for r in reports),
+            recovery=max(r.recovery for r in reports),
+            max_lag=max(r.max_lag for r in reports),
+            max_backlog=max(r.max_backlog for r in reports),
+        )
+
+    def __str__(self):
+        return (
+            f"Downtime (corrected for coordinated omission): {self.corrected_downtime:.3f}s\n"
+            + f"Downtime (uncorrected): {self.uncorrected_downtime:.3f}s\n"
+            + f"Time to drain backlog after recovery: {self.recovery:.3f}s\n"
+            + f"Worst send lag: {self.max_lag:.3f}s (backlog of {self.max_backlog} writes)\n"
+        )
+
+
+class ScheduleLog:
+    """
+    A compact record of when each acknowledged write was meant to be sent,
+    when it actually was, and when it completed. All times come from
+    time.monotonic()
+    :param float freq: The period of the arrival schedule (s)
+    """
+
+    def __init__(self, freq: float):
+        self.freq = freq
+        self.intended = array("d")
+        self.sent = array("d")
+        self.completed = array("d")
+        self.backlog = array("I")
+
+    def __len__(self):
+        return len(self.intended)
+
+    def record(self, intended: float, sent: float, completed: float):
+        """
+        Records an acknowledged write
+        :param float intended: When the write was scheduled to be sent
+        :param float sent: When the (successful attempt of the) write was sent
+        :param float completed: When the write was acknowledged
+        """
+        self.intended.append(intended)
+        self.sent.append(sent)
+        self.completed.append(completed)
+        self.backlog.append(max(0, int((sent - intended) // self.freq)))
+
+    def report(self) -> ScheduleReport:
+        """
+        Summarizes the log into a ScheduleReport
+        """
+        if len(self) == 0:
+            raise ValueError("No writes were recorded")
+        corrected = [c - i for i, c in zip(self.intended, self.completed)]
+        uncorrected = [
+            self.completed[ix + 1] - self.completed[ix] for ix in range(len(self) - 1)
+        ]
+        worst = max(range(len(corrected)), key=corrected.__getitem__)
+        # The backlog is drained once writes go out on time again
+        drained = worst
+        while drained < len(self) and self.sent[drained] - self.intended[drained] >= self.freq:
+            drained += 1
+        drained = min(drained, len(self) - 1)
+        return ScheduleReport(
+            corrected_downtime=corrected[worst],
+            uncorrected_downtime=max(uncorrected, default=0.0),
+            recovery=self.completed[drained] - self.completed[worst],
+            max_lag=max(s - i for i, s in zip(self.intended, self.sent)),
+            max_backlog=max(self.backlog),
+        )
@@ -6,3 +6,6 @@ class BootError(Exception):
 
 class ApiError(Exception):
     pass
+
+class FailoverError(Exception):
+    pass
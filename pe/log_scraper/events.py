@@ -46,13 +46,30 @@ GNL_EventType = Literal[
     "ready_for_writes"
 ]
 
+### HAPROXY EVENTS ###
+# Events about the old leader's server (HOL) and the new leader's (HNL)
+H_EventType = Literal[
+    "health_check_failed",
+    "health_check_succeeded",
+    "marked_up",
+    "marked_down",
+]
+
 # Common event stuff
 
-EventType = Union[POL_EventType, PNL_EventType, GOL_EventType, GNL_EventType]
+EventType = Union[POL_EventType, PNL_EventType, GOL_EventType, GNL_EventType, H_EventType]
+
+# How the matches of a marker become events:
+# - every: every match is an event
+# - after: every match once the anchor event has been seen
+# - first_after: only the first match after the anchor event
+# - last_before: only the last match before the anchor event
+# - dedupe: every match, except repeats of the last event
+Rule = Literal["every", "after", "first_after", "last_before", "dedupe"]
 
 class Event(NamedTuple):
     event: EventType
-    source: Literal["patroni", "postgres"]
+    source: Literal["patroni", "postgres", "haproxy"]
     timestamp: str
     readable: str
     marker: str
@@ -69,6 +86,8 @@ def Event2Dict(event: Event) -> "dict[str, Union[str, datetime]]":
 
 class PatroniEvent(Event):
     source = "patroni"
+    rule: Rule = "every"
+    anchor: Union[EventType, None] = None
 
 class POLFailoverReceived(PatroniEvent):
     event = "failover_received"
@@ -82,7 +101,7 @@ class POLCandidatePing(PatroniEvent):
 
 class POLDemoteSelf(PatroniEvent):
     event = "demote_self"
-    marker = "Demoting self (graceful)"
+    marker = "Demoting self"
     readable = "Demoting self"
 
 class POLKeyReleased(PatroniEvent):
@@ -130,6 +149,8 @@ class PNLLastFollow(PatroniEvent):
     event = "last_follow"
     marker = "a secondary, and following a leader"
     readable = "Last heartbeat as follower"
+    rule = "last_before"
+    anchor = "promote_self"
 
 class PNLWritingKeyToService(PatroniEvent):
     event = "writing_key_to_service"
@@ -155,6 +176,8 @@ class PNLFirstLead(PatroniEvent):
     event = "first_lead"
     marker = "the leader with the lock"
     readable = "First heartbeat as leader"
+    rule = "first_after"
+    anchor = "promote_self"
 
 PNLEvent = Union[
     PNLLastFollow,
@@ -177,6 +200,8 @@ PNLOrder = [
 
 class PostgresEvent(Event):
     source = "postgres"
+    rule: Rule = "every"
+    anchor: Union[EventType, None] = None
 
 class GOLReadyForWrites(PostgresEvent):
     event = "ready_for_writes"
@@ -201,7 +226,7 @@ class GOLRestarting(PostgresEvent):
 class GOLReadyForReads(PostgresEvent):
     event = "ready_for_reads"
     marker = "database system is ready to accept read-only connections"
-    readable = "DB ready for reads"
+    readable = "Node ready as replica. \nDB ready for reads"
 
 GOLEvent = Union[
     GOLReadyForWrites,
@@ -247,6 +272,8 @@ class GNLReadyForWrites(PostgresEvent):
     event = "ready_for_writes"
     marker = "database system is ready to accept connections"
     readable = "DB ready for writes"
+    rule = "after"
+    anchor = "new_timeline"
 
 GNLEvent = Union[
     GNLEnteringStandby,
@@ -261,4 +288,91 @@ GNLOrder = [
     GNLPromoteReceived,
     GNLNewTimeline,
     GNLReadyForWrites
-]
\ No newline at end of file
+]
+
+# HAProxy event classes, markers are formatted with the names of the old and
+# new leader's servers
+
+class HAProxyEvent(Event):
+    source = "haproxy"
+    rule: Rule = "every"
+    anchor: Union[EventType, None] = None
+
+class HOLHealthCheckFailed(HAProxyEvent):
+    event = "health_check_failed"
+    marker = "Health check for server patroni-experiments/{old_name} failed"
+    readable = "Proxy health check on old leader failed"
+
+class HOLHealthCheckSucceeded(HAProxyEvent):
+    event = "health_check_succeeded"
+    marker = "Health check for server patroni-experiments/{old_name} succeeded"
+    readable = "Proxy health check on old leader succeeded"
+
+class HOLMarkedUp(HAProxyEvent):
+    event = "marked_up"
+    marker = "Server patroni-experiments/{old_name} is UP"
+    readable = "Old leader marked as UP"
+
+class HOLMarkedDown(HAProxyEvent):
+    event = "marked_down"
+    marker = "Server patroni-experiments/{old_name} is DOWN"
+    readable = "Old leader marked as DOWN"
+
+class HNLHealthCheckFailed(HAProxyEvent):
+    event = "health_check_failed"
+    marker = "Health check for server patroni-experiments/{new_name} failed"
+    readable = "Proxy health check on new leader failed"
+
+class HNLHealthCheckSucceeded(HAProxyEvent):
+    event = "health_check_succeeded"
+    marker = "Health check for server patroni-experiments/{new_name} succeeded"
+    readable = "Proxy health check on new leader succeeded"
+
+class HNLMarkedUp(HAProxyEvent):
+    event = "marked_up"
+    marker = "Server patroni-experiments/{new_name} is UP"
+    readable = "New leader marked as UP"
+
+class HNLMarkedDown(HAProxyEvent):
+    event = "marked_down"
+    marker = "Server patroni-experiments/{new_name} is DOWN"
+    readable = "New leader marked as DOWN"
+
+# The events scraped from each log, in the order their markers are checked
+
+POLScraped = [
+    POLFailoverReceived,
+    POLCandidatePing,
+    POLDemoteSelf,
+    POLKeyReleased,
+    POLClosePGConn,
+    POLAcceptingConns,
+]
+PNLScraped = [
+    PNLLastFollow,
+    PNLCleanUp,
+    PNLPromoteSelf,
+    PNLClearRewindState,
+    PNLFirstLead,
+]
+GOLScraped = [
+    GOLShutdownReceived,
+    GOLShutdownComplete,
+    GOLReadyForReads,
+]
+GNLScraped = [
+    GNLReplicationTerminated,
+    GNLPromoteReceived,
+    GNLNewTimeline,
+    GNLReadyForWrites,
+]
+HAProxyScraped = [
+    HOLHealthCheckFailed,
+    HOLHealthCheckSucceeded,
+    HOLMarkedUp,
+    HOLMarkedDown,
+    HNLHealthCheckFailed,
+    HNLHealthCheckSucceeded,
+    HNLMarkedUp,
+    HNLMarkedDown,
+]
@@ -1,8 +1,34 @@
 import abc
+import mmap
 import os
-from datetime import datetime
-from typing import NamedTuple, Union
-from pe.runner.api import Api
+from datetime import datetime, timedelta
+from typing import Iterator, NamedTuple, Protocol, Union
+from pe.log_scraper import events as catalog
+from pe.log_scraper.matcher import MarkerMatcher
+from pe.log_scraper.rules import Rule, RuleState, compile_rules
+from pe.log_scraper.timestamps import haproxy_parser, patroni_parser, postgres_parser
+
+# A (start, end) span of log time to scrape
+Window = tuple[datetime, datetime]
+# How far either side of a requested window scrapers look for events
+WINDOW_PAD = timedelta(seconds=60)
+
+
+class LogFetcher(Protocol):
+    """
+    Fetches logs from the machine they live on (e.g. an agent's Api). It's
+    handed to the scrapers rather than imported, so scraping (e.g. in a
+    worker process) never loads the agent's server stack
+    """
+
+    def sync_file(self, path: str, dest: str) -> int:
+        ...
+
+    def fetch_file(self, path: str, dest: str, offset: int = 0, append: bool = False) -> int:
+        ...
+
+    def list_folder(self, folder: str) -> list[str]:
+        ...
 
 
 class Event(NamedTuple):
@@ -14,40 +40,258 @@ class Event(NamedTuple):
     raw: str
     readable: str
 
+    def to_dict(self) -> dict:
+        """
+        A plain (JSON friendly) representation of this event
+        """
+        return {
+            "timestamp": self.timestamp.isoformat(),
+            "raw": self.raw,
+            "readable": self.readable,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Event":
+        """
+        Inverse of to_dict
+        """
+        return cls(
+            timestamp=datetime.fromisoformat(data["timestamp"]),
+            raw=data["raw"],
+            readable=data["readable"],
+        )
+
 
 class LogScraper(abc.ABC):
     """
-    A base class that represents a log scraper.
+    A base class that represents a log scraper. Every scraper runs the same
+    path: its rules (compiled from the event catalog in events.py) are matched
+    against the raw log, and each match is fed through the rules' state machine
     :param str path: A path (from the root of this module) to the log to scrape
+    :param list[Rule] rules: The events to scrape
     """
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, rules: list[Rule]):
         self.path = path
-        split = path.split(".")
-        self.local_path = split[0] + "-local" + "." + split[1]
+        self.rules = rules
+        self.local_path = self.make_local_path(path)
+        # How many bytes of each remote log have been tailed so far
+        self.offsets: dict[str, int] = {}
+        # Compiled on first use, see get_matcher
+        self._matcher: Union[MarkerMatcher, None] = None
+        self.reset()
 
-    def recreate_locally(self, api: Api):
+    def make_local_path(self, path: str) -> str:
+        """
+        Where the local copy of the log at path is kept (next to it, with
+        -local added to its name)
+        """
+        root, extension = os.path.splitext(path)
+        return root + "-local" + extension
+
+    def recreate_locally(self, api: LogFetcher):
         """
         A method that will fetch the log from the remote source (api) and recreate it
-        at the same path locally for analysis.
-        :param Api api: An api object bound to the machine containing the log in question
+        at the same path locally for analysis. A local copy left by an earlier
+        analysis is kept if unchanged, or only has the appended bytes downloaded.
+        :param LogFetcher api: Fetches from the machine containing the log in question
         """
-        with open(os.path.join(self.local_path), "w") as fout:
-            fout.write(api.fetch_file(self.path))
+        api.sync_file(self.path, self.local_path)
 
-    @classmethod
-    def get_translations(cls) -> list[tuple[str, str]]:
+    def get_translations(self) -> list[tuple[str, str]]:
         """
         Returns the list of markers and their translations
         """
-        raise NotImplementedError("Can't get abstract translations")
+        return [(rule.marker, rule.readable) for rule in self.rules]
 
-    @classmethod
-    def scrape(cls) -> list[Event]:
+    def to_spec(self) -> dict:
+        """
+        The plain (JSON friendly) arguments that rebuild this scraper with
+        scraper_from_spec, e.g. on the agent that holds the log
+        """
+        raise NotImplementedError("Can't describe an abstract scraper")
+
+    def get_remote_paths(self, api: LogFetcher) -> list[tuple[str, str]]:
+        """
+        The (remote, local) paths of every file making up the log
+        """
+        return [(self.path, self.local_path)]
+
+    def get_local_paths(self) -> list[str]:
+        """
+        The local copies of the log, in the order they should be scraped.
+        Several files are streamed one after another rather than concatenated
+        """
+        return [self.local_path]
+
+    def seek(self, log: mmap.mmap, when: datetime) -> int:
+        """
+        Binary searches a (time ordered) log for the first line stamped at or
+        after when. Lines without a timestamp are skipped over
+        :returns: The offset of that line, or the size of the log if there is none
+        """
+        size = len(log)
+        line_start = lambda pos: 0 if pos == 0 else (log.find(b"\n", pos - 1) + 1 or size)
+
+        def stamp_after(pos: int) -> Union[datetime, None]:
+            # The timestamp of the first stamped line starting at or after pos
+            while pos < size:
+                line_end = log.find(b"\n", pos) + 1 or size
+                try:
+                    return self.timestamps.parse(log[pos:line_end].decode(errors="replace"))
+                except ValueError:
+                    pos = line_end
+            return None
+
+        low, high = 0, size
+        while low < high:
+            mid = (low + high) // 2
+            stamp = stamp_after(line_start(mid))
+            if stamp is None or stamp >= when:
+                high = mid
+            else:
+                low = mid + 1
+        return line_start(low)
+
+    def matches(
+        self, window: Union[Window, None] = None, pad: timedelta = WINDOW_PAD
+    ) -> Iterator[tuple[str, Rule]]:
+        """
+        Yields (line, rule) for every marker found in the local
+        logs, in file order. The logs are memory-mapped and matched as raw
+        bytes, and the matcher is compiled once per scraper
+        :param Window window: Only scrape lines stamped within this window,
+            binary searching to its start and stopping at its end, so the cost
+            is proportional to the window rather than the log. Defaults to the
+            whole log
+        :param timedelta pad: How far to widen the window on either side
+        """
+        matcher = self.get_matcher()
+        for path in self.get_local_paths():
+            with open(path, "rb") as fin:
+                if os.fstat(fin.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as log:
+                    start, end = 0, len(log)
+                    if window is not None:
+                        start = self.seek(log, window[0] - pad)
+                        end = self.seek(log, window[1] + pad)
+                    yield from self.translate(matcher.lines(log, start, end))
+
+    def get_matcher(self) -> MarkerMatcher:
+        """
+        The matcher for this scraper's markers, compiled on first use
+        """
+        if self._matcher is None:
+            self._matcher = MarkerMatcher([rule.marker for rule in self.rules])
+        return self._matcher
+
+    def translate(self, lines: Iterator[tuple[str, int]]) -> Iterator[tuple[str, Rule]]:
+        """
+        Turns the (line, marker index) pairs of the matcher into (line, rule)
+        """
+        rules = self.rules
+        for line, ix in lines:
+            yield line, rules[ix]
+
+    def reset(self):
+        """
+        Clears the state carried from one line to the next, so that scraping
+        starts over from the beginning of the log
+        """
+        self.partial_lines: dict[str, bytes] = {}
+        self.state: RuleState[Event] = RuleState(self.rules)
+
+    def handle(self, line: str, rule: Rule) -> list[Event]:
+        """
+        Turns a matched line into events, stepping the rules' state machine
+        """
+        timestamp = self.timestamps.parse(line)
+        return self.state.step(rule, Event(timestamp=timestamp, raw=line, readable=rule.readable))
+
+    def finish(self) -> list[Event]:
+        """
+        Any events that can only be decided once the whole log is seen
+        """
+        return self.state.finish()
+
+    def events(
+        self, window: Union[Window, None] = None, pad: timedelta = WINDOW_PAD
+    ) -> Iterator[Event]:
+        """
+        Yields the events of the logs (within the window, see matches) as they
+        are found, in constant memory
+        """
+        self.reset()
+        for line, rule in self.matches(window, pad):
+            yield from self.handle(line, rule)
+        yield from self.finish()
+
+    def scrape(
+        self, window: Union[Window, None] = None, pad: timedelta = WINDOW_PAD
+    ) -> list[Event]:
         """
         Does the work of scraping and returns the events in a human (and plot) friendly format
+        :param Window window: Only scrape events within this window, see matches
+        :param timedelta pad: How far to widen the window on either side
+        """
+        result = list(self.events(window, pad))
+        result.sort(key=lambda e: e.timestamp)
+        return result
+
+    def feed(self, data: bytes, path: str) -> list[Event]:
+        """
+        Scrapes bytes newly appended to a log, resuming from the state left by
+        earlier chunks. A trailing partial line is held back until the rest
+        of it arrives
+        :param bytes data: The new bytes
+        :param str path: Which file of the log they were appended to
+        :returns: The events found in the new lines
+        """
+        partial = self.partial_lines.get(path)
+        buffer = partial + data if partial else data
+        cut = buffer.rfind(b"\n") + 1
+        self.partial_lines[path] = buffer[cut:]
+        result = []
+        for line, rule in self.translate(self.get_matcher().lines(buffer, 0, cut)):
+            result.extend(self.handle(line, rule))
+        return result
+
+    def flush(self) -> list[Event]:
+        """
+        Scrapes the partial lines held back by feed as they are, once no
+        more is coming (as a full scrape does with a log's last line)
+        :returns: The events found in them
         """
-        raise NotImplementedError("Can't scrape abstract translations")
+        result = []
+        for partial in self.partial_lines.values():
+            for line, rule in self.translate(self.get_matcher().lines(partial)):
+                result.extend(self.handle(line, rule))
+        self.partial_lines.clear()
+        return result
+
+    def tail(self, api: LogFetcher) -> list[Event]:
+        """
+        Pulls whatever was appended to the remote log since the last call,
+        appends it to the local copy and scrapes it
+        :param LogFetcher api: Fetches from the machine containing the log in question
+        :returns: The events found in the new bytes
+        """
+        result = []
+        for remote_path, local_path in self.get_remote_paths(api):
+            offset = self.offsets.get(remote_path, 0)
+            if offset > 0 and os.path.getsize(local_path) > offset:
+                # Drop whatever a failed pull left behind, it's pulled again
+                os.truncate(local_path, offset)
+            written = api.fetch_file(remote_path, local_path, offset=offset, append=offset > 0)
+            if written == 0:
+                continue
+            with open(local_path, "rb") as fin:
+                fin.seek(offset)
+                data = fin.read(written)
+            self.offsets[remote_path] = offset + written
+            result.extend(self.feed(data, remote_path))
+        return result
 
 
 class PatroniScraper(LogScraper):
@@ -57,87 +301,14 @@ class PatroniScraper(LogScraper):
     """
 
     def __init__(self, path: str, old: bool):
-        super().__init__(path)
+        super().__init__(
+            path, compile_rules(catalog.POLScraped if old else catalog.PNLScraped)
+        )
         self.old = old
+        self.timestamps = patroni_parser()
 
-    def get_translations(self):
-        """ """
-        if self.old:
-            return [
-                ("received failover request", "Failover request received"),
-                ("Got response from", "Pinging next leader"),
-                ("Demoting self", "Demoting self"),
-                ("key released", "Releasing DCS key"),
-                (
-                    "closed patroni connection to the postgresql cluster",
-                    "Closing PG connection",
-                ),
-                ("accepting connections", "Accepting new PG connections"),
-                # ("establishing a new patroni connection to the postgres cluster", "Establishing new PG connections"),
-            ]
-        else:
-            return [
-                ("a secondary, and following a leader", "Last heartbeat as follower"),
-                # ("to key /service/patroni-experiments/leader", "Claiming leader in DCS"),
-                (
-                    "Cleaning up failover key after acquiring leader lock",
-                    "Cleaning up DCS",
-                ),
-                ("promoted self to leader by acquiring session lock", "Promoting self"),
-                (
-                    "cleared rewind state after becoming the leader",
-                    "Clearing rewind state",
-                ),
-                ("the leader with the lock", "First heartbeat as leader"),
-            ]
-
-    def scrape(self):
-        """ """
-        result = []
-        with open(self.local_path) as fin:
-            lines = fin.readlines()
-        if self.old:
-            # Old leader has simple marker -> event logic
-            for line in lines:
-                for marker, readable in self.get_translations():
-                    if marker in line:
-                        raw_stamp = line[:23]
-                        timestamp = datetime.strptime(raw_stamp, "%Y-%m-%d %H:%M:%S,%f")
-                        result.append(
-                            Event(timestamp=timestamp, raw=line, readable=readable)
-                        )
-        else:
-            # For the new leader, in order to accurately track the "last heartbeat as follower"
-            # and the "first heartbeat as leader" we need to handle markers differently based
-            # on whether the machine has been promoted
-            has_promoted = False
-            last_follow: Union[Event, None] = None
-            first_lead: Union[Event, None] = None
-            for line in lines:
-                for marker, readable in self.get_translations():
-                    if marker not in line:
-                        continue
-                    raw_stamp = line[:23]
-                    timestamp = datetime.strptime(raw_stamp, "%Y-%m-%d %H:%M:%S,%f")
-                    event = Event(timestamp=timestamp, raw=line, readable=readable)
-                    if "and following a leader" in marker:
-                        # Special logic for last follow
-                        if not has_promoted:
-                            last_follow = event
-                    elif "the leader with the lock" in marker:
-                        # Special logic for the first lead, only update right after has_promoted and first_lead
-                        if has_promoted and first_lead == None:
-                            first_lead = event
-                    else:
-                        if "promoted self to leader" in marker:
-                            has_promoted = True
-                        result.append(event)
-            if last_follow is not None:
-                result.append(last_follow)
-            if first_lead is not None:
-                result.append(first_lead)
-            result.sort(key=lambda e: e.timestamp)
-        return result
+    def to_spec(self):
+        return {"kind": "patroni", "path": self.path, "old": self.old}
 
 
 class PostgresScraper(LogScraper):
@@ -147,81 +318,38 @@ class PostgresScraper(LogScraper):
     """
 
     def __init__(self, path: str, old: bool):
-        if not os.path.exists(path):
-            os.mkdir(path)
-        self.path = path
-        self.local_path = os.path.join(path, "pg-local.log")
+        super().__init__(
+            path, compile_rules(catalog.GOLScraped if old else catalog.GNLScraped)
+        )
         self.old = old
+        self.timestamps = postgres_parser()
 
-    def recreate_locally(self, api: Api):
-        with open(os.path.join(self.local_path), "w") as fout:
-            fout.write(api.fetch_folder(self.path))
-
-    def get_translations(self):
-        if self.old:
-            return [
-                # (
-                #    "database system is ready to accept connections",
-                #    "DB ready for writes",
-                # ),
-                ("received fast shutdown request", "DB received shutdown"),
-                ("database system is shut down", "DB finished shutdown"),
-                # ("starting PostgreSQL", "DB restarting"),
-                (
-                    "database system is ready to accept read-only connections",
-                    "Node ready as replica. \nDB ready for reads",
-                ),
-            ]
-        else:
-            return [
-                # ("entering standby mode", "DB entering standby mode"),
-                # (
-                #    "database system is ready to accept read-only connections",
-                #    "DB ready for reads",
-                # ),
-                (
-                    "replication terminated by primary server",
-                    "DB replication terminated",
-                ),
-                ("received promote request", "DB received promote request"),
-                ("selected new timeline ID", "Starting new DB timeline"),
-                (
-                    "database system is ready to accept connections",
-                    "DB ready for writes",
-                ),
-            ]
-
-    def scrape(self):
-        result = []
-        with open(self.local_path) as fin:
-            lines = fin.readlines()
-        if self.old:
-            for line in lines:
-                for marker, readable in self.get_translations():
-                    if marker in line:
-                        raw_stamp = line[:23]
-                        timestamp = datetime.strptime(raw_stamp, "%Y-%m-%d %H:%M:%S.%f")
-                        result.append(
-                            Event(timestamp=timestamp, raw=line, readable=readable)
-                        )
-        else:
-            has_started_new_timeline = False
-            for line in lines:
-                for marker, readable in self.get_translations():
-                    if marker in line:
-                        if (
-                            "accept connections" in marker
-                            and not has_started_new_timeline
-                        ):
-                            continue
-                        if "selected new timeline ID" in marker:
-                            has_started_new_timeline = True
-                        raw_stamp = line[:23]
-                        timestamp = datetime.strptime(raw_stamp, "%Y-%m-%d %H:%M:%S.%f")
-                        result.append(
-                            Event(timestamp=timestamp, raw=line, readable=readable)
-                        )
-        return result
+    def make_local_path(self, path: str) -> str:
+        """
+        The log is a folder, so its local copy is a folder within it
+        """
+        return os.path.join(path, "local")
+
+    def to_spec(self):
+        return {"kind": "postgres", "path": self.path, "old": self.old}
+
+    def recreate_locally(self, api: LogFetcher):
+        """
+        Fetches each log in the remote folder into a local folder of its own
+        """
+        for remote_path, local_path in self.get_remote_paths(api):
+            api.sync_file(remote_path, local_path)
+
+    def get_remote_paths(self, api: LogFetcher):
+        os.makedirs(self.local_path, exist_ok=True)
+        return [
+            (os.path.join(self.path, file), os.path.join(self.local_path, file))
+            for file in api.list_folder(self.path)
+        ]
+
+    def get_local_paths(self):
+        paths = [os.path.join(self.local_path, file) for file in sorted(os.listdir(self.local_path))]
+        return [path for path in paths if os.path.isfile(path)]
 
 
 class HAProxyScraper(LogScraper):
@@ -230,48 +358,22 @@ class HAProxyScraper(LogScraper):
     """
 
     def __init__(self, path, old_name: str, new_name: str):
-        super().__init__(path)
+        super().__init__(
+            path, compile_rules(catalog.HAProxyScraped, old_name=old_name, new_name=new_name)
+        )
         self.old_name = old_name
         self.new_name = new_name
+        self.timestamps = haproxy_parser()
 
-    def get_translations(self):
-        """ """
-        return [
-            (
-                f"Health check for server patroni-experiments/{self.old_name} failed",
-                "Proxy health check on old leader failed",
-            ),
-            (
-                f"Health check for server patroni-experiments/{self.old_name} succeeded",
-                "Proxy health check on old leader succeeded",
-            ),
-            (
-                f"Server patroni-experiments/{self.old_name} is UP",
-                "Old leader marked as UP",
-            ),
-            (
-                f"Server patroni-experiments/{self.old_name} is DOWN",
-                "Old leader marked as DOWN",
-            ),
-            (
-                f"Health check for server patroni-experiments/{self.new_name} failed",
-                "Proxy health check on new leader failed",
-            ),
-            (
-                f"Health check for server patroni-experiments/{self.new_name} succeeded",
-                "Proxy health check on new leader succeeded",
-            ),
-            (
-                f"Server patroni-experiments/{self.new_name} is UP",
-                "New leader marked as UP",
-            ),
-            (
-                f"Server patroni-experiments/{self.new_name} is DOWN",
-                "New leader marked as DOWN",
-            ),
-        ]
+    def to_spec(self):
+        return {
+            "kind": "haproxy",
+            "path": self.path,
+            "old_name": self.old_name,
+            "new_name": self.new_name,
+        }
 
-    def scrape(self):
+    def handle(self, line, rule):
         """ """
         # NOTE: Because of a weird quirk in the HAProxy logging config, some
         # events get logged twice. One of the times they get logged, it looks
@@ -279,20 +381,32 @@ class HAProxyScraper(LogScraper):
         # We only want to use the ones that have the timestamp, so this whole
         # scraper is written assuming that anything that doesn't start with <#>
         # will be thrown out.
-        result = []
-        with open(self.local_path, "r") as fin:
-            lines = fin.readlines()
-        for line in lines:
-            if line[0] != "<":
-                # Sign that this line will _not_ contain a timestamp
-                continue
-            for marker, readable in self.get_translations():
-                if marker not in line:
-                    continue
-                raw_stamp = line[3:29]
-                timestamp = datetime.strptime(raw_stamp, "%Y-%m-%dT%H:%M:%S.%f")
-                result.append(Event(timestamp=timestamp, raw=line, readable=readable))
-        return result
+        if line[0] != "<":
+            # Sign that this line will _not_ contain a timestamp
+            return []
+        return super().handle(line, rule)
+
+
+SCRAPERS = {
+    "patroni": PatroniScraper,
+    "postgres": PostgresScraper,
+    "haproxy": HAProxyScraper,
+}
+
+
+def scraper_from_spec(spec: dict) -> LogScraper:
+    """
+    Inverse of LogScraper.to_spec
+    :raises ValueError: If the spec doesn't describe a scraper
+    """
+    arguments = dict(spec)
+    scraper_class = SCRAPERS.get(arguments.pop("kind", None))
+    if scraper_class == None:
+        raise ValueError(f"Unknown scraper {spec}")
+    try:
+        return scraper_class(**arguments)
+    except TypeError as e:
+        raise ValueError(f"Improper scraper {spec}") from e
 
 
 if __name__ == "__main__":
@@ -302,6 +416,8 @@ if __name__ == "__main__":
     ls4 = PostgresScraper("data/postgres/pe2/logs", old=False)
     ls5 = HAProxyScraper("data/haproxy/proxy.log", old_name="pe1", new_name="pe2")
 
+    from pe.runner.api import Api
+
     default_api = Api("127.0.0.1", 3000)
     ls1.recreate_locally(default_api)
     ls2.recreate_locally(default_api)
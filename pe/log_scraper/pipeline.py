@@ -0,0 +1,104 @@
+import heapq
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterator, NamedTuple, Union
+from pe.log_scraper.log_scraper import Event, LogScraper, Window
+
+if TYPE_CHECKING:
+    # Only for annotations, so the scraping workers never import the agent
+    from pe.runner.api import Api
+
+# Logs smaller than this are scraped right in the thread that fetched them.
+# Starting a worker process costs more than scraping a log this size does
+IN_PROCESS_BYTES = 64 << 20
+
+
+class Source(NamedTuple):
+    """
+    One log to analyze
+    :param str name: What to call its events in the merged timeline
+    :param LogScraper scraper: The scraper for the log
+    :param Api api: The api of the machine the log lives on
+    :param Window window: Only scrape events within this window (the whole
+        log if None)
+    """
+    name: str
+    scraper: LogScraper
+    api: "Api"
+    window: Union[Window, None] = None
+
+
+def scrape(scraper: LogScraper, window: Union[Window, None]) -> list[Event]:
+    """
+    Scrapes a local log, in a worker process or on a fetching thread
+    """
+    return scraper.scrape(window)
+
+
+def scrape_sources(
+    sources: list[Source], fetch: bool = True, on_agents: bool = False
+) -> list[list[Event]]:
+    """
+    Fetches and scrapes every source at once. Fetching is I/O bound, so each
+    source is fetched on its own thread (over its api's keep-alive session),
+    and scraped as soon as it lands: small logs on that thread, big ones in a
+    process pool (only started if a log needs it). The wall time is roughly
+    that of the slowest source
+    :param list[Source] sources: The logs to analyze
+    :param bool fetch: Fetch the logs first, rather than scraping the local
+        copies left by an earlier run
+    :param bool on_agents: Have each agent scrape its own logs and send back
+        only the events, rather than fetching the logs
+    :returns: The events of each source, in the order of sources
+    """
+    if on_agents:
+        with ThreadPoolExecutor(max_workers=len(sources)) as threads:
+            return list(
+                threads.map(
+                    lambda source: source.api.scrape(source.scraper.to_spec(), source.window),
+                    sources,
+                )
+            )
+
+    pool: list[ProcessPoolExecutor] = []
+    pool_lock = threading.Lock()
+
+    def processes() -> ProcessPoolExecutor:
+        with pool_lock:
+            if len(pool) == 0:
+                # This is called from threads (e.g. fan-outs and agent request
+                # handlers), and forking a multithreaded process can deadlock
+                # on inherited locks
+                spawn = multiprocessing.get_context("spawn")
+                pool.append(ProcessPoolExecutor(max_workers=len(sources), mp_context=spawn))
+            return pool[0]
+
+    def fetch_and_scrape(source: Source) -> list[Event]:
+        if fetch:
+            source.scraper.recreate_locally(source.api)
+        size = sum(os.path.getsize(path) for path in source.scraper.get_local_paths())
+        if size < IN_PROCESS_BYTES:
+            return scrape(source.scraper, source.window)
+        return processes().submit(scrape, source.scraper, source.window).result()
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(sources)) as threads:
+            return list(threads.map(fetch_and_scrape, sources))
+    finally:
+        for executor in pool:
+            executor.shutdown()
+
+
+def merge_timelines(
+    names: list[str], timelines: list[list[Event]]
+) -> Iterator[tuple[str, Event]]:
+    """
+    Merges the (time ordered) events of every source into one time ordered
+    stream of (source name, event)
+    """
+    return heapq.merge(
+        *[[(name, event) for event in timeline] for name, timeline in zip(names, timelines)],
+        key=lambda named: named[1].timestamp,
+    )
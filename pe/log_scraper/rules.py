@@ -0,0 +1,104 @@
+from typing import Generic, NamedTuple, TypeVar, Union
+from pe.log_scraper.events import EventType, Rule as RuleKind
+
+T = TypeVar("T")
+
+
+class Rule(NamedTuple):
+    """
+    An entry of the event catalog (see events.py), compiled for scraping
+    :param EventType event: Which event this is
+    :param str marker: The substring that identifies it in a log line
+    :param str readable: Its human readable label
+    :param RuleKind kind: How its matches become events
+    :param EventType anchor: The event that kind is relative to, if any
+    """
+    event: EventType
+    marker: str
+    readable: str
+    kind: RuleKind
+    anchor: Union[EventType, None]
+
+
+def compile_rules(entries: list[type], **params: str) -> list[Rule]:
+    """
+    Compiles a list of catalog classes into rules
+    :param list[type] entries: e.g. events.PNLScraped
+    :param params: Values for any {placeholders} in the markers
+    """
+    return [
+        Rule(
+            event=entry.event,
+            marker=entry.marker.format(**params),
+            readable=entry.readable,
+            kind=entry.rule,
+            anchor=entry.anchor,
+        )
+        for entry in entries
+    ]
+
+
+class RuleState(Generic[T]):
+    """
+    The small state machine that decides, one match at a time, which matches
+    of a list of rules become events. It only ever looks at the rule that
+    matched, so its cost per match doesn't grow with the number of rules.
+    Finding the matches does: MarkerMatcher makes one pass over the log per
+    marker
+    :param list[Rule] rules: The rules being scraped
+    """
+
+    def __init__(self, rules: list[Rule]):
+        # The last_before rules waiting on each anchor
+        self.waiting: dict[EventType, list[EventType]] = {}
+        for rule in rules:
+            if rule.kind == "last_before" and rule.anchor != None:
+                self.waiting.setdefault(rule.anchor, []).append(rule.event)
+        self.seen: set[EventType] = set()
+        self.done: set[EventType] = set()
+        self.pending: dict[EventType, T] = {}
+        self.last: Union[EventType, None] = None
+
+    def step(self, rule: Rule, event: T) -> list[T]:
+        """
+        Feeds one match through the state machine
+        :param Rule rule: The rule whose marker matched
+        :param event: The event the match would produce
+        :returns: The events to emit, in time order
+        """
+        result = []
+        if rule.kind == "every":
+            result.append(event)
+        elif rule.kind == "after":
+            if rule.anchor in self.seen:
+                result.append(event)
+        elif rule.kind == "first_after":
+            if rule.anchor in self.seen and rule.event not in self.done:
+                self.done.add(rule.event)
+                result.append(event)
+        elif rule.kind == "last_before":
+            if rule.anchor not in self.seen:
+                self.pending[rule.event] = event
+        elif rule.kind == "dedupe":
+            if self.last != rule.event:
+                result.append(event)
+        if rule.event not in self.seen:
+            self.seen.add(rule.event)
+            # The last matches before this anchor are now final
+            released = [
+                self.pending.pop(waiting)
+                for waiting in self.waiting.get(rule.event, [])
+                if waiting in self.pending
+            ]
+            result = released + result
+        if len(result) > 0:
+            self.last = rule.event
+        return result
+
+    def finish(self) -> list[T]:
+        """
+        The last_before matches whose anchor never came
+        """
+        result = list(self.pending.values())
+        self.pending.clear()
+        return result
@@ -0,0 +1,69 @@
+import threading
+from typing import Union
+import requests
+from pe.exceptions import ApiError
+from pe.log_scraper.log_scraper import Event, LogScraper
+from pe.runner.api import Api
+
+
+class LogTailer:
+    """
+    Tails remote logs while the experiment runs. On a short interval it pulls
+    only the bytes appended to each log since the last poll and feeds them to
+    its scraper, which keeps its state between chunks. The event timelines are
+    then ready the moment the run ends, without one big transfer at the end
+    :param list[tuple[LogScraper, Api]] sources: Each scraper, along with the
+        api of the machine its log lives on
+    :param float interval: Time between polls (s)
+    """
+
+    def __init__(self, sources: list[tuple[LogScraper, Api]], interval: float = 1.0):
+        self.sources = sources
+        self.interval = interval
+        self.timelines: list[list[Event]] = [[] for _ in sources]
+        self.stopping = threading.Event()
+        self.thread: Union[threading.Thread, None] = None
+
+    def start(self):
+        """
+        Starts tailing every log from its beginning, in the background
+        """
+        for scraper, _ in self.sources:
+            scraper.reset()
+            scraper.offsets.clear()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def poll(self):
+        """
+        Pulls and scrapes whatever was appended to each log
+        """
+        for ix, (scraper, api) in enumerate(self.sources):
+            try:
+                self.timelines[ix].extend(scraper.tail(api))
+            except (ApiError, requests.RequestException):
+                # The machine may be briefly unreachable or slow (e.g. mid
+                # failover), the next poll picks up from the same offset
+                pass
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.poll()
+
+    def stop(self) -> list[list[Event]]:
+        """
+        Stops tailing after one last poll. Nothing more is coming, so each
+        log's unterminated last line is scraped too
+        :returns: The time ordered events of each scraper, in the order of sources
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.poll()
+        result = []
+        for (scraper, _), timeline in zip(self.sources, self.timelines):
+            events = timeline + scraper.flush() + list(scraper.finish())
+            events.sort(key=lambda e: e.timestamp)
+            result.append(events)
+        return result
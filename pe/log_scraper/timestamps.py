@@ -0,0 +1,132 @@
+import re
+from datetime import datetime
+from typing import Iterable, Union
+import numpy as np
+
+# Every supported layout is YYYY-MM-DD?HH:MM:SS?<fraction>, offsets are
+# relative to the start of the stamp
+DATE_HOUR_WIDTH = 13
+# What each separator of a stamp may be, by offset
+SEPARATORS = {4: "-", 7: "-", 10: " T", 13: ":", 16: ":", 19: ".,"}
+# The date and hour of a stamp. Checked up front, since int() alone would
+# also take spaces and signs
+DATE_HOUR = re.compile("[0-9]{4}-[0-9]{2}-[0-9]{2}[ T][0-9]{2}")
+NS_PER_DAY = 86_400_000_000_000
+# Days from 0000-03-01 to 1970-01-01 in the proleptic Gregorian calendar
+EPOCH_CIVIL_DAYS = 719_468
+
+
+class TimestampParser:
+    """
+    Parses the fixed width timestamps at a fixed position in a log line
+    without strptime. Integer fields are sliced out directly, and the
+    datetime for the date and hour is cached since consecutive lines almost
+    always share it
+    :param int start: Where the stamp starts in the line
+    :param int fraction_digits: How many digits the fractional seconds have
+    """
+
+    def __init__(self, start: int, fraction_digits: int):
+        self.start = start
+        self.fraction_digits = fraction_digits
+        self.width = 20 + fraction_digits
+        self.microsecond_scale = 10 ** (6 - fraction_digits)
+        self._prefix: Union[str, None] = None
+        self._base: Union[datetime, None] = None
+        # What each byte of a stamp may be: a digit, or one of its separators
+        self._low = np.full(self.width, ord("0"), dtype=np.uint8)
+        self._high = np.full(self.width, ord("9"), dtype=np.uint8)
+        self._other = np.full(self.width, ord("0"), dtype=np.uint8)
+        for ix, allowed in SEPARATORS.items():
+            allowed = allowed.encode()
+            self._low[ix] = self._high[ix] = allowed[0]
+            self._other[ix] = allowed[-1]
+        self._rest = re.compile(f":[0-9]{{2}}:[0-9]{{2}}[.,][0-9]{{{fraction_digits}}}")
+
+    def parse(self, line: str) -> datetime:
+        """
+        The timestamp of a log line
+        :raises ValueError: If the line doesn't start with a timestamp
+        """
+        start = self.start
+        prefix = line[start : start + DATE_HOUR_WIDTH]
+        if prefix != self._prefix:
+            # Only checked when it changes, a cached prefix already passed
+            if DATE_HOUR.fullmatch(prefix) == None:
+                raise ValueError(f"No timestamp at {start} in {line!r}")
+            self._base = datetime(
+                int(prefix[0:4]), int(prefix[5:7]), int(prefix[8:10]), int(prefix[11:13])
+            )
+            self._prefix = prefix
+        rest = line[start + DATE_HOUR_WIDTH : start + self.width]
+        if self._rest.fullmatch(rest) == None:
+            raise ValueError(f"No timestamp at {start} in {line!r}")
+        return self._base.replace(
+            minute=int(rest[1:3]),
+            second=int(rest[4:6]),
+            microsecond=int(rest[7:]) * self.microsecond_scale,
+        )
+
+    def parse_many(self, lines: Iterable[Union[str, bytes]]) -> np.ndarray:
+        """
+        Batch mode: parses a column of log lines (or raw stamps, if start is
+        0) at once with NumPy
+        :returns: int64 epoch-nanoseconds, in the timezone of the log
+        :raises ValueError: If any of the lines doesn't have a timestamp
+        """
+        stamps = np.array(
+            [line[self.start : self.start + self.width] for line in lines],
+            dtype=f"S{self.width}",
+        )
+        if len(stamps) == 0:
+            return np.zeros(0, dtype=np.int64)
+        raw = stamps.view(np.uint8).reshape(-1, self.width)
+        # Short stamps are padded with NULs, which fail like any other junk
+        valid = (((raw >= self._low) & (raw <= self._high)) | (raw == self._other)).all(axis=1)
+        digits = raw.astype(np.int64) - ord("0")
+
+        def field(begin: int, end: int) -> np.ndarray:
+            value = digits[:, begin]
+            for ix in range(begin + 1, end):
+                value = value * 10 + digits[:, ix]
+            return value
+
+        year, month, day = field(0, 4), field(5, 7), field(8, 10)
+        hour, minute, second = field(11, 13), field(14, 16), field(17, 19)
+        valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+        valid &= (hour < 24) & (minute < 60) & (second < 60)
+        if not valid.all():
+            bad = int(np.argmin(valid))
+            raise ValueError(f"No timestamp at {self.start} in line {bad}: {stamps[bad]!r}")
+        # Days since the epoch, from the civil calendar (March based years)
+        year = year - (month <= 2)
+        era = year // 400
+        year_of_era = year - era * 400
+        day_of_year = (153 * np.where(month > 2, month - 3, month + 9) + 2) // 5 + day - 1
+        day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+        days = era * 146_097 + day_of_era - EPOCH_CIVIL_DAYS
+
+        seconds = hour * 3600 + minute * 60 + second
+        nanoseconds = field(20, self.width) * (self.microsecond_scale * 1000)
+        return days * NS_PER_DAY + seconds * 1_000_000_000 + nanoseconds
+
+
+def patroni_parser() -> TimestampParser:
+    """
+    2023-06-20 10:11:12,345 at the start of the line
+    """
+    return TimestampParser(start=0, fraction_digits=3)
+
+
+def postgres_parser() -> TimestampParser:
+    """
+    2023-06-20 10:11:12.345 at the start of the line
+    """
+    return TimestampParser(start=0, fraction_digits=3)
+
+
+def haproxy_parser() -> TimestampParser:
+    """
+    <#>2023-06-20T10:11:12.345678 (after the syslog priority)
+    """
+    return TimestampParser(start=3, fraction_digits=6)
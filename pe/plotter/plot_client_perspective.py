@@ -1,42 +1,38 @@
 from datetime import datetime, timedelta
+from typing import Union
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import numpy as np
+from pe.analysis.outage import Outage, biggest_outage, find_outages
 
 ZERO_TIME = datetime(2023, 1, 1, 0, 0, 0, 0)
 
 
-def plot_client_perspective(client_times: list[datetime]) -> tuple[datetime, datetime]:
+def plot_client_perspective(
+    client_times: np.ndarray, outages: Union[list[Outage], None] = None
+) -> tuple[datetime, datetime]:
+    """
+    Plots the line showing interruption from the client's perspective
+    :param np.ndarray client_times: Sorted (local) datetime64 timestamps of the
+        client's successful writes
+    :param list[Outage] outages: The outages found in client_times, computed
+        with find_outages if not given
+    :returns: The (start, end) of the biggest outage
+    """
     plt.style.use("seaborn-pastel")
-    # Plots the line showing interruption from the client's perspective
-    table_error = timedelta(hours=-7)
-    client_times = [time + table_error for time in client_times]
-    biggest_gap = -1
-    gap_ix = -1
-    for ix in range(len(client_times) - 1):
-        this_time = client_times[ix]
-        next_time = client_times[ix + 1]
-        this_gap = (next_time - this_time).seconds + (
-            next_time - this_time
-        ).microseconds / 1e6
-        if this_gap > biggest_gap:
-            biggest_gap = this_gap
-            gap_ix = ix
-    biggest_gap = round(biggest_gap)
-
-    ticks = []
+    if outages is None:
+        outages = find_outages(client_times)
+    outage = biggest_outage(outages)
+    result = (outage.start, outage.end)
+    biggest_gap = round(outage.duration)
+
+    client_times = client_times.astype("datetime64[us]")
+    gap_ix = int(np.searchsorted(client_times, np.datetime64(outage.start, "us"), side="right")) - 1
     step = 16
-    print(gap_ix)
-    for ix in range(gap_ix, 0, -step):
-        print(ix, gap_ix, "down")
-        ticks.append(client_times[ix])
-    for ix in range(gap_ix + 1, len(client_times), step):
-        print(ix, gap_ix, "up")
-        ticks.append(client_times[ix])
-    ticks.sort()
-    print(ticks)
-
-    result = (client_times[gap_ix], client_times[gap_ix + 1])
+    ticks = np.concatenate(
+        (client_times[gap_ix::-step][::-1], client_times[gap_ix + 1 :: step])
+    ).tolist()
+    client_times = client_times.tolist()
 
     fig, ax = plt.subplots(figsize=(8.8, 4), layout="constrained", dpi=300)
     # ax.set(title="Events observered during failover")
@@ -56,7 +52,7 @@ def plot_client_perspective(client_times: list[datetime]) -> tuple[datetime, dat
     # Hand draw label for client gap
     ax.annotate(
         f"Downtime observed by client\n{biggest_gap} seconds",
-        xy=(client_times[gap_ix] + timedelta(seconds=biggest_gap / 2), 0),
+        xy=(outage.start + timedelta(seconds=biggest_gap / 2), 0),
         xytext=(0, 50),
         textcoords="offset points",
         weight="bold",
@@ -77,8 +73,9 @@ def plot_client_perspective(client_times: list[datetime]) -> tuple[datetime, dat
     ax.yaxis.set_visible(False)
     ax.spines[["left", "top", "right"]].set_visible(False)
 
-    # Shade in the region with client downtime
-    ax.axvspan(result[0], result[1], alpha=0.12, facecolor="r")
+    # Shade in every region with client downtime
+    for other in outages:
+        ax.axvspan(other.start, other.end, alpha=0.12, facecolor="r")
 
     ax.margins(y=0.1)
 
@@ -1,15 +1,18 @@
 import os
 import subprocess
 import time
-import yaml
 import requests
+import yaml
 from configparser import ConfigParser
-from multiprocessing import Process
+from multiprocessing import Pipe, Process
 from pe.config.parse import AgentConfig, NodeConfig, ProxyConfig, TopologyConfig
-from pe.exceptions import BootError
-from pe.runner.api import Api, do_start
+from pe.exceptions import ApiError, BootError, FailoverError
+from pe.runner.api import Api, TIMEOUT, do_start
 from pe.utils import kill_process_on_port, ROOT_DIR, replace_strs
 
+# How long a local api gets to start listening (s)
+BOOT_TIMEOUT = 5
+
 class Agent():
     """
     An active agent in the experiment
@@ -24,23 +27,43 @@ class Agent():
         self.verbose = False
 
     def boot(self, topology: TopologyConfig):
+        """
+        Start this agent's api, then what it runs
+        """
+        self.start_api()
+        self.start(topology)
+
+    def start_api(self):
+        """
+        Ensure this agent's (Flask) api is up, restarting it if it's local
+        """
         if self.is_local:
             # If this agent is local, restart the Flask server locally
             kill_process_on_port(self.api.port)
-            p = Process(target=do_start, args=(self.api.host, self.api.port, self.verbose))
+            ready, notify = Pipe(duplex=False)
+            p = Process(target=do_start, args=(self.api.host, self.api.port, self.verbose, notify))
             p.start()
-        # Ensure the flask server is up
-        MAX_RETRIES = 10
-        DELAY = 0.5
-        for _ in range(MAX_RETRIES):
+            notify.close()
+            # Told as soon as it's listening. If it dies first, the pipe closes
             try:
-                self.api.ping() 
-                break
-            except:
-                time.sleep(DELAY)
-        else:
-            raise BootError(f"{self.config.name} api is not ready after {MAX_RETRIES * DELAY} seconds")
+                if not ready.poll(BOOT_TIMEOUT):
+                    raise BootError(f"{self.config.name} api is not ready after {BOOT_TIMEOUT} seconds")
+                ready.recv()
+            except EOFError:
+                raise BootError(f"{self.config.name} api exited while starting")
+            finally:
+                ready.close()
+            return
+        # Ensure the (remote) flask server is up. Failed connects are retried
+        # by the session
+        try:
+            self.api.ping()
+        except (ApiError, requests.RequestException) as e:
+            raise BootError(f"{self.config.name} api is not ready") from e
     
+    def start(self, topology: TopologyConfig):
+        raise NotImplementedError("The method to start nodes should be implemented specifically")
+
     def stop(self):
         raise NotImplementedError("The method to stop nodes should be implemented specifically")
 
@@ -79,11 +102,10 @@ class Node(Agent):
         
         return replace_strs(config, replacements)
     
-    def boot(self, topology: TopologyConfig):
+    def start(self, topology: TopologyConfig):
         """
-        Start a node (etcd, patroni)
+        Start a node (etcd, patroni). Its api has to be up
         """
-        super().boot(topology) # This ensures that the Flask server is up
         self.api.start_etcd(self.config.name, topology)
         patroni_dict = self.construct_patroni_config()
         self.api.start_patroni(patroni_dict)
@@ -103,7 +125,11 @@ class Node(Agent):
         """
         while True:
             try:
-                resp = requests.get(f"http://{self.config.host}:{self.config.patroni_port}/cluster")
+                # Patroni's api is on the same host, so it shares the agent's pool
+                resp = self.api.session.get(
+                    f"http://{self.config.host}:{self.config.patroni_port}/cluster",
+                    timeout=TIMEOUT,
+                )
                 data = resp.json()
                 primary = ""
                 replicas = []
@@ -121,15 +147,43 @@ class Node(Agent):
                 else:
                     time.sleep(0.1)
     
+    def get_failover_candidate(self) -> str:
+        """
+        Uses this nodes patroni api to pick the replica best placed to take
+        over: one streaming from the leader, with the least lag
+        :raises FailoverError: If no replica is replicating
+        """
+        resp = self.api.session.get(
+            f"http://{self.config.host}:{self.config.patroni_port}/cluster",
+            timeout=TIMEOUT,
+        )
+        candidates = [
+            member
+            for member in resp.json()["members"]
+            if member["role"] in ("replica", "sync_standby")
+            and member.get("state") in ("streaming", "running")
+            # Lag is "unknown" unless it's actually replicating
+            and isinstance(member.get("lag"), int)
+            and not member.get("tags", {}).get("nofailover", False)
+        ]
+        if len(candidates) == 0:
+            raise FailoverError(f"No replica to fail over to in {resp.text}")
+        # Older Patronis say running for any replica, so streaming ones first
+        candidates.sort(key=lambda member: (member["state"] != "streaming", member["lag"]))
+        return candidates[0]["name"]
+
     def failover(self, new_leader: str):
         """
         Triggers a failover. Note that if this node is not the leader
         it will fail.
         :param str new_leader: Who to fail over to
+        :raises FailoverError: If Patroni didn't accept it
         """
-        resp = requests.post(f"http://{self.config.host}:{self.config.patroni_port}/failover", json={
+        resp = self.api.session.post(f"http://{self.config.host}:{self.config.patroni_port}/failover", json={
             "candidate": new_leader
-        })
+        }, timeout=TIMEOUT)
+        if resp.status_code != 200:
+            raise FailoverError(f"Failover to {new_leader} refused ({resp.status_code}): {resp.text}")
         
 
 class Proxy(Agent):
@@ -145,11 +199,10 @@ class Proxy(Agent):
         # CHANGES IF IT PRINTS
         self.verbose = False
     
-    def boot(self, topology: TopologyConfig):
+    def start(self, topology: TopologyConfig):
         """
-        Start the proxy
+        Start the proxy. Its api has to be up
         """
-        super().boot(topology) # This ensures that the Flask server is up
         with open(os.path.join(ROOT_DIR, "config", "haproxy.cfg"), "r") as fin:
             raw_conf = fin.read()
         
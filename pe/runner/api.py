@@ -1,24 +1,183 @@
 import click
 import contextlib
+import json as jsonlib
 import os
 import sys
+import time
+import zlib
+from datetime import datetime, timedelta
 import requests
-import jsonpickle
 import logging
-from flask import Flask, make_response, jsonify, request
+import threading
+import psutil
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, Response, make_response, jsonify, request
+from pe import wire
 from pe.config.parse import TopologyConfig
-from pe.exceptions import ApiError
+from pe.exceptions import ApiError, ConfigParseError
+from pe.runner.compression import (
+    COMPRESSIONS,
+    Compression,
+    compressor,
+    decompressor,
+    is_available,
+)
 from pe.runner.controllers import EtcdController, PatroniController, ProxyController
-from typing import Union
+from pe.runner.jobs import JobManager, JobOutput, JobStatus
+from pe.runner.notifier import AgentEvent, AgentWatcher, EventLog, haproxy_ports
+from pe.runner.sampler import SAMPLE_CAPACITY, ResourceSampler, samples_to_bytes
+from pe.runner.server import AgentServer
+from pe.utils import ROOT_DIR
+from typing import NamedTuple, Union
 
 app = Flask(__name__)
 
+# How many bytes of a file are read (and sent, or written) at a time
+STREAM_CHUNK_SIZE = 1 << 20
+
+# (connect, read) timeouts for every request to an agent (s). Reads are
+# generous, since some endpoints (e.g. scraping) legitimately take a while
+TIMEOUT = (3.05, 300)
+# Connection attempts retried before giving up. Only failed connects are
+# retried, so a POST is never sent twice
+CONNECT_RETRIES = 3
+RETRY_BACKOFF = 0.1
+# Connections kept alive per host, enough for every thread of a fan-out
+POOL_SIZE = 16
+# Where the agent's processes log. Scrapers may only read from under these
+LOG_DIRS = [os.path.join(ROOT_DIR, "data", dir) for dir in ["patroni", "postgres", "haproxy"]]
+
+
+def make_session() -> requests.Session:
+    """
+    A pooled, keep-alive session with the retry policy every request to the
+    agents shares. Sessions are thread safe for the way they're used here,
+    so one can serve all the threads talking to a host
+    """
+    retry = Retry(
+        total=CONNECT_RETRIES,
+        connect=CONNECT_RETRIES,
+        read=0,
+        status=0,
+        backoff_factor=RETRY_BACKOFF,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def is_log_path(path: str) -> bool:
+    """
+    Is the path (once links are resolved) within one of the agent's log dirs?
+    """
+    path = os.path.realpath(path)
+    return any(os.path.commonpath([path, dir]) == dir for dir in LOG_DIRS)
+
+
+def is_byte_count(value) -> bool:
+    """
+    Is the value usable as a byte offset or length (a non-negative int)?
+    """
+    # bool is an int too, but never what was meant
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+class FileStat(NamedTuple):
+    """
+    What the orchestrator needs to know to decide whether a remote file changed
+    :param int size: Size of the file (bytes)
+    :param float mtime: Last modification time (epoch s)
+    :param int checksum: Adler-32 of the first length bytes of the file
+    :param int length: How many bytes the checksum covers
+    """
+    size: int
+    mtime: float
+    checksum: int
+    length: int
+
+
+def file_checksum(path: str, length: Union[int, None] = None) -> int:
+    """
+    The Adler-32 checksum of the first length bytes of a file (all of it by
+    default), computed a chunk at a time
+    """
+    checksum = zlib.adler32(b"")
+    remaining = os.path.getsize(path) if length == None else length
+    with open(path, "rb") as fin:
+        while remaining > 0:
+            chunk = fin.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            checksum = zlib.adler32(chunk, checksum)
+            remaining -= len(chunk)
+    return checksum
+
+
+def stream_files(
+    paths: list[str],
+    offset: int = 0,
+    compression: Union[Compression, None] = None,
+    length: Union[int, None] = None,
+):
+    """
+    Streams files one after another, a chunk at a time, so memory use stays
+    constant however large they are
+    :param list[str] paths: The files to send
+    :param int offset: Where to start in the first file
+    :param Compression compression: Compress the stream on the fly
+    :param int length: Stop after sending this many (uncompressed) bytes
+    """
+    encoder = compressor(compression) if compression else None
+    remaining = float("inf") if length == None else length
+    for path in paths:
+        with open(path, "rb") as fin:
+            fin.seek(offset)
+            offset = 0
+            while remaining > 0:
+                chunk = fin.read(int(min(STREAM_CHUNK_SIZE, remaining)))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                if encoder != None:
+                    chunk = encoder.compress(chunk)
+                if chunk:
+                    yield chunk
+    if encoder != None:
+        yield encoder.flush()
+
+
+def stream_response(
+    paths: list[str],
+    offset: int,
+    compression: Union[Compression, None],
+    length: Union[int, None] = None,
+):
+    """
+    A streamed response of the files, or a 503 if the compression isn't supported
+    """
+    if compression not in COMPRESSIONS + [None] or not is_available(compression):
+        return make_response(f"Unsupported compression {compression}", 503)
+    headers = {"Content-Encoding": compression} if compression else {}
+    return Response(
+        stream_files(paths, offset, compression, length),
+        mimetype="application/octet-stream",
+        headers=headers,
+    )
+
 
 class Api:
     # TODO: Anything cleaner than static?
     etcd_controller: EtcdController = EtcdController()
     patroni_controller: PatroniController = PatroniController()
     proxy_controller: ProxyController = ProxyController()
+    job_manager: JobManager = JobManager()
+    sampler: Union[ResourceSampler, None] = None
+    sampler_lock = threading.Lock()
+    event_log: EventLog = EventLog()
+    watcher: AgentWatcher = AgentWatcher(event_log, lambda: Api.managed_processes())
     """
     A class to manage the controller api on each agent. This class has
     BOTH the code to actually run the flask app AND interact with it
@@ -31,6 +190,8 @@ class Api:
         self.host = host
         self.port = port
         self.verbose = verbose
+        # Keeps connections to this api alive between requests
+        self.session = make_session()
 
     def get(self, endpoint: str):
         """
@@ -38,7 +199,7 @@ class Api:
         :param str endpoint: The endpoint to hit (i.e. /endpoint)
         """
         getting = f"http://{self.host}:{self.port}/{endpoint}"
-        resp = requests.get(getting)
+        resp = self.session.get(getting, timeout=TIMEOUT)
         if resp.status_code != 200:
             raise ApiError(f"GET {getting} returned {resp.text}")
 
@@ -49,21 +210,57 @@ class Api:
         :param dict json: A json body to include in the request
         """
         posting = f"http://{self.host}:{self.port}/{endpoint}"
-        resp = requests.post(posting, json=json)
+        resp = self.session.post(posting, json=json, timeout=TIMEOUT)
         if resp.status_code != 200:
             raise ApiError(f"POST {posting} return {resp.text}")
         return resp.text
 
-    def serve(self, verbose=False):
+    def download(self, endpoint: str, dest: str, json={}, append: bool = False) -> int:
+        """
+        Helper method to stream the body of a post request straight to disk,
+        decompressing it on the fly if the api compressed it
+        :param str endpoint: The endpoint to hit (i.e. /endpoint)
+        :param str dest: The file to write the body to
+        :param dict json: A json body to include in the request
+        :param bool append: Append to dest rather than overwriting it
+        :returns: How many (decompressed) bytes were written
+        """
+        posting = f"http://{self.host}:{self.port}/{endpoint}"
+        with self.session.post(posting, json=json, stream=True, timeout=TIMEOUT) as resp:
+            if resp.status_code != 200:
+                raise ApiError(f"POST {posting} return {resp.text}")
+            compression = resp.headers.get("Content-Encoding")
+            decoder = decompressor(compression) if compression else None
+            written = 0
+            with open(dest, "ab" if append else "wb") as fout:
+                for chunk in resp.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+                    if decoder != None:
+                        chunk = decoder.decompress(chunk)
+                    fout.write(chunk)
+                    written += len(chunk)
+        return written
+
+    def serve(self, verbose=False, ready=None):
         """
         Begin serving the api. Note that this will block, and thus should be
-        run in its own process.
+        run in its own process. Requests are served concurrently (see
+        AgentServer), so the controllers are only touched under their locks
+        :param ready: A multiprocessing Connection, told once the api is
+            listening (so whoever started it needn't poll for it)
         """
         if not verbose:
             log = logging.getLogger("werkzeug")
             log.disabled = True
             app.logger.disabled = True
-        app.run(host="0.0.0.0", port=self.port, debug=False)
+        server = AgentServer("0.0.0.0", self.port, app)
+        if ready != None:
+            # Bound already, so connections queue until serve_forever takes them
+            ready.send(True)
+            ready.close()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
 
     """
     Simple ping to make sure the api is up
@@ -78,17 +275,170 @@ class Api:
         self.get("ping")
 
     """
-    Wildcard endpoint to execute needed steps
+    Long poll the agent's events (processes starting and exiting, ports
+    opening and closing, the leader changing) after a given seq. The agent
+    only watches for them while it's being polled
+    """
+
+    @staticmethod
+    @app.route("/events", methods=["POST"])
+    def api_events():
+        json = request.json or {}
+        try:
+            after = int(json.get("after", 0))
+            timeout = float(json.get("timeout", 5.0))
+        except (TypeError, ValueError):
+            return make_response("Improper json", 503)
+        Api.watcher.subscribe()
+        try:
+            events = Api.event_log.wait(after, timeout)
+        finally:
+            Api.watcher.unsubscribe()
+        return make_response(jsonify([event.to_dict() for event in events]), 200)
+
+    def events(self, after: int = 0, timeout: float = 5.0) -> list[AgentEvent]:
+        """
+        The agent's events after seq, waiting up to timeout (s) for one
+        """
+        body = {"after": after, "timeout": timeout}
+        return [AgentEvent.from_dict(event) for event in jsonlib.loads(self.post("events", json=body))]
+
+    """
+    Run a shell command in the background, returning its job id right away
+    """
+
+    @staticmethod
+    @app.route("/submit_job", methods=["POST"])
+    def api_submit_job():
+        json = request.json
+        if json == None or not isinstance(json.get("command", None), str):
+            return make_response("Improper json", 503)
+        job = Api.job_manager.submit(json["command"])
+        return make_response(jsonify({"id": job.id}), 200)
+
+    def submit_job(self, command: str) -> str:
+        """
+        :returns: The job's id
+        """
+        return jsonlib.loads(self.post("submit_job", json={"command": command}))["id"]
+
+    """
+    Where a job is at: its state, and once it's done its exit code and rusage
     """
 
     @staticmethod
-    @app.route("/exec_command/<string:command>", methods=["POST"])
-    def api_exec_command(command: str):
-        os.system(command)
-        return make_response("Executed", 200)
+    @app.route("/job_status", methods=["POST"])
+    def api_job_status():
+        json = request.json
+        if json == None or json.get("id", None) == None:
+            return make_response("Improper json", 503)
+        try:
+            job = Api.job_manager.get(json["id"])
+        except KeyError:
+            return make_response(f"No job {json['id']}", 503)
+        return make_response(jsonify(job.status().to_dict()), 200)
 
-    def exec_command(self, command: str):
-        self.post(f"exec_command/{command}")
+    def job_status(self, job_id: str) -> JobStatus:
+        return JobStatus.from_dict(jsonlib.loads(self.post("job_status", json={"id": job_id})))
+
+    """
+    The output a job has written since the given (byte) offsets
+    """
+
+    @staticmethod
+    @app.route("/job_output", methods=["POST"])
+    def api_job_output():
+        json = request.json
+        if json == None or json.get("id", None) == None:
+            return make_response("Improper json", 503)
+        try:
+            output = Api.job_manager.output(
+                json["id"], json.get("stdout_offset", 0), json.get("stderr_offset", 0)
+            )
+        except KeyError:
+            return make_response(f"No job {json['id']}", 503)
+        return make_response(jsonify(output.to_dict()), 200)
+
+    def job_output(self, job_id: str, stdout_offset: int = 0, stderr_offset: int = 0) -> JobOutput:
+        body = {"id": job_id, "stdout_offset": stdout_offset, "stderr_offset": stderr_offset}
+        return JobOutput.from_dict(jsonlib.loads(self.post("job_output", json=body)))
+
+    """
+    Cancel a job: a queued one never runs, a running one is terminated
+    """
+
+    @staticmethod
+    @app.route("/cancel_job", methods=["POST"])
+    def api_cancel_job():
+        json = request.json
+        if json == None or json.get("id", None) == None:
+            return make_response("Improper json", 503)
+        try:
+            status = Api.job_manager.cancel(json["id"])
+        except KeyError:
+            return make_response(f"No job {json['id']}", 503)
+        return make_response(jsonify(status.to_dict()), 200)
+
+    def cancel_job(self, job_id: str) -> JobStatus:
+        return JobStatus.from_dict(jsonlib.loads(self.post("cancel_job", json={"id": job_id})))
+
+    @staticmethod
+    def managed_processes() -> dict[str, list[int]]:
+        """
+        The pids of each process the controllers are running on this agent.
+        Postgres is everything Patroni started
+        """
+        groups: dict[str, list[int]] = {}
+        for name, controller in [
+            ("etcd", Api.etcd_controller),
+            ("patroni", Api.patroni_controller),
+            ("haproxy", Api.proxy_controller),
+        ]:
+            process = controller.process
+            if process == None or process.poll() != None:
+                continue
+            groups[name] = [process.pid]
+            if name == "patroni":
+                try:
+                    children = psutil.Process(process.pid).children(recursive=True)
+                except psutil.NoSuchProcess:
+                    children = []
+                groups["postgres"] = [child.pid for child in children]
+        return groups
+
+    def run_job(self, command: str, on_output=None, interval: float = 0.2) -> JobStatus:
+        """
+        Runs a command on this agent and waits for it to finish, following
+        its output as it goes
+        :param str command: The shell command to run
+        :param on_output: Called with each new (stdout, stderr), if given
+        :param float interval: Time between polls (s)
+        :returns: The job's final status, failed (with its error) if it
+            couldn't be started
+        """
+        job_id = self.submit_job(command)
+        stdout_offset, stderr_offset = 0, 0
+        while True:
+            output = self.job_output(job_id, stdout_offset, stderr_offset)
+            stdout_offset, stderr_offset = output.stdout_offset, output.stderr_offset
+            if on_output != None and (output.stdout or output.stderr):
+                on_output(output.stdout, output.stderr)
+            if output.status.done:
+                return output.status
+            time.sleep(interval)
+
+    def exec_command(self, command: str) -> JobStatus:
+        """
+        Runs a setup step on this agent as a job, and waits for it to succeed
+        :param str command: The shell command to run
+        :returns: The job's final status
+        :raises ApiError: If it couldn't be started, or didn't exit with 0
+        """
+        stderr = []
+        status = self.run_job(command, on_output=lambda _, err: stderr.append(err))
+        if status.state != "exited" or status.exit_code != 0:
+            raise ApiError(f"{self.host}:{self.port} {status}: {''.join(stderr).strip()}")
+        return status
 
     """
     Start etcd locally in a different process
@@ -104,20 +454,26 @@ class Api:
             or json.get("my_name", None) == None
         ):
             return make_response("Improper json", 503)
-        raw_topology = json["topology"]
-        topology = jsonpickle.decode(raw_topology)
-        if not isinstance(topology, TopologyConfig):
+        try:
+            topology = TopologyConfig.from_dict(wire.decode("topology", json["topology"]))
+        except (ValueError, ConfigParseError):
             return make_response("Improper json", 503)
-        Api.etcd_controller.start(
-            {
-                "my_name": json["my_name"],
-                "topology": topology,
-            }
-        )
+        with Api.etcd_controller.lock:
+            Api.etcd_controller.start(
+                {
+                    "my_name": json["my_name"],
+                    "topology": topology,
+                }
+            )
+            process = Api.etcd_controller.process
+            Api.watcher.watch_process("etcd", process, Api.etcd_controller.started_ns)
+        for node in topology.nodes:
+            if node.name == json["my_name"]:
+                Api.watcher.watch_port("etcd", node.etcd_port, "etcd", process)
         return make_response("Etcd started", 200)
 
     def start_etcd(self, my_name: str, topology: TopologyConfig):
-        body = {"my_name": my_name, "topology": jsonpickle.encode(topology)}
+        body = {"my_name": my_name, "topology": wire.encode("topology", topology.to_dict())}
         self.post("start_etcd", json=body)
 
     """
@@ -127,7 +483,8 @@ class Api:
     @staticmethod
     @app.route("/stop_etcd", methods=["POST"])
     def api_stop_etcd():
-        Api.etcd_controller.stop()
+        with Api.etcd_controller.lock:
+            Api.etcd_controller.stop()
         return make_response("Etcd killed", 200)
 
     def stop_etcd(self):
@@ -143,16 +500,35 @@ class Api:
         json = request.json
         if json == None or json.get("patroni_dict", None) == None:
             return make_response("Improper json", 503)
-        raw_patroni_dict = json["patroni_dict"]
-        patroni_dict = jsonpickle.decode(raw_patroni_dict)
+        try:
+            patroni_dict = wire.decode("patroni_config", json["patroni_dict"])
+        except ValueError:
+            return make_response("Improper json", 503)
         if not isinstance(patroni_dict, dict):
             return make_response("Improper json", 503)
-        Api.patroni_controller.start(patroni_dict)
+        with Api.patroni_controller.lock:
+            Api.patroni_controller.start(patroni_dict)
+            process = Api.patroni_controller.process
+            Api.watcher.watch_process("patroni", process, Api.patroni_controller.started_ns)
+        restapi = patroni_dict["restapi"]["connect_address"]
+        Api.watcher.watch_port("patroni", int(restapi.split(":")[1]), "patroni", process)
+        Api.watcher.watch_port(
+            "postgres",
+            int(patroni_dict["postgresql"]["connect_address"].split(":")[1]),
+            "postgres",
+            process,
+        )
+        etcd = patroni_dict.get("etcd", {}).get("host")
+        if etcd != None:
+            Api.watcher.watch_leader(
+                etcd, patroni_dict["scope"], patroni_dict.get("namespace", "/service")
+            )
         return make_response("Patroni started", 200)
 
     def start_patroni(self, patroni_dict: dict):
         body = {
-            "patroni_dict": jsonpickle.encode(patroni_dict),
+            # It's read from yaml, so it's plain JSON already
+            "patroni_dict": wire.encode("patroni_config", patroni_dict),
         }
         self.post("start_patroni", json=body)
 
@@ -163,7 +539,8 @@ class Api:
     @staticmethod
     @app.route("/stop_patroni", methods=["POST"])
     def api_stop_patroni():
-        Api.patroni_controller.stop()
+        with Api.patroni_controller.lock:
+            Api.patroni_controller.stop()
         return make_response("Patroni killed", 200)
 
     def stop_patroni(self):
@@ -180,7 +557,12 @@ class Api:
         if json == None or json.get("haproxy_conf", None) == None:
             return make_response("Improper json", 503)
         conf = json["haproxy_conf"]
-        Api.proxy_controller.start(conf)
+        with Api.proxy_controller.lock:
+            Api.proxy_controller.start(conf)
+            process = Api.proxy_controller.process
+            Api.watcher.watch_process("haproxy", process, Api.proxy_controller.started_ns)
+        for name, port in haproxy_ports(conf).items():
+            Api.watcher.watch_port(name, port, "haproxy", process)
         return make_response("Proxy started", 200)
 
     def start_proxy(self, conf: str):
@@ -196,14 +578,16 @@ class Api:
     @staticmethod
     @app.route("/stop_proxy", methods=["POST"])
     def api_stop_proxy():
-        Api.proxy_controller.stop()
+        with Api.proxy_controller.lock:
+            Api.proxy_controller.stop()
         return make_response("Proxy killed", 200)
 
     def stop_proxy(self):
         self.post("stop_proxy")
 
     """
-    Fetch the contents of a file
+    Stream the contents of a file, optionally only a byte range (offset,
+    length) of it, and compressed with gzip or zstd
     """
 
     @staticmethod
@@ -213,14 +597,75 @@ class Api:
         path = json.get("path") if json else None
         if path == None:
             return make_response("Improper json", 503)
-        with open(os.path.join(path)) as fin:
-            return make_response(fin.read(), 200)
+        offset, length = json.get("offset", 0), json.get("length")
+        if not is_byte_count(offset) or (length != None and not is_byte_count(length)):
+            return make_response("Improper json", 503)
+        return stream_response([os.path.join(path)], offset, json.get("compression"), length)
+
+    def fetch_file(
+        self,
+        path: str,
+        dest: str,
+        offset: int = 0,
+        compression: Union[Compression, None] = "gzip",
+        append: bool = False,
+        length: Union[int, None] = None,
+    ) -> int:
+        """
+        Downloads a remote file (from offset on, length bytes of it if given) to dest
+        :returns: How many bytes were written
+        """
+        body = {"path": path, "offset": offset, "compression": compression, "length": length}
+        return self.download("fetch_file", dest, json=body, append=append)
 
-    def fetch_file(self, path: str):
-        return self.post("fetch_file", json={"path": path})
+    def sync_file(self, path: str, dest: str) -> int:
+        """
+        Brings a local copy of a remote file up to date, downloading as
+        little as possible. An unchanged file isn't downloaded at all, and a
+        file that was only appended to only has the new bytes downloaded
+        :param str path: The remote file
+        :param str dest: The local copy
+        :returns: How many bytes were downloaded
+        """
+        local_size = os.path.getsize(dest) if os.path.exists(dest) else 0
+        if local_size > 0:
+            stat = self.stat_file(path, length=local_size)
+            if stat.size >= local_size and stat.checksum == file_checksum(dest):
+                if stat.size == local_size:
+                    return 0
+                return self.fetch_file(path, dest, offset=local_size, append=True)
+        return self.fetch_file(path, dest)
 
     """
-    Fetch all logs in a folder (appending them together)
+    Describe a file: its size, mtime and the Adler-32 checksum of its first
+    length bytes (all of it by default)
+    """
+
+    @staticmethod
+    @app.route("/stat_file", methods=["POST"])
+    def api_stat_file():
+        json = request.json
+        path = json.get("path") if json else None
+        if path == None or (json.get("length") != None and not is_byte_count(json["length"])):
+            return make_response("Improper json", 503)
+        if not os.path.isfile(path):
+            return make_response(f"{path} does not exist", 503)
+        info = os.stat(path)
+        length = min(json.get("length") or info.st_size, info.st_size)
+        stat = FileStat(
+            size=info.st_size,
+            mtime=info.st_mtime,
+            checksum=file_checksum(path, length),
+            length=length,
+        )
+        return make_response(jsonify(stat._asdict()), 200)
+
+    def stat_file(self, path: str, length: Union[int, None] = None) -> FileStat:
+        body = {"path": path, "length": length}
+        return FileStat(**jsonlib.loads(self.post("stat_file", json=body)))
+
+    """
+    Stream all logs in a folder (appending them together)
     """
 
     @staticmethod
@@ -230,20 +675,176 @@ class Api:
         path = json.get("path") if json else None
         if path == None:
             return make_response("Path does not exist")
-        files = sorted(os.listdir(path))
-        result = ""
-        for file in files:
-            with open(os.path.join(path, file)) as fin:
-                result += fin.read()
-        return result
+        files = [os.path.join(path, file) for file in sorted(os.listdir(path))]
+        return stream_response(files, 0, json.get("compression"))
+
+    def fetch_folder(
+        self, folder: str, dest: str, compression: Union[Compression, None] = "gzip"
+    ) -> int:
+        """
+        Downloads every file in a remote folder, one after another, to dest
+        :returns: How many bytes were written
+        """
+        body = {"path": folder, "compression": compression}
+        return self.download("fetch_folder", dest, json=body)
 
-    def fetch_folder(self, folder: str):
-        return self.post("fetch_folder", json={"path": folder})
+    """
+    List the files in a folder, so they can be fetched one at a time
+    """
+
+    @staticmethod
+    @app.route("/list_folder", methods=["POST"])
+    def api_list_folder():
+        json = request.json
+        path = json.get("path") if json else None
+        if path == None:
+            return make_response("Improper json", 503)
+        files = sorted(
+            file for file in os.listdir(path) if os.path.isfile(os.path.join(path, file))
+        )
+        return make_response(jsonify(files), 200)
+
+    def list_folder(self, folder: str) -> list[str]:
+        return jsonlib.loads(self.post("list_folder", json={"path": folder}))
+
+    """
+    Scrape a log where it lives and return only the matched events, so a
+    failover analysis moves kilobytes rather than whole DEBUG logs
+    """
+
+    @staticmethod
+    @app.route("/scrape", methods=["POST"])
+    def api_scrape():
+        # Imported here, since the scrapers themselves import the api
+        from pe.log_scraper.log_scraper import scraper_from_spec
+
+        json = request.json
+        if json == None or json.get("scraper", None) == None:
+            return make_response(jsonify({"error": "Improper json"}), 400)
+        try:
+            scraper = scraper_from_spec(json["scraper"])
+        except ValueError as e:
+            return make_response(jsonify({"error": str(e)}), 400)
+        if not is_log_path(scraper.path):
+            return make_response(jsonify({"error": f"{scraper.path} is not a log"}), 403)
+        if not os.path.exists(scraper.path):
+            return make_response(jsonify({"error": f"{scraper.path} does not exist"}), 404)
+        # The log is right here, so there's no local copy to make
+        scraper.local_path = scraper.path
+        try:
+            window = json.get("window")
+            if window != None:
+                window = (datetime.fromisoformat(window[0]), datetime.fromisoformat(window[1]))
+            pad = timedelta(seconds=json["pad"]) if json.get("pad") != None else None
+        except (TypeError, ValueError, IndexError) as e:
+            return make_response(jsonify({"error": f"Improper json: {e}"}), 400)
+        try:
+            if pad != None:
+                events = scraper.scrape(window, pad)
+            else:
+                events = scraper.scrape(window)
+        except OSError as e:
+            return make_response(jsonify({"error": f"Couldn't read {scraper.path}: {e}"}), 503)
+        return make_response(
+            jsonify(wire.encode("timeline", [event.to_dict() for event in events])), 200
+        )
+
+    def scrape(
+        self,
+        scraper: dict,
+        window: Union[tuple[datetime, datetime], None] = None,
+        pad: Union[timedelta, None] = None,
+    ) -> list:
+        """
+        Runs a scraper on this agent
+        :param dict scraper: The scraper to run, see LogScraper.to_spec
+        :param window: Only scrape events within this (start, end) window
+        :param timedelta pad: How far to widen the window on either side,
+            the scraper's default if None
+        :returns: list[Event]
+        :raises ApiError: If the log isn't one of the agent's, or can't be read
+        """
+        from pe.log_scraper.log_scraper import Event
+
+        body = {
+            "scraper": scraper,
+            "window": [window[0].isoformat(), window[1].isoformat()] if window else None,
+            "pad": pad.total_seconds() if pad != None else None,
+        }
+        timeline = wire.decode("timeline", jsonlib.loads(self.post("scrape", json=body)))
+        return [Event.from_dict(event) for event in timeline]
+
+    """
+    Start sampling the resource usage of the host and the processes this
+    agent runs, dropping any earlier samples
+    """
+
+    @staticmethod
+    @app.route("/start_sampler", methods=["POST"])
+    def api_start_sampler():
+        json = request.json or {}
+        try:
+            interval = float(json.get("interval", 0.1))
+            capacity = int(json.get("capacity", SAMPLE_CAPACITY))
+        except (TypeError, ValueError):
+            return make_response("Improper json", 503)
+        if interval <= 0 or capacity <= 0:
+            return make_response("Improper json", 503)
+        with Api.sampler_lock:
+            if Api.sampler != None:
+                Api.sampler.stop()
+            Api.sampler = ResourceSampler(Api.managed_processes, interval, capacity)
+            Api.sampler.start()
+        return make_response("Sampler started", 200)
+
+    def start_sampler(self, interval: float = 0.1, capacity: int = SAMPLE_CAPACITY):
+        """
+        :param float interval: Time between samples (s), down to 10ms
+        :param int capacity: Samples kept per series, the oldest are dropped
+        """
+        self.post("start_sampler", json={"interval": interval, "capacity": capacity})
+
+    """
+    Stop sampling, keeping the samples to be fetched
+    """
+
+    @staticmethod
+    @app.route("/stop_sampler", methods=["POST"])
+    def api_stop_sampler():
+        with Api.sampler_lock:
+            if Api.sampler == None:
+                return make_response("Sampler not started", 503)
+            Api.sampler.stop()
+        return make_response("Sampler stopped", 200)
+
+    def stop_sampler(self):
+        self.post("stop_sampler")
+
+    """
+    Every sample taken, as an .npz with one structured array per series
+    (host, etcd, patroni, postgres, haproxy)
+    """
+
+    @staticmethod
+    @app.route("/fetch_samples", methods=["POST"])
+    def api_fetch_samples():
+        with Api.sampler_lock:
+            if Api.sampler == None:
+                return make_response("Sampler not started", 503)
+            samples = Api.sampler.snapshot()
+        return Response(samples_to_bytes(samples), mimetype="application/octet-stream")
+
+    def fetch_samples(self, dest: str) -> int:
+        """
+        Fetches every sample into dest, to be read with sampler.load_samples
+        :returns: The size of the file (bytes)
+        """
+        return self.download("fetch_samples", dest)
 
 
-def do_start(host: str, port: int, verbose: bool = True):
+def do_start(host: str, port: int, verbose: bool = True, ready=None):
     api = Api(host, port)
-    api.serve()
+    api.serve(ready=ready)
 
 
 @click.command()
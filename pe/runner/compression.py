@@ -0,0 +1,43 @@
+import zlib
+from typing import Literal, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+Compression = Literal["gzip", "zstd"]
+COMPRESSIONS = ["gzip", "zstd"]
+# zlib window bits that produce (and expect) a gzip header and trailer
+GZIP_WBITS = 31
+# Logs are very repetitive, so the fastest level already shrinks them ~10x
+GZIP_LEVEL = 1
+
+
+def is_available(compression: Union[Compression, None]) -> bool:
+    """
+    Whether this machine can (de)compress the given encoding
+    """
+    return compression != "zstd" or zstandard != None
+
+
+def compressor(compression: Compression):
+    """
+    A streaming compressor, with compress(chunk) and flush() methods
+    """
+    if compression == "gzip":
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    if zstandard == None:
+        raise ValueError("zstd compression needs the zstandard package")
+    return zstandard.ZstdCompressor().compressobj()
+
+
+def decompressor(compression: Compression):
+    """
+    A streaming decompressor, with a decompress(chunk) method
+    """
+    if compression == "gzip":
+        return zlib.decompressobj(GZIP_WBITS)
+    if zstandard == None:
+        raise ValueError("zstd compression needs the zstandard package")
+    return zstandard.ZstdDecompressor().decompressobj()
@@ -4,10 +4,11 @@ from typing import Union
 import yaml
 import os
 import shlex
+import time
 from pe.config.parse import NodeConfig, TopologyConfig
 from pe.exceptions import BootError
 from pe.utils import kill_process_on_port, ROOT_DIR
-from threading import Thread
+from threading import Lock, Thread
 
 
 class AbstractCMDController(ABC):
@@ -20,13 +21,24 @@ class AbstractCMDController(ABC):
 
     def __init__(self):
         self.process: Union[subprocess.Popen, None] = None
+        # When the process was started (epoch ns)
+        self.started_ns: Union[int, None] = None
         self.tmp_files: list[str] = []
+        # The api serves requests concurrently, so starts and stops take this
+        self.lock = Lock()
 
     def start(self, _):
         if self.process != None:
             self.process.kill()
             raise BootError("Tried to start an already started controller")
 
+    def popen(self, command: str, **kwargs):
+        """
+        Starts the process, noting when
+        """
+        self.started_ns = time.time_ns()
+        self.process = subprocess.Popen(shlex.split(command), **kwargs)
+
     def stop(self):
         if self.process == None:
             raise BootError("Tried to stop a non-started controller")
@@ -95,8 +107,8 @@ class EtcdController(AbstractCMDController):
         # lines.append(f"--log-outputs /dev/null")
 
         COMMAND = " ".join(lines)
-        self.process = subprocess.Popen(
-            shlex.split(COMMAND),
+        self.popen(
+            COMMAND,
             stdout=subprocess.DEVNULL if not verbose else None,
             stderr=subprocess.DEVNULL if not verbose else None,
         )
@@ -130,8 +142,8 @@ class PatroniController(AbstractCMDController):
         with open(config_file, "w") as fout:
             fout.write(yaml.safe_dump(config))
         self.tmp_files.append(config_file)
-        self.process = subprocess.Popen(
-            shlex.split(f"patroni {config_file}"),
+        self.popen(
+            f"patroni {config_file}",
             stdout=subprocess.DEVNULL if not verbose else None,
             stderr=subprocess.DEVNULL if not verbose else None,
         )
@@ -153,8 +165,8 @@ class ProxyController(AbstractCMDController):
             fout.write(config)
         self.tmp_files.append(config_file)
         with open("pe/data/haproxy/proxy.log", "w") as fout:
-            self.process = subprocess.Popen(
-                shlex.split(f"haproxy -f {config_file}"),
+            self.popen(
+                f"haproxy -f {config_file}",
                 stdout=fout,
                 stderr=fout,
             )
@@ -1,21 +1,108 @@
 # pylint: disable=missing-module-docstring
+import json
 import os
-import shutil
 import time
 from threading import Thread
 from typing import Union
 import click
 from datetime import timedelta
 from tqdm import tqdm
-import jsonpickle
+import numpy as np
 
 from pe.runner.agent import Node
 from pe.runner.topology import Topology
-from pe.data_generator.data_generator import DataGenerator
-from pe.log_scraper.log_scraper import HAProxyScraper, PatroniScraper, PostgresScraper
-from pe.plotter.plot_client_perspective import plot_client_perspective
-from pe.plotter.plot_events import plot_events, plot_proxy_events
-from pe.utils import ROOT_DIR
+from pe.data_generator.data_generator import DataGenerator, WriteMode, WRITE_MODES
+from pe.analysis.outage import Outage, biggest_outage, find_outages, to_local_time
+from pe.log_scraper.log_scraper import (
+    Event,
+    HAProxyScraper,
+    PatroniScraper,
+    PostgresScraper,
+)
+from pe.log_scraper.pipeline import Source, merge_timelines, scrape_sources
+from pe.log_scraper.tailer import LogTailer
+from pe.runner.notifier import Subscription
+from pe import wire
+
+# Where the timestamps of the client's successful writes are kept between runs
+CLIENT_TIMES_PATH = "client_times.npy"
+# Where the structured results of the analysis are kept, for plotting later
+RESULTS_PATH = "results.json"
+# How often each client writes (s)
+WRITE_PERIOD = 0.1
+# Where each agent's resource samples are fetched to (<agent name>.npz)
+SAMPLES_PATH = "samples"
+# How long a node gets to take the leader key, after boot or a failover (s)
+LEADER_TIMEOUT = 120
+
+
+def save_results(
+    path: str,
+    outages: list[Outage],
+    patroni_events: tuple[list[Event], list[Event]],
+    postgres_events: tuple[list[Event], list[Event]],
+    proxy_events: tuple[list[Event], list[Event]],
+):
+    """
+    Saves the outcome of an analysis as plain JSON
+    :param str path: Where to save the results
+    :param list[Outage] outages: Every outage observed by the client
+    :param patroni_events: (old leader, new leader) Patroni events
+    :param postgres_events: (old leader, new leader) Postgres events
+    :param proxy_events: (initial, failover) HAProxy events
+    """
+    to_dicts = lambda events: [event.to_dict() for event in events]
+    results = {
+        "outages": [outage.to_dict() for outage in outages],
+        "patroni": {"old": to_dicts(patroni_events[0]), "new": to_dicts(patroni_events[1])},
+        "postgres": {"old": to_dicts(postgres_events[0]), "new": to_dicts(postgres_events[1])},
+        "proxy": {"initial": to_dicts(proxy_events[0]), "failover": to_dicts(proxy_events[1])},
+    }
+    with open(path, "w") as fout:
+        json.dump(wire.encode("results", results), fout, indent=2)
+
+
+def plot_results(results_path: str = RESULTS_PATH, client_times_path: str = CLIENT_TIMES_PATH):
+    """
+    Renders the charts for a saved analysis. Plotting is the only part of the
+    analysis that needs matplotlib, so it is only imported here
+    :param str results_path: Results saved by save_results
+    :param str client_times_path: Timestamps saved by Experiment.analyze
+    """
+    from pe.plotter.plot_client_perspective import plot_client_perspective
+    from pe.plotter.plot_events import plot_events, plot_proxy_events
+
+    with open(results_path, "r") as fin:
+        results = wire.decode("results", json.load(fin))
+    from_dicts = lambda events: [Event.from_dict(event) for event in events]
+    outages = [Outage.from_dict(outage) for outage in results["outages"]]
+    client_times = to_local_time(np.load(client_times_path, mmap_mode="r"))
+    outage = plot_client_perspective(client_times, outages)
+
+    # Set the basetime for numbering axes
+    base_time = outage[0] + timedelta(seconds=-12)
+
+    # Plot Patroni, then Postgres, then HAProxy
+    plot_events(
+        old_events=from_dicts(results["patroni"]["old"]),
+        new_events=from_dicts(results["patroni"]["new"]),
+        title="Patroni",
+        outage=outage,
+        base_time=base_time,
+    )
+    plot_events(
+        old_events=from_dicts(results["postgres"]["old"]),
+        new_events=from_dicts(results["postgres"]["new"]),
+        title="Postgres",
+        outage=outage,
+        base_time=base_time,
+    )
+    plot_proxy_events(
+        initial_events=from_dicts(results["proxy"]["initial"]),
+        failover_events=from_dicts(results["proxy"]["failover"]),
+        outage=outage,
+        base_time=base_time,
+    )
 
 
 class Experiment:
@@ -23,72 +110,136 @@ class Experiment:
     A class to manage the experiment
     """
 
-    def __init__(self, config_file: str, is_local: bool):
+    def __init__(
+        self,
+        config_file: str,
+        is_local: bool,
+        clients: int = 1,
+        rate: float = 1.0,
+        write_mode: WriteMode = "insert",
+        rows_per_tick: int = 1,
+        open_loop: bool = False,
+        plots: bool = True,
+        tail_logs: bool = False,
+        scrape_on_agents: bool = False,
+        sample_interval: Union[float, None] = None,
+    ):
         self.config_file = config_file
         self.is_local = is_local
+        self.clients = clients
+        self.rate = rate
+        self.write_mode: WriteMode = write_mode
+        self.rows_per_tick = rows_per_tick
+        self.open_loop = open_loop
+        self.plots = plots
+        self.tail_logs = tail_logs
+        self.scrape_on_agents = scrape_on_agents
+        self.sample_interval = sample_interval
         self.topology = Topology(self.config_file, is_local=self.is_local)
         # pylint: disable-next=invalid-name
         self.dg: Union[DataGenerator, None] = None
 
-    def clear_data(self):
+    def make_sources(self, old_leader_node: Node, new_leader_node: Node) -> list[Source]:
         """
-        Clears the data folders so that we can start writing fresh again.
+        Every log the analysis uses (old Patroni, old Postgres, new Patroni,
+        new Postgres, HAProxy), each with its scraper and the api of the
+        machine it lives on
         """
-        shutil.rmtree(f"{ROOT_DIR}/data", ignore_errors=True)
-        os.mkdir(f"{ROOT_DIR}/data")
-        os.mkdir(f"{ROOT_DIR}/data/etcd")
-        os.mkdir(f"{ROOT_DIR}/data/haproxy")
-        os.mkdir(f"{ROOT_DIR}/data/patroni")
-        os.mkdir(f"{ROOT_DIR}/data/postgres")
+        get_patroni_log_path = lambda name: f"pe/data/patroni/{name}/patroni.log"
+        get_postgres_log_path = lambda name: f"pe/data/postgres/{name}/logs"
+        get_proxy_log_path = lambda: "pe/data/haproxy/proxy.log"
+        old_name, new_name = old_leader_node.config.name, new_leader_node.config.name
+        return [
+            Source(
+                "old_patroni",
+                PatroniScraper(get_patroni_log_path(old_name), old=True),
+                old_leader_node.api,
+            ),
+            Source(
+                "old_postgres",
+                PostgresScraper(get_postgres_log_path(old_name), old=True),
+                old_leader_node.api,
+            ),
+            Source(
+                "new_patroni",
+                PatroniScraper(get_patroni_log_path(new_name), old=False),
+                new_leader_node.api,
+            ),
+            Source(
+                "new_postgres",
+                PostgresScraper(get_postgres_log_path(new_name), old=False),
+                new_leader_node.api,
+            ),
+            Source(
+                "proxy",
+                HAProxyScraper(get_proxy_log_path(), old_name, new_name),
+                self.topology.proxy.api,
+            ),
+        ]
 
     def analyze(
-        self, old_leader_node: Node, new_leader_node: Node, after_the_fact=False
+        self,
+        old_leader_node: Node,
+        new_leader_node: Node,
+        after_the_fact=False,
+        tailer: Union[LogTailer, None] = None,
     ):
         """
         Given the old leader and new leader, does the work of marshalling
-        their logs locally and scraping them into events. Then plots.
+        their logs locally and scraping them into events. The outages and
+        event timelines are saved to RESULTS_PATH, then plotted unless the
+        experiment is headless.
+        If the logs were tailed during the run, the tailer's timelines are
+        used as they are
         """
-        # Do all the scraping
-        get_patroni_log_path = lambda name: f"pe/data/patroni/{name}/patroni.log"
-        get_postgres_log_path = lambda name: f"pe/data/postgres/{name}/logs"
-        get_proxy_log_path = lambda: "pe/data/haproxy/proxy.log"
-
-        old_patroni_scraper = PatroniScraper(
-            get_patroni_log_path(old_leader_node.config.name), old=True
-        )
-        if not after_the_fact:
-            old_patroni_scraper.recreate_locally(old_leader_node.api)
-        old_patroni_events = old_patroni_scraper.scrape()
-
-        old_postgres_scraper = PostgresScraper(
-            get_postgres_log_path(old_leader_node.config.name), old=True
-        )
+        # Find the client-perceived outage
         if not after_the_fact:
-            old_postgres_scraper.recreate_locally(old_leader_node.api)
-        old_postgres_events = old_postgres_scraper.scrape()
-
-        new_patroni_scraper = PatroniScraper(
-            get_patroni_log_path(new_leader_node.config.name), old=False
-        )
-        if not after_the_fact:
-            new_patroni_scraper.recreate_locally(new_leader_node.api)
-        new_patroni_events = new_patroni_scraper.scrape()
+            assert self.dg is not None
+            client_times = self.dg.get_successful_writes()
+            np.save(CLIENT_TIMES_PATH, client_times)
+        else:
+            client_times = np.load(CLIENT_TIMES_PATH, mmap_mode="r")
+        client_times = to_local_time(client_times)
+        # The merged writes of every client still land at least once a
+        # period, whatever the number of clients, so per client jitter
+        # isn't mistaken for an outage
+        outages = find_outages(client_times, period=WRITE_PERIOD)
+        for found in outages:
+            print(found)
+        failover = biggest_outage(outages)
+        print(f"Failover: {failover}")
 
-        new_postgres_scraper = PostgresScraper(
-            get_postgres_log_path(new_leader_node.config.name), old=False
-        )
-        if not after_the_fact:
-            new_postgres_scraper.recreate_locally(new_leader_node.api)
-        new_postgres_events = new_postgres_scraper.scrape()
+        # Only the logs around the failover are scraped
+        window = (failover.degraded_start, failover.degraded_end)
 
-        proxy_scraper = HAProxyScraper(
-            get_proxy_log_path(),
-            old_leader_node.config.name,
-            new_leader_node.config.name,
-        )
-        if not after_the_fact:
-            proxy_scraper.recreate_locally(self.topology.proxy.api)
-        proxy_events = proxy_scraper.scrape()
+        # Do all the scraping, fetching and scraping every source at once
+        sources = self.make_sources(old_leader_node, new_leader_node)
+        if tailer is not None:
+            timelines = tailer.stop()
+        else:
+            # The proxy log is scraped whole, since the initial events are
+            # split off at the point the old leader first came UP when booting
+            sources = [
+                source
+                if isinstance(source.scraper, HAProxyScraper)
+                else source._replace(window=window)
+                for source in sources
+            ]
+            timelines = scrape_sources(
+                sources,
+                fetch=not after_the_fact,
+                # After the fact, the local copies are what's being analyzed
+                on_agents=self.scrape_on_agents and not after_the_fact,
+            )
+        for name, event in merge_timelines([source.name for source in sources], timelines):
+            print(f"{event.timestamp} {name}: {event.readable}")
+        (
+            old_patroni_events,
+            old_postgres_events,
+            new_patroni_events,
+            new_postgres_events,
+            proxy_events,
+        ) = timelines
         initial_proxy_events = []
         failover_proxy_events = []
         is_in_initial = True
@@ -100,50 +251,54 @@ class Experiment:
             if event.readable == "Old leader marked as UP":
                 is_in_initial = False
 
-        # Find the client-perceived outage and plot it
-        if not after_the_fact:
-            assert self.dg is not None
-            client_times = self.dg.get_successful_writes()
-            raw_client_times = jsonpickle.encode(client_times)
-            with open("client_times.out", "w") as fout:
-                fout.write(raw_client_times)
-            outage = plot_client_perspective(client_times)
-        else:
-            with open("client_times.out", "r") as fin:
-                client_times = jsonpickle.decode(fin.read())
-            outage = plot_client_perspective(client_times)
-
-        # Set the basetime for numbering axes
-        base_time = outage[0] + timedelta(seconds=-12)
-
-        # Plot Patroni, then Postgres, then HAProxy
-        plot_events(
-            old_events=old_patroni_events,
-            new_events=new_patroni_events,
-            title="Patroni",
-            outage=outage,
-            base_time=base_time,
-        )
-        plot_events(
-            old_events=old_postgres_events,
-            new_events=new_postgres_events,
-            title="Postgres",
-            outage=outage,
-            base_time=base_time,
-        )
-        plot_proxy_events(
-            initial_events=initial_proxy_events,
-            failover_events=failover_proxy_events,
-            outage=outage,
-            base_time=base_time,
+        save_results(
+            RESULTS_PATH,
+            outages,
+            patroni_events=(old_patroni_events, new_patroni_events),
+            postgres_events=(old_postgres_events, new_postgres_events),
+            proxy_events=(initial_proxy_events, failover_proxy_events),
         )
+        if self.plots:
+            plot_results(RESULTS_PATH, CLIENT_TIMES_PATH)
+
+    def wait_for_leader(self, subscription: Subscription, name: Union[str, None] = None) -> Node:
+        """
+        Waits for a node (the given one, or any) to take the leader key
+        :returns: The leader
+        :raises TimeoutError: If none did within LEADER_TIMEOUT
+        """
+        agent, event = subscription.wait_for_leader(name, timeout=LEADER_TIMEOUT)
+        print(f"{event.value} became the leader at {event.time_ns} ({agent}'s clock)")
+        return [node for node in self.topology.nodes if node.config.name == event.value][0]
+
+    def fetch_samples(self):
+        """
+        Stops every agent's resource sampler and fetches its samples into
+        SAMPLES_PATH, to be read with sampler.load_samples
+        """
+        os.makedirs(SAMPLES_PATH, exist_ok=True)
+
+        def fetch(agent):
+            agent.api.stop_sampler()
+            return agent.api.fetch_samples(os.path.join(SAMPLES_PATH, f"{agent.config.name}.npz"))
+
+        # The run is over by now, so one agent's missing samples shouldn't
+        # cost the others'
+        for result in self.topology.fan_out(fetch):
+            if result.error != None:
+                print(f"Warning: no samples from {result}")
+            else:
+                print(f"Samples from {result}")
 
     def run(self):
         """
         Runs the experiment and returns the name of the old and new leader
         :return tuple[str, str]: representing (old_leader_name, new_leader_name)
         """
-        self.clear_data()
+        # Pushed from every agent, so role changes are seen within
+        # milliseconds. Subscribed before booting, so no start is missed
+        subscription = Subscription(self.topology.agents)
+        subscription.start()
         self.topology.boot(verbose=True)
         write_time = 10
 
@@ -152,28 +307,46 @@ class Experiment:
                 time.sleep(1)
 
         print("Waiting for leadership...")
-        old_leader, _ = self.topology.nodes[0].get_roles()
-        old_leader_node = [
-            node for node in self.topology.nodes if node.config.name == old_leader
-        ][0]
+        old_leader_node = self.wait_for_leader(subscription)
 
         self.dg = DataGenerator(
-            self.topology.config.proxy.host, self.topology.config.proxy.proxy_port
+            self.topology.config.proxy.host,
+            self.topology.config.proxy.proxy_port,
+            freq=WRITE_PERIOD,
+            rate=self.rate,
+            clients=self.clients,
+            write_mode=self.write_mode,
+            rows_per_tick=self.rows_per_tick,
+            open_loop=self.open_loop,
         )
 
+        if self.sample_interval != None:
+            # Before writing, so an agent that can't sample stops the run
+            # rather than leaving a hole in the samples
+            for result in self.topology.fan_out(
+                lambda agent: agent.api.start_sampler(self.sample_interval)
+            ):
+                if result.error != None:
+                    raise result.error
+
         print("Writing to DB...")
         self.dg.reset()
         self.dg.start_writing()
         show_bar()
 
         print("Issuing failover...")
-        _, replicas = old_leader_node.get_roles()
-        new_leader = replicas[0]
+        new_leader = old_leader_node.get_failover_candidate()
         new_leader_node = [
             node for node in self.topology.nodes if node.config.name == new_leader
         ][0]
+        tailer = None
+        if self.tail_logs:
+            sources = self.make_sources(old_leader_node, new_leader_node)
+            tailer = LogTailer([(source.scraper, source.api) for source in sources])
+            tailer.start()
         old_leader_node.failover(new_leader)
-        new_leader_node.get_roles()
+        self.wait_for_leader(subscription, new_leader)
+        subscription.stop()
         print("Roles reestablished")
 
         print("Writing some more...")
@@ -181,8 +354,16 @@ class Experiment:
         bar_thread.start()
         self.dg.write_for_x_seconds_then_stop(10)
         bar_thread.join()
+        outage_report = self.dg.get_outage_report()
+        print(outage_report)
+        print(self.dg.get_latency_report(outage_report.outage))
+        print(self.dg.get_throughput_report())
+        print(self.dg.get_schedule_report())
+        print(self.dg.get_journal_report())
 
-        self.analyze(old_leader_node, new_leader_node)
+        self.analyze(old_leader_node, new_leader_node, tailer=tailer)
+        if self.sample_interval != None:
+            self.fetch_samples()
 
         print("Done writing")
         input("Enter anything to stop")
@@ -192,9 +373,80 @@ class Experiment:
 @click.command()
 @click.argument("config-file")
 @click.option("--is-local/--is-remote", default=False)
-def experiment(config_file, is_local):
+@click.option("--clients", default=1, help="Number of concurrent writing clients")
+@click.option("--rate", default=1.0, help="MiB written per second (across all clients)")
+@click.option(
+    "--write-mode",
+    default="insert",
+    type=click.Choice(WRITE_MODES),
+    help="How each tick's rows are sent to the database",
+)
+@click.option("--rows-per-tick", default=1, help="Rows each client writes per tick")
+@click.option(
+    "--open-loop/--closed-loop",
+    default=False,
+    help="Issue writes on a fixed schedule, even when earlier ones stall",
+)
+@click.option(
+    "--tail-logs/--fetch-logs",
+    default=False,
+    help="Pull and scrape the logs incrementally during the run, rather than all at the end",
+)
+@click.option(
+    "--scrape-on-agents",
+    is_flag=True,
+    default=False,
+    help="Scrape each log on its own agent and only fetch the events, rather than the whole log",
+)
+@click.option(
+    "--sample-interval",
+    type=click.FLOAT,
+    default=None,
+    help=f"Sample every agent's CPU, memory, disk and network usage this often (s, down to 0.01) into {SAMPLES_PATH}",
+)
+@click.option(
+    "--no-plots",
+    is_flag=True,
+    default=False,
+    help=f"Only save the analysis to {RESULTS_PATH}, without importing matplotlib",
+)
+def experiment(
+    config_file,
+    is_local,
+    clients,
+    rate,
+    write_mode,
+    rows_per_tick,
+    open_loop,
+    tail_logs,
+    scrape_on_agents,
+    sample_interval,
+    no_plots,
+):
     """
     The logic behind the command line argument which runs the experiment
     """
-    exp = Experiment(config_file=config_file, is_local=is_local)
+    exp = Experiment(
+        config_file=config_file,
+        is_local=is_local,
+        clients=clients,
+        rate=rate,
+        write_mode=write_mode,
+        rows_per_tick=rows_per_tick,
+        open_loop=open_loop,
+        plots=not no_plots,
+        tail_logs=tail_logs,
+        scrape_on_agents=scrape_on_agents,
+        sample_interval=sample_interval,
+    )
     exp.run()
+
+
+@click.command()
+@click.option("--results", default=RESULTS_PATH, help="Results saved by an experiment")
+@click.option("--client-times", default=CLIENT_TIMES_PATH, help="Client timestamps saved by an experiment")
+def plot(results, client_times):
+    """
+    The logic behind the command line argument which plots saved results
+    """
+    plot_results(results, client_times)
@@ -0,0 +1,323 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal, NamedTuple, Union
+
+# Jobs run at once on an agent, the rest wait their turn
+JOB_WORKERS = 4
+# How much of a pipe is read at a time (bytes)
+READ_SIZE = 1 << 16
+# How long to keep reading a finished job's output, in case it left a
+# background process holding its pipes open (s)
+DRAIN_TIMEOUT = 1.0
+# Finished jobs kept for callers that never read them to the end. Past this
+# the oldest are forgotten
+MAX_FINISHED_JOBS = 256
+
+JobState = Literal["queued", "running", "exited", "cancelled", "failed"]
+
+
+class JobStatus(NamedTuple):
+    """
+    Where a job is at
+    :param str id: The job's id
+    :param str command: The shell command it runs
+    :param JobState state: queued, running, exited, cancelled or failed
+        (couldn't be started)
+    :param int exit_code: How it exited, negative if killed by a signal
+        (None until it has)
+    :param dict rusage: user_time and system_time (s) and max_rss (KiB) of
+        the job, from wait4 (None until it has exited)
+    :param float submitted: When it was submitted (epoch s)
+    :param float started: When it started running (epoch s)
+    :param float finished: When it finished (epoch s)
+    :param str error: Why it failed to start (None unless it did)
+    """
+    id: str
+    command: str
+    state: JobState
+    exit_code: Union[int, None]
+    rusage: Union[dict, None]
+    submitted: float
+    started: Union[float, None]
+    finished: Union[float, None]
+    error: Union[str, None] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("exited", "cancelled", "failed")
+
+    def to_dict(self) -> dict:
+        """
+        A plain (JSON friendly) representation of this status
+        """
+        return self._asdict()
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "JobStatus":
+        """
+        Inverse of to_dict
+        """
+        return cls(**data)
+
+    def __str__(self):
+        if self.state == "exited":
+            return f"Job {self.id} ({self.command}) exited with {self.exit_code}"
+        if self.state == "failed":
+            return f"Job {self.id} ({self.command}) failed to start: {self.error}"
+        return f"Job {self.id} ({self.command}) {self.state}"
+
+
+class JobOutput(NamedTuple):
+    """
+    The output a job wrote since the given offsets
+    :param str stdout: New stdout
+    :param str stderr: New stderr
+    :param int stdout_offset: Where to read stdout from next (bytes)
+    :param int stderr_offset: Where to read stderr from next (bytes)
+    :param JobStatus status: The job's status once this output was read
+    """
+    stdout: str
+    stderr: str
+    stdout_offset: int
+    stderr_offset: int
+    status: JobStatus
+
+    def to_dict(self) -> dict:
+        """
+        A plain (JSON friendly) representation of this output
+        """
+        return {**self._asdict(), "status": self.status.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "JobOutput":
+        """
+        Inverse of to_dict
+        """
+        return cls(**{**data, "status": JobStatus.from_dict(data["status"])})
+
+
+def complete_utf8(data: bytes) -> int:
+    """
+    How much of data ends on a character boundary, so that a multibyte UTF-8
+    character cut off at the end is left for the next read
+    :param bytes data: The output read so far
+    :returns: The length of its complete prefix
+    """
+    # A character is at most 4 bytes, so its lead byte is within the last 4
+    for back in range(1, min(len(data), 4) + 1):
+        byte = data[-back]
+        if byte & 0xC0 == 0x80:
+            # A continuation byte, keep looking for the lead
+            continue
+        if byte & 0xE0 == 0xC0:
+            size = 2
+        elif byte & 0xF0 == 0xE0:
+            size = 3
+        elif byte & 0xF8 == 0xF0:
+            size = 4
+        else:
+            # ASCII (or invalid, which no amount of waiting fixes)
+            size = 1
+        return len(data) - back if size > back else len(data)
+    return len(data)
+
+
+class Job:
+    """
+    A shell command submitted to an agent, and everything it has written
+    :param str command: The shell command to run
+    """
+
+    def __init__(self, command: str):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.state: JobState = "queued"
+        self.exit_code: Union[int, None] = None
+        self.rusage: Union[dict, None] = None
+        self.submitted = time.time()
+        self.started: Union[float, None] = None
+        self.finished: Union[float, None] = None
+        self.error: Union[str, None] = None
+        # Has a caller read all of its output since it finished?
+        self.fetched = False
+        self.process: Union[subprocess.Popen, None] = None
+        self.cancelled = False
+        self.stdout = bytearray()
+        self.stderr = bytearray()
+        self.lock = threading.Lock()
+        self.exited = threading.Event()
+
+    def status(self) -> JobStatus:
+        with self.lock:
+            return JobStatus(
+                id=self.id,
+                command=self.command,
+                state=self.state,
+                exit_code=self.exit_code,
+                rusage=self.rusage,
+                submitted=self.submitted,
+                started=self.started,
+                finished=self.finished,
+                error=self.error,
+            )
+
+
+class JobManager:
+    """
+    Runs shell commands in the background on a bounded pool, keeping their
+    output so it can be read incrementally, and their exit code and resource
+    usage once they finish. A finished job is forgotten once its output has
+    been read to the end (on the next submit), or once too many have finished
+    :param int max_workers: How many jobs run at once
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS):
+        self.jobs: dict[str, Job] = {}
+        self.lock = threading.Lock()
+        self.workers = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, command: str) -> Job:
+        """
+        Queues a command, returning right away
+        """
+        job = Job(command)
+        with self.lock:
+            self.prune()
+            self.jobs[job.id] = job
+        self.workers.submit(self.run, job)
+        return job
+
+    def prune(self):
+        """
+        Forgets the finished jobs whose output has been read, and the oldest
+        of the rest beyond MAX_FINISHED_JOBS
+        """
+        finished = []
+        for job in list(self.jobs.values()):
+            with job.lock:
+                if job.finished == None:
+                    continue
+                if job.fetched:
+                    del self.jobs[job.id]
+                else:
+                    finished.append((job.finished, job.id))
+        finished.sort()
+        for _, job_id in finished[: max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id: str) -> Job:
+        """
+        :raises KeyError: If there's no such job (or it has been forgotten)
+        """
+        with self.lock:
+            return self.jobs[job_id]
+
+    def run(self, job: Job):
+        with job.lock:
+            if job.cancelled:
+                return
+            try:
+                # Its own session, so cancelling reaches everything it started
+                job.process = subprocess.Popen(
+                    ["/bin/sh", "-c", job.command],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    start_new_session=True,
+                )
+            except (OSError, ValueError, subprocess.SubprocessError) as e:
+                # e.g. out of pids or file descriptors
+                job.error = f"{type(e).__name__}: {e}"
+                job.state = "failed"
+                job.finished = time.time()
+                job.exited.set()
+                return
+            job.state = "running"
+            job.started = time.time()
+        readers = [
+            threading.Thread(target=self.drain, args=(job, pipe, buffer), daemon=True)
+            for pipe, buffer in [(job.process.stdout, job.stdout), (job.process.stderr, job.stderr)]
+        ]
+        for reader in readers:
+            reader.start()
+        _, wait_status, rusage = os.wait4(job.process.pid, 0)
+        exit_code = os.waitstatus_to_exitcode(wait_status)
+        # Reaped here, so Popen mustn't try to wait on it again
+        job.process.returncode = exit_code
+        for reader in readers:
+            reader.join(DRAIN_TIMEOUT)
+        with job.lock:
+            job.exit_code = exit_code
+            job.rusage = {
+                "user_time": rusage.ru_utime,
+                "system_time": rusage.ru_stime,
+                "max_rss": rusage.ru_maxrss,
+            }
+            job.state = "cancelled" if job.cancelled else "exited"
+            job.finished = time.time()
+        job.exited.set()
+
+    def drain(self, job: Job, pipe, buffer: bytearray):
+        """
+        Copies a pipe into a job's buffer until it closes
+        """
+        fd = pipe.fileno()
+        while True:
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                break
+            with job.lock:
+                buffer.extend(chunk)
+        pipe.close()
+
+    def output(self, job_id: str, stdout_offset: int = 0, stderr_offset: int = 0) -> JobOutput:
+        """
+        What a job has written since the given offsets. Until it's done, a
+        multibyte character cut off at the end is left for the next call
+        :raises KeyError: If there's no such job
+        """
+        job = self.get(job_id)
+        status = job.status()
+        with job.lock:
+            stdout = bytes(job.stdout[stdout_offset:])
+            stderr = bytes(job.stderr[stderr_offset:])
+            # Everything it will ever write has now been read
+            if status.done:
+                job.fetched = True
+        if not status.done:
+            # The rest of a character cut off mid-write comes with the next read
+            stdout = stdout[: complete_utf8(stdout)]
+            stderr = stderr[: complete_utf8(stderr)]
+        return JobOutput(
+            stdout=stdout.decode(errors="replace"),
+            stderr=stderr.decode(errors="replace"),
+            stdout_offset=stdout_offset + len(stdout),
+            stderr_offset=stderr_offset + len(stderr),
+            status=status,
+        )
+
+    def cancel(self, job_id: str, sig: int = signal.SIGTERM) -> JobStatus:
+        """
+        Cancels a job. A queued job never runs, a running one (and everything
+        it started) gets sig
+        :raises KeyError: If there's no such job
+        """
+        job = self.get(job_id)
+        with job.lock:
+            if job.state == "queued":
+                job.cancelled = True
+                job.state = "cancelled"
+                job.finished = time.time()
+                job.exited.set()
+            elif job.state == "running" and job.process != None:
+                job.cancelled = True
+                try:
+                    os.killpg(job.process.pid, sig)
+                except ProcessLookupError:
+                    pass
+        return job.status()
@@ -0,0 +1,462 @@
+import os
+import queue
+import select
+import threading
+import time
+from collections import deque
+from typing import Callable, Literal, NamedTuple, Union
+import psutil
+import requests
+from pe.exceptions import ApiError
+
+# A port is first checked as soon as its process starts, then again after
+# each of these delays, doubling up to the last (s), until it opens
+PORT_BACKOFF_MIN = 0.01
+PORT_BACKOFF_MAX = 0.1
+# How long the leader watch keeps going after the last long poll ended (s).
+# A subscriber polls again right away, so this only lapses once it's gone
+WATCH_IDLE = 10.0
+# How long one watch of the DCS leader key is held open (s), and how long to
+# wait before trying again if etcd can't be reached
+LEADER_WATCH_TIMEOUT = 5.0
+LEADER_RETRY = 0.5
+# How etcd reports that a key went away
+DELETED = ["delete", "expire", "compareAndDelete"]
+# Events kept on the agent for subscribers that fall behind
+EVENT_CAPACITY = 10_000
+# The longest a long poll is held open (s), well within the server's
+# socket timeout
+MAX_POLL_TIMEOUT = 20.0
+
+AgentEventKind = Literal[
+    "process_started",
+    "process_exited",
+    "port_open",
+    "port_closed",
+    "leader_changed",
+    "watch_failed",
+]
+
+
+def haproxy_ports(conf: str) -> dict[str, int]:
+    """
+    The port each listen section of an HAProxy config binds, by section name
+    """
+    ports: dict[str, int] = {}
+    section = "haproxy"
+    for line in conf.splitlines():
+        words = line.split()
+        if len(words) >= 2 and words[0] == "listen":
+            section = words[1]
+        elif len(words) >= 2 and words[0] == "bind":
+            port = words[1].rsplit(":", 1)[-1]
+            if port.isdigit():
+                ports[section] = int(port)
+    return ports
+
+
+class AgentEvent(NamedTuple):
+    """
+    Something that happened on an agent
+    :param int seq: Its position in the agent's stream, from 1
+    :param int time_ns: When the agent saw it (epoch ns, agent clock)
+    :param AgentEventKind kind: What happened
+    :param str subject: What it happened to (e.g. patroni, or a port's name)
+    :param value: The pid of a started process, the exit code of an exited
+        one, the port that opened or closed, the name of the node that now
+        holds the leader key (None if none does), or why a check failed
+    """
+    seq: int
+    time_ns: int
+    kind: AgentEventKind
+    subject: str
+    value: Union[int, str, None]
+
+    def to_dict(self) -> dict:
+        """
+        A plain (JSON friendly) representation of this event
+        """
+        return self._asdict()
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AgentEvent":
+        """
+        Inverse of to_dict
+        """
+        return cls(**data)
+
+    def __str__(self):
+        return f"{self.time_ns} {self.kind} {self.subject} ({self.value})"
+
+
+class EventLog:
+    """
+    The agent's stream of events. Subscribers long poll it for whatever
+    came after the last event they saw
+    :param int capacity: How many of the latest events are kept
+    """
+
+    def __init__(self, capacity: int = EVENT_CAPACITY):
+        self.events: deque[AgentEvent] = deque(maxlen=capacity)
+        self.seq = 0
+        self.changed = threading.Condition()
+
+    def publish(
+        self,
+        kind: AgentEventKind,
+        subject: str,
+        value: Union[int, str, None] = None,
+        time_ns: Union[int, None] = None,
+    ):
+        """
+        :param int time_ns: When it happened, if not now (epoch ns)
+        """
+        with self.changed:
+            self.seq += 1
+            when = time.time_ns() if time_ns == None else time_ns
+            self.events.append(AgentEvent(self.seq, when, kind, subject, value))
+            self.changed.notify_all()
+
+    def wait(self, after: int, timeout: float) -> list[AgentEvent]:
+        """
+        The events after seq, waiting up to timeout (s) for one if there are none
+        """
+        with self.changed:
+            if after > self.seq:
+                # The subscriber followed an earlier run of this agent
+                after = 0
+            self.changed.wait_for(lambda: self.seq > after, timeout=min(timeout, MAX_POLL_TIMEOUT))
+            return [event for event in self.events if event.seq > after]
+
+
+def wait_for_exit(pid: int):
+    """
+    Blocks until a process (not necessarily a child of this one) exits,
+    without reaping it
+    """
+    try:
+        fd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return
+    except (AttributeError, OSError):
+        # No pidfds (not Linux, or an old kernel), psutil waits its own way
+        try:
+            psutil.Process(pid).wait()
+        except psutil.NoSuchProcess:
+            pass
+        return
+    try:
+        # Readable once the process has exited
+        select.select([fd], [], [])
+    finally:
+        os.close(fd)
+
+
+class AgentWatcher:
+    """
+    Watches the processes an agent runs, the ports they listen on and which
+    node holds Patroni's leader key, publishing every change. Each process
+    and port has a thread blocked until it changes, so nothing is polled on
+    an interval. The leader key is only watched while someone is subscribed
+    to the agent's events
+    :param EventLog log: Where to publish
+    :param pids: Returns the pids of each group of managed processes (see
+        Api.managed_processes), to find the process that holds a port
+    """
+
+    def __init__(self, log: EventLog, pids: Callable[[], dict[str, list[int]]]):
+        self.log = log
+        self.pids = pids
+        self.leader_url: Union[str, None] = None
+        self.leader: Union[str, None] = None
+        self.failures: dict[str, str] = {}
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.subscribers = 0
+        self.last_poll = 0.0
+        # Bumped whenever the leader watch stops, so its thread knows to stop
+        self.generation = 0
+        self.running = False
+
+    def watch_process(self, name: str, process, started_ns: int):
+        """
+        Publishes that a process started, and (from a thread blocked on it)
+        when it exits
+        :param process: Its Popen
+        :param int started_ns: When it was started (epoch ns)
+        """
+        self.log.publish("process_started", name, process.pid, started_ns)
+        threading.Thread(target=self.follow_process, args=(name, process), daemon=True).start()
+
+    def follow_process(self, name: str, process):
+        process.wait()
+        self.log.publish("process_exited", name, process.returncode)
+
+    def watch_port(self, name: str, port: int, owner: str, process):
+        """
+        Publishes when a port opens and closes, for as long as the managed
+        process it belongs to runs. Call it right after starting the process
+        :param str owner: The group of processes that listens on it (e.g. postgres)
+        :param process: The Popen of the managed process it belongs to
+        """
+        threading.Thread(
+            target=self.report,
+            args=(f"port {name}", lambda: self.follow_port(name, port, owner, process)),
+            daemon=True,
+        ).start()
+
+    def follow_port(self, name: str, port: int, owner: str, process):
+        while True:
+            holder = self.wait_for_open(port, owner, process)
+            if holder == None:
+                return
+            self.log.publish("port_open", name, port)
+            # A listening socket lives as long as the process that holds it
+            wait_for_exit(holder)
+            self.log.publish("port_closed", name, port)
+
+    def wait_for_open(self, port: int, owner: str, process) -> Union[int, None]:
+        """
+        Checks the owner's sockets right away, then with a short backoff,
+        until one of its processes listens on the port
+        :returns: That process' pid, or None if the managed process exited first
+        """
+        delay = PORT_BACKOFF_MIN
+        while process.poll() == None:
+            holder = self.listener(self.pids().get(owner, []), port)
+            if holder != None:
+                return holder
+            time.sleep(delay)
+            delay = min(delay * 2, PORT_BACKOFF_MAX)
+        return None
+
+    def listener(self, pids: list[int], port: int) -> Union[int, None]:
+        """
+        Which of the given processes listens on the port. Read from each
+        process' own sockets, so nothing ever connects to (and shows up in
+        the logs of) the watched servers. The oldest process (e.g. the
+        postmaster) is checked first
+        """
+        for pid in sorted(pids):
+            try:
+                connections = psutil.Process(pid).net_connections(kind="tcp")
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                continue
+            for connection in connections:
+                if connection.status == psutil.CONN_LISTEN and connection.laddr.port == port:
+                    return pid
+        return None
+
+    def watch_leader(self, etcd: str, scope: str, namespace: str = "/service"):
+        """
+        Follows the leader key Patroni keeps in etcd (over the v2 api, as
+        Patroni itself does), rather than asking Patroni
+        :param str etcd: host:port of the etcd Patroni uses
+        :param str scope: Patroni's scope (the cluster's name)
+        :param str namespace: Patroni's namespace
+        """
+        with self.lock:
+            self.leader_url = f"http://{etcd}/v2/keys/{namespace.strip('/')}/{scope}/leader"
+
+    def watching(self, generation: int) -> bool:
+        """
+        Should the leader watch of this generation keep going? It stops once
+        nobody has been subscribed for WATCH_IDLE
+        """
+        with self.lock:
+            if generation != self.generation:
+                return False
+            if self.subscribers > 0 or time.monotonic() - self.last_poll < WATCH_IDLE:
+                return True
+            self.running = False
+            self.generation += 1
+            return False
+
+    def subscribe(self):
+        """
+        Marks the start of a long poll, starting the leader watch if it had stopped
+        """
+        with self.lock:
+            self.subscribers += 1
+            if self.running:
+                return
+            self.running = True
+            self.generation += 1
+            generation = self.generation
+        threading.Thread(target=self.follow_leader, args=(generation,), daemon=True).start()
+
+    def unsubscribe(self):
+        """
+        Marks the end of a long poll
+        """
+        with self.lock:
+            self.subscribers -= 1
+            self.last_poll = time.monotonic()
+
+    def report(self, name: str, check: Callable[[], None]):
+        """
+        Runs a check, publishing why it failed if it did. A check that keeps
+        failing the same way is only reported once
+        """
+        try:
+            check()
+        except Exception as e:
+            self.failed(name, e)
+        else:
+            self.failures.pop(name, None)
+
+    def failed(self, name: str, e: Exception):
+        failure = f"{type(e).__name__}: {e}"
+        if self.failures.get(name) != failure:
+            self.failures[name] = failure
+            self.log.publish("watch_failed", name, failure)
+
+    def follow_leader(self, generation: int):
+        """
+        Long polls etcd for changes to the leader key, for as long as the
+        watch runs
+        """
+        index = None
+        watched = None
+        while self.watching(generation):
+            with self.lock:
+                url = self.leader_url
+            if url == None:
+                time.sleep(LEADER_RETRY)
+                continue
+            if url != watched:
+                # Patroni was started against another cluster, start over
+                watched, index = url, None
+            try:
+                index = self.read_leader(url, index)
+            except requests.Timeout:
+                # Nothing changed in a while, watch again from the same index
+                pass
+            except (requests.RequestException, ValueError) as e:
+                # e.g. etcd isn't up yet
+                self.failed("follow_leader", e)
+                index = None
+                time.sleep(LEADER_RETRY)
+            else:
+                self.failures.pop("follow_leader", None)
+
+    def read_leader(self, url: str, index: Union[int, None]) -> Union[int, None]:
+        """
+        Reads the leader key, or (given the etcd index to watch from) waits
+        for its next change, and publishes who holds it if that changed
+        :returns: The index to watch from next
+        """
+        if index == None:
+            resp = self.session.get(url, timeout=(3.05, LEADER_WATCH_TIMEOUT))
+        else:
+            resp = self.session.get(
+                url,
+                params={"wait": "true", "waitIndex": index},
+                timeout=(3.05, LEADER_WATCH_TIMEOUT),
+            )
+        data = resp.json()
+        if data.get("errorCode") == 401:
+            # The index was compacted away, so read the key afresh
+            return None
+        if data.get("errorCode") not in (None, 100):
+            raise ValueError(data.get("message"))
+        node = data.get("node") or {}
+        # A deleted or expired key comes back without its value
+        leader = node.get("value") if data.get("action") not in DELETED else None
+        with self.lock:
+            # A watch that stopped may still be finishing its last poll
+            if leader != self.leader:
+                self.leader = leader
+                self.log.publish("leader_changed", "patroni", leader)
+        if index == None:
+            # Watch for whatever comes after the state just read
+            return int(resp.headers.get("X-Etcd-Index", data.get("index", 0))) + 1
+        return node.get("modifiedIndex", index) + 1
+
+
+class Subscription:
+    """
+    Follows the event streams of many agents at once (one long poll each),
+    merging them into one queue as they arrive
+    :param agents: The agents to follow
+    """
+
+    def __init__(self, agents: list):
+        self.agents = agents
+        self.events: "queue.Queue[tuple[str, AgentEvent]]" = queue.Queue()
+        self.stopping = threading.Event()
+        self.threads: list[threading.Thread] = []
+        self.started_ns = 0
+
+    def start(self):
+        """
+        Starts following. Events from before now (e.g. from an earlier run
+        of an agent) are dropped, so agents' clocks must roughly agree
+        """
+        self.started_ns = time.time_ns()
+        self.stopping.clear()
+        self.threads = [
+            threading.Thread(target=self.follow, args=(agent,), daemon=True)
+            for agent in self.agents
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stops following, once each agent's current long poll returns
+        """
+        self.stopping.set()
+
+    def follow(self, agent):
+        after = 0
+        while not self.stopping.is_set():
+            try:
+                events = agent.api.events(after, timeout=5.0)
+            except (ApiError, requests.RequestException):
+                # e.g. the agent is restarting, try again shortly
+                self.stopping.wait(0.1)
+                continue
+            for event in events:
+                after = max(after, event.seq)
+                if event.time_ns >= self.started_ns:
+                    self.events.put((agent.config.name, event))
+
+    def wait_for(
+        self, matches: Callable[[str, AgentEvent], bool], timeout: Union[float, None] = None
+    ) -> tuple[str, AgentEvent]:
+        """
+        Waits for the next event that matches, dropping the others (but
+        warning of any failed watch on an agent)
+        :param matches: Given (agent name, event), is this the one?
+        :param float timeout: Give up after this long (s)
+        :raises TimeoutError: If no event matched in time
+        """
+        deadline = None if timeout == None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline == None else deadline - time.monotonic()
+            if remaining != None and remaining <= 0:
+                raise TimeoutError("No matching agent event")
+            try:
+                name, event = self.events.get(timeout=remaining)
+            except queue.Empty:
+                raise TimeoutError("No matching agent event")
+            if matches(name, event):
+                return name, event
+            if event.kind == "watch_failed":
+                print(f"Warning: {name} {event}")
+
+    def wait_for_leader(
+        self, name: Union[str, None] = None, timeout: Union[float, None] = None
+    ) -> tuple[str, AgentEvent]:
+        """
+        Waits until a node (the given one, or any) holds the leader key, as
+        seen by any agent. The event's value is the leader's name
+        :raises TimeoutError: If none did in time
+        """
+        return self.wait_for(
+            lambda agent, event: event.kind == "leader_changed"
+            and event.value != None
+            and (name == None or event.value == name),
+            timeout,
+        )
@@ -0,0 +1,235 @@
+import io
+import threading
+import time
+from typing import Callable, Union
+import numpy as np
+import psutil
+
+# Capacity of each ring buffer (samples), 10 minutes at 10ms
+SAMPLE_CAPACITY = 60_000
+# The shortest interval between samples (s)
+MIN_INTERVAL = 0.01
+# How often the pids of each process group are looked up again (s). Finding
+# Postgres' pids walks /proc, too costly to do on every sample
+TARGETS_INTERVAL = 0.5
+
+# Counters are cumulative (as the OS keeps them), so rates are differences
+# between samples. time_ns is an int64 (epoch ns), the rest are float64
+# times in s and sizes in bytes
+HOST_FIELDS = [
+    "time_ns",
+    "cpu_user",
+    "cpu_system",
+    "cpu_iowait",
+    "mem_used",
+    "disk_read_bytes",
+    "disk_write_bytes",
+    "disk_write_count",
+    "disk_write_time",
+    "disk_busy_time",
+    "net_bytes_sent",
+    "net_bytes_recv",
+]
+# Summed over every process in the group. processes is how many were alive,
+# and rss is theirs. The counters include the last values seen of processes
+# that have since exited, so they never go backwards
+PROCESS_FIELDS = [
+    "time_ns",
+    "processes",
+    "cpu_user",
+    "cpu_system",
+    "rss",
+    "read_bytes",
+    "write_bytes",
+]
+
+
+class RingBuffer:
+    """
+    A fixed-size buffer of samples that overwrites the oldest once full, so
+    sampling for any length of time uses the same memory
+    :param list[str] fields: The name of each column
+    :param int capacity: How many samples are kept
+    """
+
+    def __init__(self, fields: list[str], capacity: int):
+        self.dtype = np.dtype(
+            [(field, np.int64 if field == "time_ns" else np.float64) for field in fields]
+        )
+        self.rows = np.zeros(capacity, dtype=self.dtype)
+        self.count = 0
+
+    def append(self, row: tuple):
+        self.rows[self.count % len(self.rows)] = row
+        self.count += 1
+
+    def snapshot(self) -> np.ndarray:
+        """
+        The samples held, oldest first
+        """
+        if self.count <= len(self.rows):
+            return self.rows[: self.count].copy()
+        start = self.count % len(self.rows)
+        return np.concatenate([self.rows[start:], self.rows[:start]])
+
+
+def host_sample() -> tuple:
+    cpu = psutil.cpu_times()
+    disk = psutil.disk_io_counters()
+    net = psutil.net_io_counters()
+    return (
+        time.time_ns(),
+        cpu.user,
+        cpu.system,
+        getattr(cpu, "iowait", 0.0),
+        psutil.virtual_memory().used,
+        disk.read_bytes if disk else 0,
+        disk.write_bytes if disk else 0,
+        disk.write_count if disk else 0,
+        disk.write_time / 1e3 if disk else 0.0,
+        getattr(disk, "busy_time", 0) / 1e3 if disk else 0.0,
+        net.bytes_sent,
+        net.bytes_recv,
+    )
+
+
+class ResourceSampler:
+    """
+    Samples the host's and the managed processes' resource usage on a short
+    interval, in the background, into ring buffers that are fetched in bulk
+    after the run. This shows whether a slow failover step was waiting on
+    disk or CPU rather than on Patroni itself
+    :param targets: Returns the pids of each process group to sample (e.g.
+        {"postgres": [...]}), groups can come and go. Called every
+        TARGETS_INTERVAL rather than every sample
+    :param float interval: Time between samples (s)
+    :param int capacity: Samples kept per series
+    """
+
+    def __init__(
+        self,
+        targets: Callable[[], dict[str, list[int]]],
+        interval: float = 0.1,
+        capacity: int = SAMPLE_CAPACITY,
+    ):
+        self.targets = targets
+        self.interval = max(interval, MIN_INTERVAL)
+        self.capacity = capacity
+        self.series: dict[str, RingBuffer] = {}
+        # Kept between samples, since psutil caches per process state
+        self.processes: dict[int, psutil.Process] = {}
+        self.pids: dict[str, list[int]] = {}
+        # The counters each process of a group last had, and the totals of
+        # the group's processes that have since exited
+        self.last: dict[str, dict[int, tuple]] = {}
+        self.retired: dict[str, list[float]] = {}
+        self.stopping = threading.Event()
+        self.thread: Union[threading.Thread, None] = None
+        self.lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """
+        Starts sampling from scratch, dropping any earlier samples
+        """
+        self.stop()
+        with self.lock:
+            self.series = {"host": RingBuffer(HOST_FIELDS, self.capacity)}
+        self.processes.clear()
+        self.pids, self.last, self.retired = {}, {}, {}
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        next_sample = time.monotonic()
+        next_targets = next_sample
+        while not self.stopping.is_set():
+            if time.monotonic() >= next_targets:
+                self.pids = self.targets()
+                next_targets = time.monotonic() + TARGETS_INTERVAL
+            self.sample()
+            # On a fixed schedule, however long the sample itself took
+            next_sample += self.interval
+            delay = next_sample - time.monotonic()
+            if delay < 0:
+                next_sample = time.monotonic()
+                delay = 0
+            self.stopping.wait(delay)
+
+    def sample(self):
+        rows = {"host": host_sample()}
+        for name, pids in self.pids.items():
+            rows[name] = self.process_sample(name, pids)
+        with self.lock:
+            for name, row in rows.items():
+                if name not in self.series:
+                    self.series[name] = RingBuffer(PROCESS_FIELDS, self.capacity)
+                self.series[name].append(row)
+
+    def process_sample(self, group: str, pids: list[int]) -> tuple:
+        now = time.time_ns()
+        last = self.last.setdefault(group, {})
+        retired = self.retired.setdefault(group, [0.0] * 4)
+        alive = 0
+        rss = 0.0
+        current: dict[int, tuple] = {}
+        for pid in pids:
+            try:
+                process = self.processes.get(pid)
+                if process == None:
+                    process = self.processes[pid] = psutil.Process(pid)
+                with process.oneshot():
+                    cpu = process.cpu_times()
+                    memory = process.memory_info()
+                    disk = process.io_counters()
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                self.processes.pop(pid, None)
+                continue
+            alive += 1
+            rss += memory.rss
+            current[pid] = (cpu.user, cpu.system, disk.read_bytes, disk.write_bytes)
+        # Whatever exited keeps counting with what it had last been seen using
+        for pid, counters in last.items():
+            if pid not in current:
+                for ix, value in enumerate(counters):
+                    retired[ix] += value
+        self.last[group] = current
+        totals = list(retired)
+        for counters in current.values():
+            for ix, value in enumerate(counters):
+                totals[ix] += value
+        return (now, alive, totals[0], totals[1], rss, totals[2], totals[3])
+
+    def snapshot(self) -> dict[str, np.ndarray]:
+        """
+        Every series' samples, oldest first
+        """
+        with self.lock:
+            return {name: series.snapshot() for name, series in self.series.items()}
+
+
+def samples_to_bytes(samples: dict[str, np.ndarray]) -> bytes:
+    """
+    Packs a snapshot as an .npz (one structured array per series)
+    """
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **samples)
+    return buffer.getvalue()
+
+
+def load_samples(path: str) -> dict[str, np.ndarray]:
+    """
+    Inverse of samples_to_bytes, from a fetched file
+    """
+    with np.load(path) as samples:
+        return {name: samples[name] for name in samples.files}
@@ -0,0 +1,117 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import ClosingIterator
+
+# Connections served at once. Each keep-alive connection holds a worker until
+# it closes or idles out, so this comfortably exceeds the orchestrator's pool
+CONNECTION_WORKERS = 32
+# Connections accepted beyond the workers (waiting for one) before new
+# connections are turned away with a 503
+CONNECTION_BACKLOG = 32
+# Endpoints that move or crunch a lot of data. Only a few run at a time, so
+# they can never tie up the workers the control endpoints need
+BULK_ENDPOINTS = ["/fetch_file", "/fetch_folder", "/scrape", "/fetch_samples"]
+BULK_WORKERS = 4
+# How long a bulk request waits for a slot before it's turned away (s)
+BULK_WAIT = 30
+# How long a connection may stall (idle keep-alive, or mid request) before
+# it's dropped, freeing its worker (s)
+SOCKET_TIMEOUT = 30
+
+BUSY_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"Content-Length: 4\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b"Busy"
+)
+
+
+class BulkLimiter:
+    """
+    WSGI middleware that bounds how many bulk requests run at once. The slot
+    is held until the (possibly streamed) response has been fully sent
+    :param app: The WSGI app to wrap
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.slots = threading.BoundedSemaphore(BULK_WORKERS)
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") not in BULK_ENDPOINTS:
+            return self.app(environ, start_response)
+        if not self.slots.acquire(timeout=BULK_WAIT):
+            start_response("503 Service Unavailable", [("Content-Type", "text/plain")])
+            return [b"Busy"]
+        try:
+            return ClosingIterator(self.app(environ, start_response), self.slots.release)
+        except BaseException:
+            self.slots.release()
+            raise
+
+
+class AgentRequestHandler(WSGIRequestHandler):
+    """
+    Keeps connections alive (so the orchestrator's pooled sessions reuse
+    them), but drops any that stall
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = SOCKET_TIMEOUT
+
+
+class AgentServer(BaseWSGIServer):
+    """
+    The agent's WSGI server. Connections are served by a bounded pool of
+    threads, so a long log transfer never blocks e.g. /ping or /stop_patroni,
+    and bulk endpoints are further limited by BulkLimiter. Once every worker
+    is busy and the backlog is full, connections get an immediate 503 rather
+    than queueing without bound
+    :param str host: Interface to listen on
+    :param int port: Port to listen on
+    :param app: The WSGI app to serve
+    """
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app):
+        super().__init__(host, port, BulkLimiter(app), handler=AgentRequestHandler)
+        self.workers = ThreadPoolExecutor(
+            max_workers=CONNECTION_WORKERS, thread_name_prefix="agent"
+        )
+        self.slots = threading.BoundedSemaphore(CONNECTION_WORKERS + CONNECTION_BACKLOG)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self.reject(request)
+            return
+        self.workers.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def reject(self, request):
+        """
+        Answers a connection there's no room for with a 503, without reading
+        its request (so it can't hold up the accept loop)
+        """
+        try:
+            request.setblocking(False)
+            request.send(BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        if hasattr(self, "workers"):
+            self.workers.shutdown(wait=False, cancel_futures=True)
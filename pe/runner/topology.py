@@ -1,10 +1,33 @@
-import os
-import jsonpickle
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+from typing import Any, Callable, NamedTuple, Union
 from pe.config.parse import TopologyConfig
 from pe.runner.agent import Agent, Node, Proxy
 import time
 
+# Clears out what a previous run left on an agent: its servers (the [p] stops
+# pkill -f matching the job's own shell) and its data folders
+SETUP_COMMAND = (
+    "pkill -9 etcd; pkill -9 -f 'bin/[p]atroni'; pkill -9 haproxy; "
+    "rm -rf pe/data && mkdir -p pe/data/etcd pe/data/haproxy pe/data/patroni pe/data/postgres"
+)
+
+class FanOutResult(NamedTuple):
+    """
+    What one agent returned from a fan-out call
+    :param str name: The agent's name
+    :param Any value: What the call returned (None if it raised)
+    :param Exception error: What the call raised, if anything
+    """
+    name: str
+    value: Any
+    error: Union[Exception, None]
+
+    def __str__(self):
+        if self.error != None:
+            return f"{self.name}: failed with {self.error!r}"
+        return f"{self.name}: {self.value}"
+
 
 class Topology:
     """
@@ -31,22 +54,68 @@ class Topology:
         result.append(self.proxy)
         return result
 
+    def fan_out(
+        self, call: Callable[[Agent], Any], agents: Union[list[Agent], None] = None
+    ) -> list[FanOutResult]:
+        """
+        Runs the same call against every agent at once, over each agent's
+        pooled session. Errors are collected rather than raised, so one bad
+        agent doesn't hide the others' results
+        :param call: What to run, given an agent (e.g. lambda a: a.api.ping())
+        :param list[Agent] agents: Who to run it on (every agent by default)
+        :returns: One result per agent, in the order of agents
+        """
+        agents = self.agents if agents == None else agents
+
+        def run(agent: Agent) -> FanOutResult:
+            try:
+                return FanOutResult(agent.config.name, call(agent), None)
+            except Exception as e:
+                return FanOutResult(agent.config.name, None, e)
+
+        with ThreadPoolExecutor(max_workers=max(1, len(agents))) as threads:
+            return list(threads.map(run, agents))
+
+    def run_job(
+        self, command: str, agents: Union[list[Agent], None] = None
+    ) -> list[FanOutResult]:
+        """
+        Runs a shell command on every agent at once, and waits until it has
+        actually finished everywhere
+        :param str command: The shell command to run
+        :param list[Agent] agents: Who to run it on (every agent by default)
+        :returns: Each agent's final JobStatus (see Api.run_job)
+        """
+        return self.fan_out(lambda agent: agent.api.run_job(command), agents)
+
+    def setup(self):
+        """
+        Runs SETUP_COMMAND as a job on every machine of the topology, once
+        their apis are up. Locally they all share one machine, so it's run once
+        :raises ApiError: If it failed anywhere
+        """
+        agents = self.agents[:1] if self.is_local else self.agents
+        for result in self.fan_out(lambda agent: agent.api.exec_command(SETUP_COMMAND), agents):
+            if result.error != None:
+                raise result.error
+
     def boot(self, verbose=True):
         """
-        Start up every node in the topology
+        Start up every node in the topology, from a clean slate
         """
-        if self.is_local:
-            if verbose:
-                print("Cleaning up local instances...")
-            # Kill any etcd/patroni servers
-            os.system('pkill -9 etcd')
-            os.system('pkill -9 -f "bin/patroni"')
-            os.system('pkill -9 haproxy')
+        if verbose:
+            print("Starting agents...")
+        for agent in tqdm(self.agents, disable=not verbose):
+            agent.start_api()
+
+        if verbose:
+            print("Cleaning up previous runs...")
+        self.setup()
 
         if verbose:
             print("Booting topology...")
         for agent in tqdm(self.agents, disable=not verbose):
-            agent.boot(topology=self.config)
+            agent.start(topology=self.config)
     
     def stop(self, verbose=True):
         """
@@ -54,8 +123,9 @@ class Topology:
         """
         if verbose:
             print("Stopping topology...")
-        for agent in tqdm(self.agents, disable=not verbose):
-            agent.stop()
+        for result in self.fan_out(lambda agent: agent.stop()):
+            if result.error != None:
+                raise result.error
 
 
 if __name__ == "__main__":
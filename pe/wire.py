@@ -0,0 +1,39 @@
+"""
+The format of everything sent between the orchestrator and the agents (and
+of the saved results). Payloads are plain JSON dicts built by each type's
+to_dict, wrapped in a small envelope naming what they are and which version
+of the format wrote them, so nothing arbitrary is ever decoded on either end
+"""
+from typing import Any, Literal
+
+# Bump whenever a to_dict/from_dict changes shape
+WIRE_VERSION = 1
+
+Kind = Literal["topology", "patroni_config", "timeline", "results"]
+
+
+def encode(kind: Kind, data: Any) -> dict:
+    """
+    Wraps a plain (JSON friendly) payload in its envelope
+    :param Kind kind: What the payload is
+    :param data: The payload, e.g. TopologyConfig.to_dict()
+    """
+    return {"version": WIRE_VERSION, "kind": kind, "data": data}
+
+
+def decode(kind: Kind, message: Any) -> Any:
+    """
+    Unwraps a payload, checking it's what was expected
+    :param Kind kind: What the payload should be
+    :param message: An envelope made by encode
+    :raises ValueError: If the message isn't a kind payload of this version
+    """
+    if not isinstance(message, dict) or "data" not in message:
+        raise ValueError(f"Expected a {kind} envelope")
+    if message.get("kind") != kind:
+        raise ValueError(f"Expected a {kind} payload, got {message.get('kind')}")
+    if message.get("version") != WIRE_VERSION:
+        raise ValueError(
+            f"Can't read version {message.get('version')} of {kind}, only {WIRE_VERSION}"
+        )
+    return message["data"]
@@ -14,6 +14,7 @@ setup(
     entry_points={
         "console_scripts": [
             "experiment = pe.runner.experiment:experiment",
+            "plot-results = pe.runner.experiment:plot",
             "start-api = pe.runner.api:start_api",
         ]
     },
@@ -0,0 +1,77 @@
+import pytest
+from pe.data_generator.histogram import (
+    BUCKETS,
+    SUB_BUCKETS,
+    LatencyHistogram,
+    WindowedHistogram,
+    bucket_index,
+    bucket_upper_bound,
+)
+
+# Small values, every power of two boundary, and some in between
+VALUES = list(range(4 * SUB_BUCKETS)) + [
+    (1 << shift) + delta for shift in range(6, 64) for delta in (-1, 0, 1, 12345)
+]
+VALUES = sorted(value for value in VALUES if value < 1 << 64)
+
+
+def test_small_values_get_their_own_bucket():
+    for value in range(SUB_BUCKETS):
+        assert bucket_index(value) == value
+        assert bucket_upper_bound(value) == value
+
+
+def test_buckets_are_ordered_and_bounded():
+    indexes = [bucket_index(value) for value in VALUES]
+    assert indexes == sorted(indexes)
+    assert max(indexes) < BUCKETS
+    assert bucket_index((1 << 64) - 1) == BUCKETS - 1
+
+
+def test_upper_bound_is_within_the_relative_error():
+    for value in VALUES:
+        upper = bucket_upper_bound(bucket_index(value))
+        assert value <= upper <= value + value // SUB_BUCKETS
+        # The bound is the last value of the bucket
+        assert bucket_index(upper) == bucket_index(value)
+        assert bucket_index(upper + 1) == bucket_index(value) + 1
+
+
+def test_percentiles():
+    histogram = LatencyHistogram()
+    for value in range(1, 1001):
+        histogram.record(value)
+    assert histogram.total == 1000
+    assert 500 <= histogram.percentile(50) <= 500 * (1 + 1 / SUB_BUCKETS)
+    assert 990 <= histogram.percentile(99) <= 1000
+    # Never past the largest value actually recorded
+    assert histogram.percentile(100) == 1000
+    assert histogram.percentile(0) == 1
+
+
+def test_percentile_of_an_empty_histogram():
+    with pytest.raises(ValueError):
+        LatencyHistogram().percentile(50)
+
+
+def test_merge():
+    low, high = LatencyHistogram(), LatencyHistogram()
+    for value in range(10):
+        low.record(value)
+        high.record(1000 + value)
+    low.merge(high)
+    assert low.total == 20
+    assert low.max == 1009
+    assert low.percentile(50) == 9
+    assert low.percentile(100) == 1009
+
+
+def test_windows_are_counted_in_one_phase_by_their_midpoint():
+    windowed = WindowedHistogram(window=1.0)
+    for at in [0.1, 0.9, 1.5, 2.2, 2.7]:
+        windowed.record(int(at * 1000), at)
+    # [0, 1) is centred at 0.5, [1, 2) at 1.5 and [2, 3) at 2.5
+    assert windowed.between(0.0, 1.5).total == 2
+    assert windowed.between(1.5, 2.5).total == 1
+    assert windowed.between(2.5, 10.0).total == 2
+    assert windowed.between(0.0, 10.0).max == 2700
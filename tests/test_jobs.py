@@ -0,0 +1,97 @@
+import signal
+import pytest
+from pe.runner import jobs
+from pe.runner.jobs import JobManager, complete_utf8
+
+# Generous, these only bound how long a broken test hangs (s)
+WAIT = 10
+
+
+@pytest.fixture
+def manager():
+    manager = JobManager(max_workers=1)
+    yield manager
+    for job in list(manager.jobs.values()):
+        manager.cancel(job.id, signal.SIGKILL)
+    manager.workers.shutdown(wait=True)
+
+
+def finish(manager: JobManager, command: str) -> jobs.JobStatus:
+    job = manager.submit(command)
+    assert job.exited.wait(WAIT)
+    return job.status()
+
+
+def test_exit_code_and_output(manager):
+    job = manager.submit("echo out; echo err >&2; exit 3")
+    assert job.exited.wait(WAIT)
+    output = manager.output(job.id)
+    assert (output.stdout, output.stderr) == ("out\n", "err\n")
+    assert (output.stdout_offset, output.stderr_offset) == (4, 4)
+    assert output.status.state == "exited"
+    assert output.status.exit_code == 3
+    assert output.status.rusage["max_rss"] > 0
+    # Read from the offsets, nothing is new
+    assert manager.output(job.id, 4, 4).stdout == ""
+
+
+def test_cancel_a_running_job(manager):
+    job = manager.submit("sleep 30")
+    for _ in range(WAIT * 100):
+        if job.status().state == "running":
+            break
+        job.exited.wait(0.01)
+    manager.cancel(job.id)
+    assert job.exited.wait(WAIT)
+    status = job.status()
+    assert status.state == "cancelled"
+    assert status.exit_code == -signal.SIGTERM
+
+
+def test_cancel_a_queued_job(manager):
+    blocker = manager.submit("sleep 30")
+    queued = manager.submit("echo never")
+    status = manager.cancel(queued.id)
+    assert status.state == "cancelled"
+    manager.cancel(blocker.id)
+    assert blocker.exited.wait(WAIT)
+    assert queued.status().started == None
+    assert manager.output(queued.id).stdout == ""
+
+
+def test_finished_jobs_are_pruned_once_read(manager):
+    read = finish(manager, "true")
+    unread = finish(manager, "true")
+    manager.output(read.id)
+    manager.submit("true")
+    assert read.id not in manager.jobs
+    assert unread.id in manager.jobs
+    with pytest.raises(KeyError):
+        manager.output(read.id)
+
+
+def test_only_so_many_unread_jobs_are_kept(manager, monkeypatch):
+    monkeypatch.setattr(jobs, "MAX_FINISHED_JOBS", 2)
+    finished = [finish(manager, "true").id for _ in range(4)]
+    manager.submit("true")
+    assert [job_id in manager.jobs for job_id in finished] == [False, False, True, True]
+
+
+def test_split_characters_are_held_back(manager):
+    job = manager.submit("printf 'a\\303'; sleep 30")
+    for _ in range(WAIT * 100):
+        if len(job.stdout) == 2:
+            break
+        job.exited.wait(0.01)
+    output = manager.output(job.id)
+    assert (output.stdout, output.stdout_offset) == ("a", 1)
+
+
+def test_complete_utf8():
+    data = "aé€😀".encode()
+    boundaries = [0, 1, 3, 6, 10]
+    for end in range(len(data) + 1):
+        assert complete_utf8(data[:end]) == max(b for b in boundaries if b <= end)
+    # Invalid bytes aren't waited on
+    assert complete_utf8(b"a\xff") == 2
+    assert complete_utf8(b"\x80\x80\x80\x80\x80") == 5
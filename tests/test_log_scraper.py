@@ -0,0 +1,108 @@
+import mmap
+from datetime import datetime, timedelta
+import pytest
+from pe.log_scraper.log_scraper import PatroniScraper
+
+START = datetime(2023, 6, 20, 10, 59, 50)
+# A new leader's Patroni log: following, promoting itself, then leading.
+# Lines without a stamp (e.g. tracebacks) are mixed in
+MESSAGES = (
+    ["INFO: no action. I am (n1), a secondary, and following a leader (n0)"] * 4
+    + [None, "INFO: promoted self to leader by acquiring session lock", None, None]
+    + ["INFO: Cleaning up failover key after acquiring leader lock"]
+    + ["INFO: no action. I am (n1), the leader with the lock"] * 5
+    + ["INFO: no action. I am (n1), a secondary, and following a leader (n0)"]
+)
+
+
+def stamp(ix: int) -> datetime:
+    # Spread over an hour change, so the parser's cached hour is exercised
+    return START + timedelta(seconds=ix * 1.5)
+
+
+def make_log(messages: list, first: int = 0) -> tuple[bytes, list[tuple[int, int, datetime]]]:
+    """
+    The log, and the (start, end, stamp) of each of its stamped lines
+    :param int first: The index of the first message, which sets its stamp
+    """
+    log, stamped = b"", []
+    for ix, message in enumerate(messages, first):
+        if message is None:
+            line = b"Traceback (most recent call last):\n"
+        else:
+            when = stamp(ix)
+            line = f"{when:%Y-%m-%d %H:%M:%S},{when.microsecond // 1000:03d} {message}\n".encode()
+            stamped.append((len(log), len(log) + len(line), stamp(ix)))
+        log += line
+    # The last line isn't terminated yet
+    start, _, when = stamped[-1]
+    return log[:-1], stamped[:-1] + [(start, len(log) - 1, when)]
+
+
+def scraper_for(path) -> PatroniScraper:
+    scraper = PatroniScraper(str(path), old=False)
+    # The log is local already
+    scraper.local_path = str(path)
+    return scraper
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    log, stamped = make_log(MESSAGES)
+    path = tmp_path / "patroni.log"
+    path.write_bytes(log)
+    return path, stamped
+
+
+def test_scrape(log_file):
+    path, _ = log_file
+    events = scraper_for(path).scrape()
+    assert [event.readable for event in events] == [
+        "Last heartbeat as follower",
+        "Promoting self",
+        "Cleaning up DCS",
+        "First heartbeat as leader",
+    ]
+    assert events[0].timestamp == stamp(3)
+    assert events[3].timestamp == stamp(9)
+
+
+def test_seek_lands_after_the_last_earlier_line(log_file):
+    path, stamped = log_file
+    scraper = scraper_for(path)
+    with open(path, "rb") as fin, mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as log:
+        assert scraper.seek(log, START - timedelta(days=1)) == 0
+        assert scraper.seek(log, stamp(len(MESSAGES))) == len(log)
+        for ix, (_, _, when) in enumerate(stamped):
+            # Unstamped lines just before a line stay with it
+            expected = stamped[ix - 1][1] if ix > 0 else 0
+            assert scraper.seek(log, when) == expected
+            assert scraper.seek(log, when - timedelta(microseconds=1)) == expected
+            assert scraper.seek(log, when + timedelta(microseconds=1)) == stamped[ix][1]
+
+
+def test_scrape_a_window(log_file, tmp_path):
+    path, _ = log_file
+    # Lines stamped from the start of the window up to (not including) its end
+    within, _ = make_log(MESSAGES[5:10], first=5)
+    only = tmp_path / "within.log"
+    only.write_bytes(within + b"\n")
+    window = (stamp(5), stamp(10))
+    assert scraper_for(path).scrape(window, pad=timedelta(0)) == scraper_for(only).scrape()
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, 1 << 20])
+def test_feeding_chunks_matches_a_full_scrape(log_file, size):
+    path, _ = log_file
+    data = path.read_bytes()
+    scraper = scraper_for(path)
+    expected = scraper.scrape()
+    scraper.reset()
+    events = []
+    for ix in range(0, len(data), size):
+        events.extend(scraper.feed(data[ix : ix + size], str(path)))
+    # The unterminated last line only comes out once nothing more is coming
+    events.extend(scraper.flush())
+    events.extend(scraper.finish())
+    events.sort(key=lambda e: e.timestamp)
+    assert events == expected
@@ -0,0 +1,52 @@
+from pe.log_scraper import matcher
+from pe.log_scraper.matcher import MarkerMatcher
+
+LOG = (
+    b"noise\n"
+    b"first alpha\n"
+    b"alpha and beta, alpha again\n"
+    b"more noise\n"
+    b"beta at the end"
+)
+
+
+def test_find_reports_each_marker_once_per_line():
+    hits = MarkerMatcher(["alpha", "beta"]).find(LOG)
+    second, third, last = LOG.index(b"first"), LOG.index(b"alpha and"), LOG.index(b"beta at")
+    assert hits == [
+        (second, 0, third),
+        (third, 0, LOG.index(b"more")),
+        (third, 1, LOG.index(b"more")),
+        # The last line has no newline, it ends with the buffer
+        (last, 1, len(LOG)),
+    ]
+
+
+def test_find_within_a_range():
+    start, end = LOG.index(b"alpha and"), LOG.index(b"beta at")
+    hits = MarkerMatcher(["alpha", "beta"]).find(LOG, start, end)
+    assert [ix for _, ix, _ in hits] == [0, 1]
+    assert all(start <= line_start and line_end <= end for line_start, _, line_end in hits)
+
+
+def test_find_nothing():
+    assert MarkerMatcher(["gamma"]).find(LOG) == []
+    assert MarkerMatcher(["alpha"]).find(b"") == []
+
+
+def test_lines_decodes_the_matched_lines():
+    lines = list(MarkerMatcher(["alpha", "beta"]).lines(LOG))
+    assert lines == [
+        ("first alpha\n", 0),
+        ("alpha and beta, alpha again\n", 0),
+        ("alpha and beta, alpha again\n", 1),
+        ("beta at the end", 1),
+    ]
+
+
+def test_lines_are_the_same_across_chunks(monkeypatch):
+    log = LOG * 50 + b"\n" + b"x" * 100 + b" alpha\n"
+    whole = list(MarkerMatcher(["alpha", "beta"]).lines(log))
+    # Smaller than some lines, so chunks have to stretch to a line's end
+    monkeypatch.setattr(matcher, "CHUNK_SIZE", 16)
+    assert list(MarkerMatcher(["alpha", "beta"]).lines(log)) == whole
@@ -0,0 +1,54 @@
+import numpy as np
+from pe.analysis.outage import Outage, biggest_outage, find_outages
+
+# An arbitrary start, so nothing depends on the series starting at the epoch
+BASE_NS = 1_700_000_000 * 1_000_000_000
+MS = 1_000_000
+
+
+def series(*spans: tuple[float, float, float]) -> np.ndarray:
+    """
+    Write times (epoch ns) for each (start s, end s, period ms) span
+    """
+    return np.concatenate([
+        BASE_NS + np.arange(int(start * 1000), int(end * 1000), period, dtype=np.int64) * MS
+        for start, end, period in spans
+    ])
+
+
+def at(seconds: float):
+    return np.datetime64(BASE_NS + int(seconds * 1000) * MS, "ns").astype("datetime64[us]").tolist()
+
+
+def test_steady_writes_have_no_outage():
+    assert find_outages(series((0, 10, 10))) == []
+    assert find_outages(series((0, 0.01, 10))) == []
+
+
+def test_a_gap_and_the_degraded_bins_around_it():
+    # Every 10ms, then a slower second on either side of a 3s gap
+    times = series((0, 4, 10), (4, 5, 25), (8, 9, 25), (9, 13, 10))
+    [outage] = find_outages(times)
+    assert outage.start == at(4.975)
+    assert outage.end == at(8)
+    assert abs(outage.duration - 3.025) < 1e-9
+    assert outage.degraded_start == at(4)
+    assert outage.degraded_end == at(9)
+    assert abs(outage.degraded_duration - 5) < 1e-9
+
+
+def test_every_gap_is_found_in_order():
+    times = series((0, 5, 10), (6, 10, 10), (12, 20, 10))
+    outages = find_outages(times, period=0.01)
+    assert [(o.start, o.end) for o in outages] == [(at(4.99), at(6)), (at(9.99), at(12))]
+    assert biggest_outage(outages) == outages[1]
+
+
+def test_datetimes_are_accepted():
+    times = series((0, 5, 10), (6, 10, 10))
+    assert find_outages(times.view("datetime64[ns]")) == find_outages(times)
+
+
+def test_round_trip():
+    [outage] = find_outages(series((0, 5, 10), (6, 10, 10)))
+    assert Outage.from_dict(outage.to_dict()) == outage
@@ -0,0 +1,57 @@
+from pe.log_scraper.rules import Rule, RuleState
+
+
+def rule(event: str, kind: str = "every", anchor=None) -> Rule:
+    return Rule(event=event, marker=event, readable=event, kind=kind, anchor=anchor)
+
+
+ANCHOR = rule("anchor")
+
+
+def run(rules: list[Rule], matches: list[str]) -> list[str]:
+    """
+    Steps a RuleState through matches of the named rules, then finishes it,
+    returning the events emitted. Each match's event is its rule and position
+    """
+    by_event = {r.event: r for r in rules}
+    state = RuleState(rules)
+    result = []
+    for ix, event in enumerate(matches):
+        result.extend(state.step(by_event[event], f"{event}{ix}"))
+    return result + state.finish()
+
+
+def test_every():
+    assert run([rule("a")], ["a", "a"]) == ["a0", "a1"]
+
+
+def test_after():
+    rules = [ANCHOR, rule("a", "after", "anchor")]
+    assert run(rules, ["a", "anchor", "a", "a"]) == ["anchor1", "a2", "a3"]
+
+
+def test_first_after():
+    rules = [ANCHOR, rule("a", "first_after", "anchor")]
+    assert run(rules, ["a", "anchor", "a", "a", "anchor", "a"]) == ["anchor1", "a2", "anchor4"]
+
+
+def test_last_before_is_released_with_its_anchor():
+    rules = [ANCHOR, rule("a", "last_before", "anchor")]
+    # Only the last one before the anchor, emitted ahead of it
+    assert run(rules, ["a", "a", "anchor", "a"]) == ["a1", "anchor2"]
+
+
+def test_last_before_without_its_anchor_comes_out_at_the_end():
+    rules = [ANCHOR, rule("a", "last_before", "anchor"), rule("b")]
+    assert run(rules, ["a", "b", "a"]) == ["b1", "a2"]
+
+
+def test_dedupe():
+    rules = [rule("a", "dedupe"), rule("b")]
+    assert run(rules, ["a", "a", "b", "a", "a"]) == ["a0", "b2", "a3"]
+
+
+def test_dedupe_only_counts_emitted_events():
+    rules = [ANCHOR, rule("a", "dedupe"), rule("b", "after", "anchor")]
+    # b isn't emitted before the anchor, so the second a is still a repeat
+    assert run(rules, ["a", "b", "a", "anchor", "a"]) == ["a0", "anchor3", "a4"]
@@ -0,0 +1,45 @@
+import numpy as np
+from pe.runner.sampler import RingBuffer
+
+FIELDS = ["time_ns", "value"]
+# Past what a float64 holds exactly
+TIME_NS = 1_700_000_000_123_456_789
+
+
+def test_before_it_wraps():
+    buffer = RingBuffer(FIELDS, capacity=4)
+    assert len(buffer.snapshot()) == 0
+    for ix in range(3):
+        buffer.append((ix, ix / 2))
+    assert buffer.snapshot()["time_ns"].tolist() == [0, 1, 2]
+    assert buffer.snapshot()["value"].tolist() == [0.0, 0.5, 1.0]
+
+
+def test_wraparound_keeps_the_newest_oldest_first():
+    buffer = RingBuffer(FIELDS, capacity=3)
+    for ix in range(8):
+        buffer.append((ix, float(ix)))
+    assert buffer.snapshot()["time_ns"].tolist() == [5, 6, 7]
+    # Exactly full, then one past
+    buffer = RingBuffer(FIELDS, capacity=3)
+    for ix in range(3):
+        buffer.append((ix, 0.0))
+    assert buffer.snapshot()["time_ns"].tolist() == [0, 1, 2]
+    buffer.append((3, 0.0))
+    assert buffer.snapshot()["time_ns"].tolist() == [1, 2, 3]
+
+
+def test_snapshot_is_a_copy():
+    buffer = RingBuffer(FIELDS, capacity=2)
+    buffer.append((1, 1.0))
+    snapshot = buffer.snapshot()
+    buffer.append((2, 2.0))
+    buffer.append((3, 3.0))
+    assert snapshot["time_ns"].tolist() == [1]
+
+
+def test_times_are_exact():
+    buffer = RingBuffer(FIELDS, capacity=2)
+    buffer.append((TIME_NS, 0.0))
+    assert buffer.snapshot()["time_ns"].dtype == np.int64
+    assert buffer.snapshot()["time_ns"][0] == TIME_NS
@@ -0,0 +1,57 @@
+import pytest
+from pe.data_generator.schedule import ScheduleLog, ScheduleReport
+
+# Binary fractions throughout, so the expected values are exact
+FREQ = 0.125
+
+
+def stalled_log() -> ScheduleLog:
+    """
+    Five writes on time, one stuck (and retried) across an outage, three
+    that queued up behind it, then back on schedule
+    """
+    log = ScheduleLog(FREQ)
+    for ix in range(5):
+        log.record(ix * FREQ, ix * FREQ, ix * FREQ + 1 / 64)
+    log.record(0.625, 2.0, 2.25)
+    for ix, intended in enumerate([0.75, 0.875, 1.0], start=1):
+        log.record(intended, 2.25, 2.25 + ix / 64)
+    log.record(2.5, 2.5, 2.5 + 1 / 64)
+    return log
+
+
+def test_report_measures_from_the_intended_send_time():
+    report = stalled_log().report()
+    assert report.corrected_downtime == 2.25 - 0.625
+    assert report.uncorrected_downtime == 2.25 - (0.5 + 1 / 64)
+
+
+def test_report_recovery_lasts_until_the_backlog_drains():
+    report = stalled_log().report()
+    # From the stuck write's ack to the first write sent on time again
+    assert report.recovery == (2.5 + 1 / 64) - 2.25
+    assert report.max_lag == 2.25 - 0.75
+    assert report.max_backlog == 12
+
+
+def test_report_on_schedule():
+    log = ScheduleLog(FREQ)
+    for ix in range(10):
+        log.record(ix * FREQ, ix * FREQ, ix * FREQ + 1 / 64)
+    report = log.report()
+    assert report.corrected_downtime == 1 / 64
+    assert report.recovery == 0
+    assert report.max_lag == 0
+    assert report.max_backlog == 0
+
+
+def test_report_needs_writes():
+    with pytest.raises(ValueError):
+        ScheduleLog(FREQ).report()
+
+
+def test_merge_takes_the_worst_of_each():
+    merged = ScheduleReport.merge(
+        [ScheduleReport(1.0, 0.5, 0.25, 2.0, 3), ScheduleReport(0.5, 1.5, 0.75, 1.0, 7)]
+    )
+    assert merged == ScheduleReport(1.0, 1.5, 0.75, 2.0, 7)
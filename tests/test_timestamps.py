@@ -0,0 +1,76 @@
+from datetime import datetime
+import numpy as np
+import pytest
+from pe.log_scraper.timestamps import haproxy_parser, patroni_parser, postgres_parser
+
+MALFORMED = [
+    "",
+    "not a timestamp at all",
+    "2023-06-20 10:11",
+    "2023-06-20 10:11:12,3",
+    "2023/06/20 10:11:12,345",
+    "2023-06-20 10:11:12:345",
+    "2023-06-20 10: 1:12,345",
+    "2023-06-20 10:11:+2,345",
+    "+023-06-20 10:11:12,345",
+    "2023-06-20 10:11:12, 45",
+    "2023-13-20 10:11:12,345",
+]
+
+
+def epoch_ns(stamp: datetime) -> int:
+    return int(np.datetime64(stamp, "ns").astype(np.int64))
+
+
+def test_parse():
+    assert patroni_parser().parse("2023-06-20 10:11:12,345 INFO: x") == datetime(
+        2023, 6, 20, 10, 11, 12, 345000
+    )
+    assert postgres_parser().parse("2023-06-20 10:11:12.345 UTC [1] LOG: x") == datetime(
+        2023, 6, 20, 10, 11, 12, 345000
+    )
+    assert haproxy_parser().parse("<1>2023-06-20T10:11:12.345678 proxy") == datetime(
+        2023, 6, 20, 10, 11, 12, 345678
+    )
+
+
+def test_parse_across_hours():
+    parser = patroni_parser()
+    lines = ["2023-06-20 10:59:59,999 a", "2023-06-20 11:00:00,000 b", "2023-06-20 10:59:58,000 c"]
+    assert [parser.parse(line) for line in lines] == [
+        datetime(2023, 6, 20, 10, 59, 59, 999000),
+        datetime(2023, 6, 20, 11),
+        datetime(2023, 6, 20, 10, 59, 58),
+    ]
+
+
+def test_parse_many_agrees_with_parse():
+    parser = patroni_parser()
+    lines = [
+        f"{day} {hour:02d}:{minute:02d}:{second:02d},{ms:03d} x"
+        for day in ["1969-12-31", "1970-01-01", "2000-02-29", "2023-06-20", "2100-03-01"]
+        for hour, minute, second, ms in [(0, 0, 0, 0), (23, 59, 59, 999), (12, 34, 56, 789)]
+    ]
+    expected = [epoch_ns(parser.parse(line)) for line in lines]
+    assert parser.parse_many(lines).tolist() == expected
+    assert parser.parse_many([line.encode() for line in lines]).tolist() == expected
+    assert parser.parse_many([]).tolist() == []
+
+
+def test_parse_many_with_an_offset():
+    parser = haproxy_parser()
+    line = "<1>2023-06-20T10:11:12.345678 proxy"
+    assert parser.parse_many([line]).tolist() == [epoch_ns(parser.parse(line))]
+
+
+@pytest.mark.parametrize("stamp", MALFORMED)
+def test_malformed_stamps_are_rejected(stamp):
+    parser = patroni_parser()
+    # With the date and hour cached, and without
+    parser.parse("2023-06-20 10:00:00,000 x")
+    with pytest.raises(ValueError):
+        parser.parse(stamp + " x")
+    with pytest.raises(ValueError):
+        patroni_parser().parse(stamp)
+    with pytest.raises(ValueError):
+        parser.parse_many(["2023-06-20 10:00:00,000 x", stamp])
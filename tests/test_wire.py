@@ -0,0 +1,36 @@
+import json
+import pytest
+from pe import wire
+from pe.config.parse import TopologyConfig
+
+
+def test_round_trip():
+    data = {"nodes": [1, 2], "name": "x"}
+    message = json.loads(json.dumps(wire.encode("results", data)))
+    assert wire.decode("results", message) == data
+
+
+def test_topology_round_trip():
+    topology = TopologyConfig("config/topology.local.yml")
+    message = json.loads(json.dumps(wire.encode("topology", topology.to_dict())))
+    assert TopologyConfig.from_dict(wire.decode("topology", message)).to_dict() == topology.to_dict()
+
+
+@pytest.mark.parametrize("version", [None, 0, wire.WIRE_VERSION + 1, str(wire.WIRE_VERSION)])
+def test_other_versions_are_rejected(version):
+    message = {**wire.encode("results", {}), "version": version}
+    with pytest.raises(ValueError, match="version"):
+        wire.decode("results", message)
+
+
+def test_other_kinds_are_rejected():
+    with pytest.raises(ValueError):
+        wire.decode("topology", wire.encode("results", {}))
+
+
+@pytest.mark.parametrize(
+    "message", [None, [], "data", {"version": wire.WIRE_VERSION, "kind": "results"}]
+)
+def test_non_envelopes_are_rejected(message):
+    with pytest.raises(ValueError):
+        wire.decode("results", message)